@@ -1,65 +1,199 @@
 import logging
 import traceback
-from pathlib import Path
-from decimal import Decimal
-from typing import cast, Optional
+from typing import AsyncGenerator, cast, Optional
 
-import boto3
 import dotenv
 import chainlit as cl
 import chainlit.data as cl_data
-from chainlit.data.dynamodb import DynamoDBDataLayer
 from chainlit.types import ThreadDict
+from chainlit.session import WebsocketSession
 from chainlit.logger import logger as cl_logger
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
 
 dotenv.load_dotenv()  # noqa: E402
 
 from src.config import config
+from src.data.session_store import create_session_state_store
+from src.data.save_jobs import SaveJobStore
 from src.handlers.save_handler import SaveHandler
 from src.handlers.search_handler import WebSearchHandler
 from src.handlers.image_file_handler import ImageFileLoadHandler
 from src.handlers.file_handler import FileLoadHandler
+from src.handlers.attachment_handler import AttachmentHandler
 from src.services.section_printer import SectionPrinterService
+from src.services.speculative_printer import SpeculativeSectionPrinter
+from src.services.cache_warmer import CacheWarmer
+from src.services.prompt_registry import prompt_registry
 from src.services.web_search import WebSearchService
 from src.services.prompt_cache import PromptCacheService
 from src.services.alps_cowriter import ALPSCowriterService
-from src.constant import COMMANDS, SECTIONS
-from src.utils.chainlit_patch import patch_chainlit_json
-from src.utils.session import create_latest_cache_point, load_cache_point_indices
+from src.constant import COMMANDS, SECTIONS, PromptFamily
+from src.utils.session import (
+    build_cached_history,
+    commit_session_state,
+    load_cache_point_indices,
+    load_prompt_cache_state,
+    load_session_state,
+    save_cache_point_indices,
+)
+from src.utils.thread_history import (
+    load_message_history,
+    persist_memory_snapshot,
+    restore_memory_snapshot,
+)
 from src.utils.memory import RecentMemoryManager
+from src.utils.context_budget import ContextAllocation, allocate_context_budget
+from src.utils.thread_queue import ThreadTurnQueue
+from src.utils.broadcast import ThreadBroadcaster
+from src.utils.token_counter import warmup_tokenizer
+from src.utils.token_estimator import token_estimator
+from src.utils.warmup import StartupWarmup
 from src.utils.logger import logger
 
 
-# Patch Chainlit JSON serialization to handle Decimal values
-patch_chainlit_json()
-
 # Initialize services and handlers
 alps_cowriter_service = ALPSCowriterService(config.llm_backend, config.model_id)
 section_printer_service = SectionPrinterService(config.llm_backend, config.model_id)
 prompt_cache_service = PromptCacheService(config.llm_backend)
 web_search_service = WebSearchService()
 
-file_handler = FileLoadHandler()
+file_handler = FileLoadHandler(config.context_encoding)
 image_file_handler = ImageFileLoadHandler()
+attachment_handler = AttachmentHandler(file_handler, image_file_handler)
 search_handler = WebSearchHandler(web_search_service)
-save_handler = SaveHandler(section_printer_service)
+save_handler = SaveHandler(
+    section_printer_service,
+    SaveJobStore(config.save_job_database_path),
+    config.save_parallelism,
+)
+
+# opt-in background rendering of the confirmed sections
+speculative_printer = (
+    SpeculativeSectionPrinter(
+        section_printer_service,
+        save_handler.section_groups,
+        config.speculative_save_token_budget,
+    )
+    if config.speculative_save
+    else None
+)
+
+# opt-in warming of the prompt cache between turns and before /save
+cache_warmer = (
+    CacheWarmer(
+        prompt_cache_service,
+        {
+            PromptFamily.COWRITER: (
+                alps_cowriter_service,
+                alps_cowriter_service.get_system_prompt_for_alps,
+            ),
+            PromptFamily.SECTION_PRINTER: (
+                section_printer_service,
+                section_printer_service.get_system_prompt,
+            ),
+        },
+        config.cache_warm_hourly_budget,
+    )
+    if config.cache_warming
+    else None
+)
+
+# conversation state shared by the workers, None keeps it in the user session only
+session_state_store = create_session_state_store(config.session_store_url)
+# turns of a conversation shared by several tabs or collaborators run in order
+thread_turn_queue = ThreadTurnQueue()
+# streamed responses are fanned out to the other viewers of the thread
+thread_broadcaster = ThreadBroadcaster()
+# cold-path resources are loaded in the background after startup
+startup_warmup = StartupWarmup(
+    {
+        "prompts": prompt_registry.compile,
+        "tokenizer": warmup_tokenizer,
+        "cowriter": alps_cowriter_service.warmup,
+        "section_printer": section_printer_service.warmup,
+    }
+)
 
 
 def init_history_persistent_layer():
     """Initialize the history persistent layer for the ChainLit defaults."""
-    if not config.history_table_name:
+    if config.history_table_name:
+        # boto3 is only needed for the DynamoDB history
+        import boto3
+        from src.data.dynamodb import BufferedDynamoDBDataLayer
+
+        # set history persistent db layer
+        session = boto3.Session(profile_name=config.aws_profile)
+        cl_data._data_layer = BufferedDynamoDBDataLayer(
+            table_name=config.history_table_name,
+            client=session.client(
+                "dynamodb",
+                region_name=config.aws_default_region,
+                endpoint_url=config.dynamodb_endpoint_url,
+            ),
+        )
+        cl_logger.getChild("DynamoDB").setLevel(logging.INFO)
+    elif config.history_database_path:
+        from src.data.sqlite import SQLiteDataLayer
+
+        # single node and on-prem deployments keep the history in a local SQLite database
+        cl_data._data_layer = SQLiteDataLayer(config.history_database_path)
+    else:
         logger.warning(
-            "HISTORY_TABLE_NAME is not set, skipping history persistent layer initialization"
+            "Neither HISTORY_TABLE_NAME nor HISTORY_DATABASE_PATH is set, skipping history persistent layer initialization"
         )
-        return
 
-    # set history persistent db layer
-    session = boto3.Session(profile_name=config.aws_profile)
-    cl_data._data_layer = DynamoDBDataLayer(
-        table_name=config.history_table_name,
-        client=session.client("dynamodb", region_name=config.aws_default_region),
+
+def init_speculative_printer():
+    """Initialize the speculative render state of the session."""
+    if speculative_printer:
+        cl.user_session.set(
+            "prerender_state",
+            speculative_printer.create_state(config.speculative_save_locale),
+        )
+
+
+async def readiness(request: Request) -> JSONResponse:
+    """Readiness probe, 503 until the startup warmup finished."""
+    ready = startup_warmup.ready.is_set()
+    return JSONResponse(
+        {"ready": ready, "warmup": startup_warmup.status},
+        status_code=200 if ready else 503,
     )
-    cl_logger.getChild("DynamoDB").setLevel(logging.INFO)
+
+
+@cl.on_app_startup
+def on_app_startup():
+    startup_warmup.start()
+    # Chainlit serves the UI on every unknown path, so the probe goes in front of it
+    from chainlit.server import app as server_app
+
+    server_app.router.routes.insert(0, Route("/ready", readiness, methods=["GET"]))
+
+
+@cl.on_app_shutdown
+def on_app_shutdown():
+    # keep the calibration learned since the last periodic write
+    token_estimator.save()
+
+
+async def flush_history_persistent_layer():
+    """Flush the buffered chat history of the current thread."""
+    data_layer = cl_data.get_data_layer()
+    thread_id = cl.context.session.thread_id
+    # only the buffered DynamoDB layer defers its writes
+    if not hasattr(data_layer, "flush") or not thread_id:
+        return
+
+    try:
+        await data_layer.flush(thread_id)
+    except Exception:
+        logger.error(
+            "Error flushing chat history",
+            traceback=traceback.format_exc(),
+        )
 
 
 if not config.disable_oauth:
@@ -69,50 +203,35 @@ if not config.disable_oauth:
     async def on_chat_resume(thread: ThreadDict):
         logger.info("Chat resumed", thread_id=thread["id"])
         await cl.context.emitter.set_commands(COMMANDS)
+        thread_broadcaster.subscribe(
+            thread["id"], cl.context.session.id, cl.context.emitter
+        )
+        # documents saved while the user was away
+        await save_handler.deliver_finished_jobs(thread["id"])
+        init_speculative_printer()
 
-        # Function to recursively convert Decimal to float in a dictionary
-        def convert_decimal_in_dict(obj):
-            if isinstance(obj, dict):
-                return {k: convert_decimal_in_dict(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_decimal_in_dict(item) for item in obj]
-            elif isinstance(obj, Decimal):
-                return float(obj)
-            else:
-                return obj
+        # restore the memory and cache points from the shared session state
+        if await load_session_state(cl.user_session, session_state_store, thread["id"]):
+            await cl.context.emitter.send_toast("Chat Resumed", "success")
+            return
 
-        # Convert any Decimal values in the thread dictionary
-        thread = convert_decimal_in_dict(thread)
+        # restore the memory and cache points from the snapshot in one read
+        restored = restore_memory_snapshot(thread)
+        if restored:
+            recent_memory, cache_point_indices = restored
+            cl.user_session.set("recent_memory", recent_memory)
+            save_cache_point_indices(cl.user_session, cache_point_indices)
+            logger.info(
+                "Restored memory snapshot",
+                count=len(recent_memory.get_conversation_history()),
+                cache_point_indices=cache_point_indices,
+            )
+            await commit_session_state(cl.user_session, session_state_store, thread["id"])
+            await cl.context.emitter.send_toast("Chat Resumed", "success")
+            return
 
         # restore the message history from the thread
-        message_history = []
-        for message in (m for m in thread["steps"]):
-            # skip messages with exclude_from_history metadata
-            if message["metadata"].get("exclude_from_history", False):
-                continue
-
-            # skip empty messages
-            if message["output"] == "":
-                continue
-
-            # skip error messages
-            if message["isError"]:
-                logger.debug("Skipping error message", message=message)
-                continue
-
-            if message["type"] == "user_message":
-                message_history.append({"role": "user", "content": message["output"]})
-            elif message["type"] == "assistant_message":
-                message_history.append(
-                    {"role": "assistant", "content": message["output"]}
-                )
-            else:
-                logger.debug(
-                    "Skipping message with unknown type",
-                    message_type=message["type"],
-                    output=message["output"][:50],
-                )
-                continue
+        message_history = load_message_history(thread)
         logger.info("Restored message history", count=len(message_history))
 
         # Initialize and restore the memory managers
@@ -120,9 +239,10 @@ if not config.disable_oauth:
         recent_memory.add_message_history(message_history)
         cl.user_session.set("recent_memory", recent_memory)
 
-        # create cache point at the end of the message history
+        # cache points are planned with the next request
         cl.user_session.set("cache_point_indices", [])
-        create_latest_cache_point(cl.user_session, prompt_cache_service)
+        await persist_memory_snapshot(cl.user_session)
+        await commit_session_state(cl.user_session, session_state_store, thread["id"])
 
         await cl.context.emitter.send_toast("Chat Resumed", "success")
 
@@ -176,12 +296,95 @@ Hello! I'm ALPS Writer. I can help you write a technical specification for your
     recent_memory = RecentMemoryManager()
     cl.user_session.set("recent_memory", recent_memory)
     cl.user_session.set("cache_point_indices", [])
+    init_speculative_printer()
+    thread_broadcaster.subscribe(
+        cl.context.session.thread_id, cl.context.session.id, cl.context.emitter
+    )
 
     logger.info("New chat started")
 
 
+@cl.on_stop
+async def stop():
+    # the user stopped the turn, Chainlit cancels the message task, the save job runs detached
+    save_handler.cancel_job(cl.context.session.thread_id)
+
+
+@cl.on_chat_end
+async def end():
+    # a disconnected user cannot receive the response, stop streaming it
+    current_task = cl.context.session.current_task
+    if current_task and not current_task.done():
+        current_task.cancel()
+    thread_broadcaster.unsubscribe(cl.context.session.thread_id, cl.context.session.id)
+    prerender_state = cl.user_session.get("prerender_state")
+    if speculative_printer and prerender_state:
+        speculative_printer.cancel(prerender_state)
+    if cache_warmer:
+        cache_warmer.cancel(cl.context.session.id)
+    await flush_history_persistent_layer()
+
+
+async def notify_queued(ahead: int):
+    await cl.context.emitter.send_toast(
+        f"Waiting for {ahead} earlier message(s) in this conversation", "info"
+    )
+
+
 @cl.on_message
+async def on_message(message: cl.Message):
+    try:
+        async with thread_turn_queue.turn(message.thread_id, notify_queued):
+            await main(message)
+    finally:
+        # the turn is durable once the message is complete
+        await flush_history_persistent_layer()
+
+
+async def stream_message(msg: cl.Message, chunks: AsyncGenerator[str, None]) -> None:
+    """Stream the response into the message and fan out the tokens to the other viewers."""
+    thread_id = cl.context.session.thread_id
+    session_id = cl.context.session.id
+    try:
+        async for chunk in chunks:
+            if chunk:
+                await msg.stream_token(chunk)
+                thread_broadcaster.publish_token(thread_id, msg, chunk, exclude=session_id)
+        await msg.send()
+    finally:
+        # aborts the model request when the user stops or leaves
+        await chunks.aclose()
+        # ends the stream for the viewers even if the response failed
+        if msg.content:
+            thread_broadcaster.publish_step(thread_id, msg.to_dict(), exclude=session_id)
+
+
+async def notify_context_budget(allocation: ContextAllocation) -> bool:
+    """Tell the user what was left out of the request, False if it cannot be sent at all."""
+    if not allocation.fits:
+        await cl.Message(
+            content="The message is too long for the model. Please shorten it and send it again.",
+            metadata={"exclude_from_history": True},
+        ).send()
+        return False
+    if allocation.trimmed:
+        await cl.context.emitter.send_toast(
+            f"Left out to fit the context window: {', '.join(allocation.trimmed)}.", "warning"
+        )
+    return True
+
+
 async def main(message: cl.Message):
+    # pick up the turns handled by the other workers
+    thread_id = cl.context.session.thread_id
+    await load_session_state(cl.user_session, session_state_store, thread_id)
+    thread_broadcaster.publish_step(
+        thread_id, message.to_dict(), exclude=cl.context.session.id
+    )
+    # the turn reads or writes the prompt cache itself
+    if cache_warmer:
+        cache_warmer.cancel(cl.context.session.id)
+
     search_result = None
     # Process commands
     if message.command == "search":
@@ -203,68 +406,73 @@ async def main(message: cl.Message):
             ).send()
             return
 
-        # Create a cache point at the end of the message history before saving
-        create_latest_cache_point(cl.user_session, prompt_cache_service)
-
-        # Add cache points to history
-        cache_point_indices = load_cache_point_indices(cl.user_session)
-        cached_recent_history = prompt_cache_service.add_cache_points_to_messages(
-            cache_point_indices,
-            recent_history,
+        # sections rendered ahead of time in the requested locale
+        locale = save_handler.get_locale(message)
+        prerendered = {}
+        prerender_state = cl.user_session.get("prerender_state")
+        if speculative_printer and prerender_state:
+            prerendered = speculative_printer.take_rendered(prerender_state, locale)
+            speculative_printer.switch_locale(prerender_state, locale)
+
+        # every remaining section group reads the same history
+        section_groups = save_handler.plan_section_groups(recent_history, prerendered)
+        remaining_groups = len(section_groups) - len(prerendered)
+        cached_recent_history, plan = build_cached_history(
+            cl.user_session,
+            prompt_cache_service,
+            PromptFamily.SECTION_PRINTER,
+            upcoming_calls=remaining_groups,
         )
-        logger.info(
-            "cache_point_indices for save command",
-            cache_point_indices=cache_point_indices,
+        history_warmed = False
+        if cache_warmer and plan:
+            history_warmed = await cache_warmer.warm_before_save(
+                recent_memory, plan, min(save_handler.parallelism, remaining_groups)
+            )
+        await save_handler.handle_save_command(
+            message,
+            cached_recent_history,
+            prerendered,
+            section_groups,
+            staggered=not history_warmed,
         )
-        await save_handler.handle_save_command(message, cached_recent_history)
         return
 
     # Process file uploads
     text_context = None
-    image_context = None
+    image_contexts = []
     elements = message.elements
     if elements:
-        # Process only the first file
-        element = elements[0]
-        text_file_ext = [".json", ".md", ".pdf"]
-        image_file_ext = [".jpg", ".jpeg", ".png", ".gif", ".webp"]
-        available_file_extensions = text_file_ext + image_file_ext
-        if element.path:
-            if Path(element.path).suffix.lower() not in available_file_extensions:
-                await cl.Message(
-                    content=f"file format is not supported.\n**supported file formats:** {available_file_extensions}"
-                ).send()
-                return
-
-            if Path(element.path).suffix.lower() in text_file_ext:
-                text_context = await file_handler.handle(element)
-            elif Path(element.path).suffix.lower() in image_file_ext:
-                image_context = await image_file_handler.handle(element)
-
-    # Get memory managers from user session
-    recent_memory = cast(
-        RecentMemoryManager,
-        cl.user_session.get("recent_memory"),
-    )
+        error_message = attachment_handler.validate(elements)
+        if error_message:
+            await cl.Message(content=error_message).send()
+            return
+
+        text_context, image_contexts = await attachment_handler.handle(elements)
 
     # Process general messages
     user_message_content = message.content
 
-    cache_point_indices = load_cache_point_indices(cl.user_session)
     msg = cl.Message(content="")
     if search_result:
+        allocation = allocate_context_budget(
+            alps_cowriter_service.get_system_prompt_for_web_qa(),
+            user_message_content,
+            web_result=search_result,
+        )
+        if not await notify_context_budget(allocation):
+            return
         messages = alps_cowriter_service.build_web_search_messages(
             query=user_message_content,
-            web_result=search_result,
+            web_result=allocation.web_result,
         )
         try:
-            async for chunk in alps_cowriter_service.stream_llm_response(
-                messages,
-                system_prompt=alps_cowriter_service.get_system_prompt_for_web_qa(),
-            ):
-                if chunk:
-                    await msg.stream_token(chunk)
-            await msg.send()
+            await stream_message(
+                msg,
+                alps_cowriter_service.stream_llm_response(
+                    messages,
+                    system_prompt=alps_cowriter_service.get_system_prompt_for_web_qa(),
+                ),
+            )
         except Exception as e:
             logger.error(
                 "Error streaming LLM response",
@@ -275,29 +483,42 @@ async def main(message: cl.Message):
             )
             return
     else:
-        # Get recent conversation history from recent memory
-        recent_history = recent_memory.get_conversation_history()
-
-        # Add cache points to history
-        cached_recent_history = prompt_cache_service.add_cache_points_to_messages(
-            cache_point_indices,
-            recent_history,
+        # fit the request to the context window before its cache points are planned
+        allocation = allocate_context_budget(
+            alps_cowriter_service.get_system_prompt_for_alps(),
+            user_message_content,
+            cast(RecentMemoryManager, cl.user_session.get("recent_memory")).get_token_counts(),
+            text_context=text_context,
+            image_count=len(image_contexts),
+        )
+        if not await notify_context_budget(allocation):
+            return
+        # Get recent conversation history with the cache points planned for this turn
+        cached_recent_history, plan = build_cached_history(
+            cl.user_session,
+            prompt_cache_service,
+            PromptFamily.COWRITER,
+            history_start=allocation.history_start,
         )
+        if cache_warmer and plan:
+            cache_warmer.credit(
+                load_prompt_cache_state(cl.user_session), PromptFamily.COWRITER, plan
+            )
         # Build messages for ALPS writer
         messages = alps_cowriter_service.build_alps_messages(
             message_content=user_message_content,
             recent_history=cached_recent_history,
-            text_context=text_context,
-            image_context=image_context,
+            text_context=allocation.text_context,
+            image_contexts=image_contexts[: allocation.image_count],
         )
         try:
-            async for chunk in alps_cowriter_service.stream_llm_response(
-                messages,
-                system_prompt=alps_cowriter_service.get_system_prompt_for_alps(),
-            ):
-                if chunk:
-                    await msg.stream_token(chunk)
-            await msg.send()
+            await stream_message(
+                msg,
+                alps_cowriter_service.stream_llm_response(
+                    messages,
+                    system_prompt=alps_cowriter_service.get_system_prompt_for_alps(),
+                ),
+            )
         except Exception as e:
             logger.error(
                 "Error streaming LLM response",
@@ -308,8 +529,40 @@ async def main(message: cl.Message):
             )
             return
 
-    # add AI response to memory systems
-    recent_memory.add_ai_message(user_message_content, msg.content)
-    cl.user_session.set("recent_memory", recent_memory)
-    # update cache points
-    create_latest_cache_point(cl.user_session, prompt_cache_service)
+    def add_turn(user_session):
+        # add AI response to memory systems
+        recent_memory = cast(RecentMemoryManager, user_session.get("recent_memory"))
+        recent_memory.add_ai_message(
+            user_message_content, msg.content, message_ids=(message.id, msg.id)
+        )
+        user_session.set("recent_memory", recent_memory)
+
+    await commit_session_state(
+        cl.user_session, session_state_store, thread_id, add_turn
+    )
+    # persist the memory snapshot for fast resume
+    await persist_memory_snapshot(cl.user_session)
+
+    # keep the prompt cache warm while the user writes the next message
+    if cache_warmer:
+        session_id = cl.context.session.id
+        cache_warmer.schedule(
+            session_id,
+            load_prompt_cache_state(cl.user_session),
+            cast(RecentMemoryManager, cl.user_session.get("recent_memory")),
+            lambda: WebsocketSession.get_by_id(session_id) is not None,
+        )
+
+    # render the sections confirmed by this turn while the user is idle
+    prerender_state = cl.user_session.get("prerender_state")
+    if speculative_printer and prerender_state:
+        speculative_printer.on_assistant_message(
+            prerender_state,
+            prompt_cache_service.add_cache_points_to_messages(
+                load_cache_point_indices(cl.user_session),
+                cast(
+                    RecentMemoryManager, cl.user_session.get("recent_memory")
+                ).get_conversation_history(),
+            ),
+            msg.content,
+        )
@@ -0,0 +1,317 @@
+"""
+Replay chat sessions against a simulated prompt cache and compare the cache point policies.
+
+Usage:
+    uv run -- python -m benchmarks.cache_planner [--history-db ./history.db] [--sessions 200] [--seed 7]
+
+Sessions are read from a SQLite history database when --history-db is given,
+otherwise synthetic sessions with mixed quick and idle turns and /save commands are generated.
+
+- threshold: the former policy, a cache point at the end of the history once 2000 tokens
+  built up since the last one, keeping the last three
+- planner: PromptCacheService.plan_cache_points, the cost model driven placement
+
+Costs are in uncached input tokens of the history, cache writes cost 1.25 and reads 0.1.
+The system prompt is cached the same way by both policies and left out.
+"""
+import json
+import random
+import sqlite3
+import logging
+import argparse
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import dotenv
+import structlog
+
+dotenv.load_dotenv()
+
+from src.constant import (
+    PROMPT_CACHE_READ_PRICE,
+    PROMPT_CACHE_TTL,
+    PROMPT_CACHE_WRITE_PRICE,
+    LLMBackend,
+    PromptFamily,
+)
+from src.services.prompt_cache import PromptCacheService, PromptCacheState
+from src.utils.token_counter import count_tokens
+
+# the provider finds a cached prefix only within this many blocks before a cache point
+LOOKBACK_BLOCKS = 20
+# seconds between the section groups of a /save
+SAVE_CALL_INTERVAL = 40.0
+MIN_TOKENS_FOR_CACHE = 2000
+SAVE_CALLS = 3
+
+
+@dataclass
+class Event:
+    """A chat turn, or a /save command, at a point of the session."""
+
+    at: float
+    kind: str  # "chat" or "save"
+    user_tokens: int = 0
+    assistant_tokens: int = 0
+
+
+@dataclass
+class Cost:
+    total: float = 0.0
+    read_tokens: int = 0
+    write_tokens: int = 0
+    requests: int = 0
+
+
+@dataclass
+class SimulatedCache:
+    """Prompt cache of the provider, prefixes by family and last history index."""
+
+    entries: Dict[str, Dict[int, float]] = field(default_factory=dict)
+
+    def request(
+        self,
+        family: PromptFamily,
+        prefix_tokens: List[int],
+        cache_point_indices: List[int],
+        tail_tokens: int,
+        now: float,
+        cost: Cost,
+    ) -> None:
+        entries = {
+            index: expires_at
+            for index, expires_at in self.entries.get(family.value, {}).items()
+            if expires_at > now
+        }
+        last_point = max(cache_point_indices) if cache_point_indices else -1
+        hits = [
+            index
+            for index in entries
+            if index <= last_point
+            and any(index <= point <= index + LOOKBACK_BLOCKS for point in cache_point_indices)
+        ]
+        read_index = max(hits) if hits else -1
+        read_tokens = prefix_tokens[read_index + 1]
+        write_tokens = prefix_tokens[last_point + 1] - read_tokens
+        total_tokens = prefix_tokens[-1] + tail_tokens
+
+        cost.total += (
+            PROMPT_CACHE_READ_PRICE * read_tokens
+            + PROMPT_CACHE_WRITE_PRICE * write_tokens
+            + (total_tokens - read_tokens - write_tokens)
+        )
+        cost.read_tokens += read_tokens
+        cost.write_tokens += write_tokens
+        cost.requests += 1
+
+        if read_index >= 0:
+            entries[read_index] = now + PROMPT_CACHE_TTL
+        for point in cache_point_indices:
+            if point > read_index:
+                entries[point] = now + PROMPT_CACHE_TTL
+        self.entries[family.value] = entries
+
+
+def prefix_sums(token_counts: List[int]) -> List[int]:
+    sums = [0]
+    for token_count in token_counts:
+        sums.append(sums[-1] + token_count)
+    return sums
+
+
+def replay_threshold(events: List[Event]) -> Cost:
+    cost, cache = Cost(), SimulatedCache()
+    token_counts: List[int] = []
+    cache_point_indices: List[int] = []
+
+    def update_cache_points() -> None:
+        nonlocal cache_point_indices
+        last = cache_point_indices[-1] if cache_point_indices else 0
+        if token_counts and sum(token_counts[last:]) >= MIN_TOKENS_FOR_CACHE:
+            cache_point_indices = [*cache_point_indices, len(token_counts) - 1][-3:]
+
+    for event in events:
+        if event.kind == "save":
+            if not token_counts:
+                continue
+            update_cache_points()
+            for call in range(SAVE_CALLS):
+                cache.request(
+                    PromptFamily.SECTION_PRINTER,
+                    prefix_sums(token_counts),
+                    cache_point_indices,
+                    30,
+                    event.at + call * SAVE_CALL_INTERVAL,
+                    cost,
+                )
+            continue
+
+        cache.request(
+            PromptFamily.COWRITER,
+            prefix_sums(token_counts),
+            cache_point_indices,
+            event.user_tokens,
+            event.at,
+            cost,
+        )
+        token_counts += [event.user_tokens, event.assistant_tokens]
+        update_cache_points()
+    return cost
+
+
+def replay_planner(events: List[Event], service: PromptCacheService) -> Cost:
+    cost, cache = Cost(), SimulatedCache()
+    state = PromptCacheState()
+    token_counts: List[int] = []
+    anchors: List[int] = []
+
+    for event in events:
+        if event.kind == "save":
+            if not token_counts:
+                continue
+            plan = service.plan_cache_points(
+                state, PromptFamily.SECTION_PRINTER, token_counts,
+                upcoming_calls=SAVE_CALLS, now=event.at,
+            )
+            service.record_request(state, PromptFamily.SECTION_PRINTER, plan, now=event.at)
+            for call in range(SAVE_CALLS):
+                cache.request(
+                    PromptFamily.SECTION_PRINTER,
+                    prefix_sums(token_counts),
+                    plan.cache_point_indices,
+                    30,
+                    event.at + call * SAVE_CALL_INTERVAL,
+                    cost,
+                )
+            continue
+
+        plan = service.plan_cache_points(
+            state, PromptFamily.COWRITER, token_counts, anchors=anchors, now=event.at
+        )
+        service.record_request(state, PromptFamily.COWRITER, plan, now=event.at)
+        anchors = plan.cache_point_indices
+        cache.request(
+            PromptFamily.COWRITER,
+            prefix_sums(token_counts),
+            plan.cache_point_indices,
+            event.user_tokens,
+            event.at,
+            cost,
+        )
+        token_counts += [event.user_tokens, event.assistant_tokens]
+    return cost
+
+
+def synthetic_sessions(count: int, rng: random.Random) -> List[List[Event]]:
+    sessions = []
+    for _ in range(count):
+        # some users answer right away, others come back after a break most of the time
+        quick_ratio = rng.choice([0.9, 0.7, 0.4])
+        now, events = 0.0, []
+        for turn in range(rng.randint(6, 40)):
+            if turn:
+                if rng.random() < quick_ratio:
+                    now += rng.lognormvariate(4.0, 0.6)  # about a minute
+                else:
+                    now += rng.lognormvariate(7.0, 0.8)  # about twenty minutes
+            events.append(
+                Event(
+                    at=now,
+                    kind="chat",
+                    user_tokens=int(rng.lognormvariate(4.5, 0.9)),
+                    assistant_tokens=int(rng.lognormvariate(6.6, 0.5)),
+                )
+            )
+            if turn > 4 and rng.random() < 0.08:
+                now += rng.lognormvariate(3.0, 0.5)
+                events.append(Event(at=now, kind="save"))
+        sessions.append(events)
+    return sessions
+
+
+def recorded_sessions(history_db: str) -> List[List[Event]]:
+    """Read the chat turns and /save commands of every thread of a SQLite history database."""
+    from datetime import datetime
+
+    connection = sqlite3.connect(history_db)
+    rows = connection.execute(
+        "SELECT thread_id, data FROM steps ORDER BY thread_id, created_at"
+    ).fetchall()
+    connection.close()
+
+    threads: Dict[str, List[dict]] = {}
+    for thread_id, data in rows:
+        threads.setdefault(thread_id, []).append(json.loads(data))
+
+    sessions = []
+    for steps in threads.values():
+        events: List[Event] = []
+        pending: Optional[Tuple[float, int]] = None
+        for step in steps:
+            created_at = step.get("createdAt")
+            if not created_at:
+                continue
+            at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp()
+            output = step.get("output") or ""
+            if step.get("type") == "user_message":
+                if step.get("command") == "save":
+                    events.append(Event(at=at, kind="save"))
+                elif not (step.get("metadata") or {}).get("exclude_from_history"):
+                    pending = (at, count_tokens(output))
+            elif step.get("type") == "assistant_message" and pending:
+                if (step.get("metadata") or {}).get("exclude_from_history"):
+                    continue
+                events.append(
+                    Event(
+                        at=pending[0],
+                        kind="chat",
+                        user_tokens=pending[1],
+                        assistant_tokens=count_tokens(output),
+                    )
+                )
+                pending = None
+        if events:
+            sessions.append(events)
+    return sessions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history-db", default="")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.history_db:
+        sessions = recorded_sessions(args.history_db)
+        source = args.history_db
+    else:
+        sessions = synthetic_sessions(args.sessions, random.Random(args.seed))
+        source = "synthetic"
+
+    # the planner logs every decision, keep the replay output readable
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    service = PromptCacheService(LLMBackend.AWS)
+    results = {"threshold": Cost(), "planner": Cost()}
+    for events in sessions:
+        for name, cost in (
+            ("threshold", replay_threshold(events)),
+            ("planner", replay_planner(events, service)),
+        ):
+            results[name].total += cost.total
+            results[name].read_tokens += cost.read_tokens
+            results[name].write_tokens += cost.write_tokens
+            results[name].requests += cost.requests
+
+    print(f"source={source} sessions={len(sessions)} requests={results['planner'].requests}")
+    baseline = results["threshold"].total
+    for name, cost in results.items():
+        print(
+            f"{name:10} cost={cost.total:12.0f} read_tokens={cost.read_tokens:10d} "
+            f"write_tokens={cost.write_tokens:10d} vs_threshold={(cost.total / baseline - 1) * 100:+6.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Compare the process-wide Decimal JSON patch with the Decimal normalization at the DynamoDB boundary.
+
+Usage:
+    uv run -- python -m benchmarks.decimal_normalization [--steps 300] [--number 200]
+
+- emit: json.dumps of a socket emit payload, through the patched json.dumps (before) and the plain one (after)
+- resume: deserializing the items of a thread and normalizing the Decimals,
+  TypeDeserializer + recursive conversions (before) and NativeNumberDeserializer (after)
+"""
+import json
+import timeit
+import argparse
+from decimal import Decimal
+from typing import Any, Dict, List
+
+import dotenv
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+dotenv.load_dotenv()
+
+from src.data.dynamodb import NativeNumberDeserializer
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super(DecimalEncoder, self).default(obj)
+
+
+def patched_dumps(obj: Any, *args: Any, **kwargs: Any) -> str:
+    """The removed process-wide json.dumps patch."""
+    if "cls" not in kwargs:
+        kwargs["cls"] = DecimalEncoder
+    return json.dumps(obj, *args, **kwargs)
+
+
+def convert_decimals(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    elif isinstance(obj, dict):
+        return {k: convert_decimals(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_decimals(v) for v in obj]
+    return obj
+
+
+def build_items(steps: int) -> List[Dict[str, Any]]:
+    serializer = TypeSerializer()
+    items = []
+    for i in range(steps):
+        step = {
+            "PK": "THREAD#benchmark",
+            "SK": f"STEP#{i}",
+            "id": str(i),
+            "type": "assistant_message" if i % 2 else "user_message",
+            "output": "lorem ipsum " * 100,
+            "metadata": {"exclude_from_history": False, "tokens": Decimal(i)},
+            "generation": {"usage": {"inputTokens": Decimal(1200), "outputTokens": Decimal(800)}},
+            "createdAt": f"2025-01-01T00:00:{i % 60:02d}Z",
+        }
+        items.append({k: serializer.serialize(v) for k, v in step.items()})
+    return items
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    items = build_items(args.steps)
+    before_deserializer = TypeDeserializer()
+    after_deserializer = NativeNumberDeserializer()
+
+    def resume_before():
+        steps = [
+            convert_decimals({k: before_deserializer.deserialize(v) for k, v in item.items()})
+            for item in items
+        ]
+        return convert_decimals({"steps": steps})
+
+    def resume_after():
+        return {
+            "steps": [
+                {k: after_deserializer.deserialize(v) for k, v in item.items()}
+                for item in items
+            ]
+        }
+
+    payload = resume_after()["steps"][1]
+    results = {
+        "emit before": timeit.timeit(lambda: patched_dumps(payload), number=args.number * 100),
+        "emit after": timeit.timeit(lambda: json.dumps(payload), number=args.number * 100),
+        "resume before": timeit.timeit(resume_before, number=args.number),
+        "resume after": timeit.timeit(resume_after, number=args.number),
+    }
+    print(f"emit:   {args.number * 100 / results['emit before']:10.0f} -> {args.number * 100 / results['emit after']:10.0f} payloads/s")
+    print(f"resume: {args.number / results['resume before']:10.1f} -> {args.number / results['resume after']:10.1f} threads/s ({args.steps} steps)")
+
+
+if __name__ == "__main__":
+    main()
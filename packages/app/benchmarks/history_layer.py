@@ -0,0 +1,104 @@
+"""
+Compare the SQLite and DynamoDB history layers on thread listing and resume reads.
+
+Usage:
+    uv run -- python -m benchmarks.history_layer [--threads 50] [--steps 300]
+
+The DynamoDB layer is benchmarked only when HISTORY_TABLE_NAME is set,
+point DYNAMODB_ENDPOINT_URL at DynamoDB Local to run it without AWS.
+"""
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+import boto3
+import dotenv
+from chainlit.context import init_http_context
+from chainlit.data.base import BaseDataLayer
+from chainlit.types import Pagination, ThreadFilter
+from chainlit.user import User
+
+dotenv.load_dotenv()
+
+from src.config import config
+from src.data.dynamodb import BufferedDynamoDBDataLayer
+from src.data.sqlite import SQLiteDataLayer
+
+
+async def measure(fn: Callable[[], Awaitable], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def seed(data_layer: BaseDataLayer, threads: int, steps: int) -> tuple[str, str]:
+    user = await data_layer.create_user(User(identifier="benchmark@example.com"))
+    for t in range(threads):
+        thread_id = f"benchmark-thread-{t}"
+        await data_layer.update_thread(thread_id, name=f"Thread {t}", user_id=user.id)
+        # only the last thread is a long one, the others are listed only
+        for s in range(steps if t == threads - 1 else 2):
+            await data_layer.create_step(
+                {
+                    "id": f"{thread_id}-step-{s}",
+                    "threadId": thread_id,
+                    "type": "user_message" if s % 2 == 0 else "assistant_message",
+                    "name": "benchmark",
+                    "output": "lorem ipsum " * 200,
+                    "metadata": {},
+                    "createdAt": f"2025-01-01T00:{s // 60:02d}:{s % 60:02d}Z",
+                }
+            )
+    if isinstance(data_layer, BufferedDynamoDBDataLayer):
+        await data_layer.flush()
+    return user.id, f"benchmark-thread-{threads - 1}"
+
+
+async def run(name: str, data_layer: BaseDataLayer, args: argparse.Namespace) -> None:
+    user_id, thread_id = await seed(data_layer, args.threads, args.steps)
+
+    list_timings = await measure(
+        lambda: data_layer.list_threads(Pagination(first=20), ThreadFilter(userId=user_id)),
+        args.repeat,
+    )
+    resume_timings = await measure(lambda: data_layer.get_thread(thread_id), args.repeat)
+
+    for label, timings in (("list_threads", list_timings), ("get_thread", resume_timings)):
+        print(
+            f"{name:10} {label:14} median={statistics.median(timings):8.2f}ms "
+            f"p95={sorted(timings)[int(len(timings) * 0.95) - 1]:8.2f}ms"
+        )
+    await data_layer.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    init_http_context()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        await run("sqlite", SQLiteDataLayer(str(Path(tmp_dir) / "history.db")), args)
+
+    if config.history_table_name:
+        session = boto3.Session(profile_name=config.aws_profile)
+        client = session.client(
+            "dynamodb",
+            region_name=config.aws_default_region,
+            endpoint_url=config.dynamodb_endpoint_url,
+        )
+        await run("dynamodb", BufferedDynamoDBDataLayer(config.history_table_name, client), args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
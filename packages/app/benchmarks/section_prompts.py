@@ -0,0 +1,193 @@
+"""
+Compare the section printer requests of a /save with the full and the sliced ALPS template.
+
+Usage:
+    uv run -- python -m benchmarks.section_prompts [--turns 30] [--seed 7] [--live] [--repeat 3]
+
+- full: the former layout, the whole template in the system prompt of every group
+- sliced: the shared system prompt, and the template of the group's sections after the history
+- per_group: the template of the group's sections in the system prompt, so each group caches its own history
+
+Input tokens are counted for every group of a /save, and priced like the cache planner does
+with the system prompt and the history cached by the first group and read by the others.
+With --live the requests are sent to the configured model and the time to first token is measured,
+the layouts take turns so both run against a warm prompt cache.
+"""
+import time
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+from typing import Callable, Dict, List, Tuple
+
+import dotenv
+import structlog
+
+dotenv.load_dotenv()
+
+from src.config import config
+from src.constant import PROMPT_CACHE_READ_PRICE, PROMPT_CACHE_WRITE_PRICE, PromptFamily
+from src.prompts.section_printer import SYSTEM_PROMPT
+from src.services.prompt_cache import PromptCacheService
+from src.services.prompt_registry import prompt_registry
+from src.services.section_printer import SectionPrinterService
+from src.utils.context import load_alps_context
+from src.utils.token_counter import count_tokens
+
+SECTION_GROUPS: List[Tuple[str, ...]] = [
+    ("Section 1", "Section 2", "Section 3", "Section 4", "Section 5", "Section 6"),
+    ("Section 7",),
+    ("Section 8", "Section 9"),
+]
+WORDS = "user flow page api feature metric login sign-up coupon shoes email latency scenario".split()
+
+# system prompt and messages of the requests of a /save, by layout
+Layout = Callable[[List[dict], Tuple[str, ...]], Tuple[str, List[dict]]]
+
+
+def synthetic_history(turns: int, rng: random.Random) -> List[dict]:
+    history = []
+    for _ in range(turns):
+        for role, mu in (("user", 4.5), ("assistant", 6.6)):
+            words = int(rng.lognormvariate(mu, 0.6) * 0.75)
+            history.append(
+                {"role": role, "content": [{"text": " ".join(rng.choice(WORDS) for _ in range(words))}]}
+            )
+    return history
+
+
+def group_message(section_group: Tuple[str, ...]) -> dict:
+    """Group message of the layouts with the template in the system prompt."""
+    return {
+        "role": "user",
+        "content": [
+            {
+                "text": f"<locale>English</locale>\n<section>{section_group}</section>\nPlease print the section in the requested locale.",
+            }
+        ],
+    }
+
+
+def system_prompt_with(alps_template: str) -> str:
+    return "\n".join(
+        [SYSTEM_PROMPT, alps_template, "Please print the section in the requested locale."]
+    )
+
+
+def full_layout() -> Layout:
+    system_prompt = system_prompt_with(f"<alps-template>{load_alps_context()}</alps-template>")
+
+    def build(history: List[dict], section_group: Tuple[str, ...]) -> Tuple[str, List[dict]]:
+        return system_prompt, [*history, group_message(section_group)]
+
+    return build
+
+
+def per_group_layout(service: SectionPrinterService) -> Layout:
+    def build(history: List[dict], section_group: Tuple[str, ...]) -> Tuple[str, List[dict]]:
+        system_prompt = system_prompt_with(service.get_section_template(section_group).text)
+        return system_prompt, [*history, group_message(section_group)]
+
+    return build
+
+
+def sliced_layout(service: SectionPrinterService) -> Layout:
+    def build(history: List[dict], section_group: Tuple[str, ...]) -> Tuple[str, List[dict]]:
+        messages = service.build_section_printer_messages(history, section_group, "English")
+        return service.get_system_prompt(), messages
+
+    return build
+
+
+def count_request(system_prompt: str, messages: List[dict]) -> Tuple[int, int]:
+    """Token counts of the cacheable prefix, the system prompt and history, and of the group message."""
+    prefix = count_tokens(system_prompt) + sum(
+        count_tokens(block["text"]) for message in messages[:-1] for block in message["content"]
+    )
+    return prefix, sum(count_tokens(block["text"]) for block in messages[-1]["content"])
+
+
+def price_save(layout: Layout, history: List[dict]) -> Dict[str, float]:
+    input_tokens, cost = 0, 0.0
+    prefixes = set()
+    for section_group in SECTION_GROUPS:
+        system_prompt, messages = layout(history, section_group)
+        prefix, tail = count_request(system_prompt, messages)
+        input_tokens += prefix + tail
+        # the first group with a prefix writes it, the next ones read it
+        key = (system_prompt, len(messages))
+        cost += (PROMPT_CACHE_READ_PRICE if key in prefixes else PROMPT_CACHE_WRITE_PRICE) * prefix + tail
+        prefixes.add(key)
+    return {"input_tokens": input_tokens, "cost": cost}
+
+
+async def time_to_first_token(
+    service: SectionPrinterService, layout: Layout, history: List[dict]
+) -> List[float]:
+    timings = []
+    cached_history = PromptCacheService(config.llm_backend).add_cache_points_to_messages(
+        [len(history) - 1], history
+    )
+    for section_group in SECTION_GROUPS:
+        system_prompt, messages = layout(cached_history, section_group)
+        started_at = time.perf_counter()
+        stream = service.stream_llm_response(messages, system_prompt=system_prompt)
+        try:
+            async for chunk in stream:
+                if chunk:
+                    timings.append((time.perf_counter() - started_at) * 1000)
+                    break
+        finally:
+            await stream.aclose()
+    return timings
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # keep the output readable
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    service = SectionPrinterService(config.llm_backend, config.model_id)
+    service.register_section_groups(SECTION_GROUPS)
+    history = synthetic_history(args.turns, random.Random(args.seed))
+    layouts = {
+        "full": full_layout(),
+        "sliced": sliced_layout(service),
+        "per_group": per_group_layout(service),
+    }
+
+    print(
+        f"turns={args.turns} system_prompt_version={prompt_registry.get(PromptFamily.SECTION_PRINTER.value).version}"
+    )
+    results = {name: price_save(layout, history) for name, layout in layouts.items()}
+    for name, result in results.items():
+        print(
+            f"{name:9} input_tokens_per_save={result['input_tokens']:8d} "
+            f"tokens_vs_full={(result['input_tokens'] / results['full']['input_tokens'] - 1) * 100:+6.1f}% "
+            f"cost_per_save={result['cost']:10.0f} "
+            f"cost_vs_full={(result['cost'] / results['full']['cost'] - 1) * 100:+6.1f}%"
+        )
+
+    if not args.live:
+        return
+
+    timings: Dict[str, List[float]] = {name: [] for name in layouts}
+    for _ in range(args.repeat):
+        for name, layout in layouts.items():
+            timings[name] += await time_to_first_token(service, layout, history)
+    for name, values in timings.items():
+        print(
+            f"{name:9} ttft median={statistics.median(values):8.1f}ms "
+            f"p95={sorted(values)[max(int(len(values) * 0.95) - 1, 0)]:8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Measure the cold start of the Chainlit app: wall-clock time of `import app` and import time per module.
+
+Usage:
+    uv run -- python -m benchmarks.startup_time [--repeat 5] [--top 25]
+
+Every run imports the app in a fresh interpreter with `-X importtime`,
+so the numbers include the module loading each container start pays before the first request.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# the heavy dependencies which should only load on first use
+LAZY_MODULES = [
+    "boto3",
+    "pdfplumber",
+    "PIL.Image",
+    "strands",
+    "strands.models.bedrock",
+    "strands.models.anthropic",
+]
+
+
+def import_app() -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """
+    Import the app in a fresh interpreter.
+
+    Returns:
+        Tuple[float, Dict[str, Tuple[int, int]]]: Wall-clock seconds and (self, cumulative) microseconds by module
+    """
+    # the import must not fail on the OAuth callback registration
+    env = {**os.environ, "DISABLE_OAUTH": "true"}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        if self_us.strip().isdigit():
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return elapsed, modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    wall_times: List[float] = []
+    cumulative: Dict[str, List[int]] = defaultdict(list)
+    for _ in range(args.repeat):
+        elapsed, modules = import_app()
+        wall_times.append(elapsed)
+        for name, (_, cumulative_us) in modules.items():
+            cumulative[name].append(cumulative_us)
+
+    print(f"import app: median={statistics.median(wall_times) * 1000:8.1f}ms (interpreter start included)")
+    print(f"\ntop {args.top} modules by cumulative import time (median)")
+    medians = {name: statistics.median(timings) for name, timings in cumulative.items()}
+    for name, median_us in sorted(medians.items(), key=lambda item: -item[1])[: args.top]:
+        print(f"{median_us / 1000:10.1f}ms  {name}")
+
+    print("\nlazy dependencies loaded at startup")
+    for name in LAZY_MODULES:
+        status = f"{medians[name] / 1000:8.1f}ms" if name in medians else "  not loaded"
+        print(f"{status}  {name}")
+
+
+if __name__ == "__main__":
+    main()
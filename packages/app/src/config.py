@@ -6,7 +6,7 @@ import structlog
 from dotenv import load_dotenv
 load_dotenv()  # noqa: E402
 
-from src.constant import LLMBackend
+from src.constant import ContextEncoding, LLMBackend
 
 logger = structlog.get_logger('config')
 
@@ -18,6 +18,56 @@ HISTORY_TABLE_NAME = os.getenv("HISTORY_TABLE_NAME", "")
 logger.info("HISTORY_TABLE_NAME configuration", table_name=HISTORY_TABLE_NAME)
 AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION", None)
 logger.info("AWS region configuration", region=AWS_DEFAULT_REGION)
+# local SQLite history database, used when HISTORY_TABLE_NAME is not set
+HISTORY_DATABASE_PATH = os.getenv("HISTORY_DATABASE_PATH", "")
+logger.info("HISTORY_DATABASE_PATH configuration", database_path=HISTORY_DATABASE_PATH)
+# set to use a local DynamoDB-compatible endpoint, e.g. http://localhost:8001 for DynamoDB Local
+DYNAMODB_ENDPOINT_URL = os.getenv("DYNAMODB_ENDPOINT_URL", None)
+logger.info("DynamoDB endpoint configuration", endpoint_url=DYNAMODB_ENDPOINT_URL)
+# durable /save jobs with per-section checkpoints
+SAVE_JOB_DATABASE_PATH = os.getenv("SAVE_JOB_DATABASE_PATH", "./output/save_jobs.db")
+logger.info("SAVE_JOB_DATABASE_PATH configuration", database_path=SAVE_JOB_DATABASE_PATH)
+# render the confirmed sections in the background, so /save mostly assembles them
+SPECULATIVE_SAVE = os.getenv("SPECULATIVE_SAVE", "false").lower() == "true"
+SPECULATIVE_SAVE_LOCALE = os.getenv("SPECULATIVE_SAVE_LOCALE", "English")
+# uncached input token equivalents per session, an output token is worth OUTPUT_TOKEN_PRICE of them
+SPECULATIVE_SAVE_TOKEN_BUDGET = int(os.getenv("SPECULATIVE_SAVE_TOKEN_BUDGET", 163840))
+logger.info(
+    "Speculative save configuration",
+    enabled=SPECULATIVE_SAVE,
+    locale=SPECULATIVE_SAVE_LOCALE,
+    token_budget=SPECULATIVE_SAVE_TOKEN_BUDGET,
+)
+# section groups of /save printed at the same time
+SAVE_PARALLELISM = int(os.getenv("SAVE_PARALLELISM", 3))
+logger.info("SAVE_PARALLELISM configuration", parallelism=SAVE_PARALLELISM)
+# keep the prompt cache of the active sessions warm and warm it before /save
+CACHE_WARMING = os.getenv("CACHE_WARMING", "false").lower() == "true"
+# uncached input token equivalents the warming requests of a worker may spend per hour
+CACHE_WARM_HOURLY_BUDGET = int(os.getenv("CACHE_WARM_HOURLY_BUDGET", 200000))
+logger.info(
+    "Cache warming configuration",
+    enabled=CACHE_WARMING,
+    hourly_budget=CACHE_WARM_HOURLY_BUDGET,
+)
+# conversation state shared by the workers: memory://, sqlite:///session.db or redis://host:6379/0
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "")
+logger.info("Session store configuration", scheme=SESSION_STORE_URL.split(":", 1)[0])
+# tiktoken data bundled with the app, so the tokenizer loads without network access
+TOKENIZER_DATA_DIR = os.getenv("TOKENIZER_DATA_DIR", "./tokenizers")
+logger.info("TOKENIZER_DATA_DIR configuration", data_dir=TOKENIZER_DATA_DIR)
+# versions of the system prompts at the last start, a changed prompt starts its cache cold
+PROMPT_MANIFEST_PATH = os.getenv("PROMPT_MANIFEST_PATH", "./output/prompt_versions.json")
+logger.info("PROMPT_MANIFEST_PATH configuration", manifest_path=PROMPT_MANIFEST_PATH)
+# token estimator calibration learned from the usage metadata, empty keeps it in memory only
+TOKEN_CALIBRATION_PATH = os.getenv("TOKEN_CALIBRATION_PATH", "./output/token_calibration.json")
+logger.info("TOKEN_CALIBRATION_PATH configuration", calibration_path=TOKEN_CALIBRATION_PATH)
+# relative error of the token estimates tolerated on request-sized texts, above it tokens are counted exactly
+TOKEN_ESTIMATOR_TOLERANCE = float(os.getenv("TOKEN_ESTIMATOR_TOLERANCE", 0.05))
+logger.info("TOKEN_ESTIMATOR_TOLERANCE configuration", tolerance=TOKEN_ESTIMATOR_TOLERANCE)
+# input and output tokens the model accepts, requests are trimmed to fit it
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", 200000))
+logger.info("CONTEXT_WINDOW configuration", context_window=CONTEXT_WINDOW)
 
 # AWS
 AWS_PROFILE = os.getenv("AWS_PROFILE", None)
@@ -41,6 +91,10 @@ logger.info("Tavily API key configuration", api_key=TAVILY_API_KEY)
 TAVILY_MAX_RESULTS = os.getenv("TAVILY_MAX_RESULTS", 5)
 logger.info("Tavily max results configuration", max_results=TAVILY_MAX_RESULTS)
 
+# Context encoding of the uploaded files, set "verbose" to fall back to the padded format
+CONTEXT_ENCODING = ContextEncoding(os.getenv("CONTEXT_ENCODING", "compact").lower())
+logger.info("Context encoding configuration", context_encoding=CONTEXT_ENCODING)
+
 # Environment
 ENVIRONMENT = os.getenv("ENVIRONMENT", "local")
 logger.info("Environment configuration", environment=ENVIRONMENT)
@@ -50,6 +104,21 @@ logger.info("Environment configuration", environment=ENVIRONMENT)
 class Config:
     disable_oauth: bool
     history_table_name: Optional[str]
+    history_database_path: Optional[str]
+    dynamodb_endpoint_url: Optional[str]
+    session_store_url: str
+    save_job_database_path: str
+    speculative_save: bool
+    speculative_save_locale: str
+    speculative_save_token_budget: int
+    save_parallelism: int
+    cache_warming: bool
+    cache_warm_hourly_budget: int
+    tokenizer_data_dir: str
+    token_calibration_path: str
+    token_estimator_tolerance: float
+    prompt_manifest_path: str
+    context_window: int
     aws_default_region: Optional[str]
     aws_profile: Optional[str]
     aws_bedrock_model_id: Optional[str]
@@ -58,12 +127,28 @@ class Config:
     llm_backend: LLMBackend
     tavily_api_key: Optional[str]
     tavily_max_results: int
+    context_encoding: ContextEncoding
     environment: str
 
 
 config = Config(
     disable_oauth=DISABLE_OAUTH,
     history_table_name=HISTORY_TABLE_NAME,
+    history_database_path=HISTORY_DATABASE_PATH,
+    dynamodb_endpoint_url=DYNAMODB_ENDPOINT_URL,
+    session_store_url=SESSION_STORE_URL,
+    save_job_database_path=SAVE_JOB_DATABASE_PATH,
+    speculative_save=SPECULATIVE_SAVE,
+    speculative_save_locale=SPECULATIVE_SAVE_LOCALE,
+    speculative_save_token_budget=SPECULATIVE_SAVE_TOKEN_BUDGET,
+    save_parallelism=SAVE_PARALLELISM,
+    cache_warming=CACHE_WARMING,
+    cache_warm_hourly_budget=CACHE_WARM_HOURLY_BUDGET,
+    tokenizer_data_dir=TOKENIZER_DATA_DIR,
+    token_calibration_path=TOKEN_CALIBRATION_PATH,
+    token_estimator_tolerance=TOKEN_ESTIMATOR_TOLERANCE,
+    prompt_manifest_path=PROMPT_MANIFEST_PATH,
+    context_window=CONTEXT_WINDOW,
     aws_default_region=AWS_DEFAULT_REGION,
     aws_profile=AWS_PROFILE,
     aws_bedrock_model_id=AWS_BEDROCK_MODEL_ID,
@@ -72,5 +157,6 @@ config = Config(
     llm_backend=LLM_BACKEND,
     tavily_api_key=TAVILY_API_KEY,
     tavily_max_results=TAVILY_MAX_RESULTS,
+    context_encoding=CONTEXT_ENCODING,
     environment=ENVIRONMENT,
 )
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 from enum import Enum
 
 from chainlit.types import CommandDict
@@ -14,6 +14,109 @@ MAX_TOKENS: int = 1024 * 16
 TEMPERATURE: float = 0.33
 
 
+# Image
+# Claude downsizes anything above ~1.15 megapixels, so larger uploads only cost upload time
+MAX_IMAGE_LONG_EDGE: int = 1568
+# Bedrock rejects image blocks above 3.75 MB
+MAX_IMAGE_BYTES: int = int(3.75 * 1024 * 1024)
+JPEG_QUALITY: int = 85
+WEBP_QUALITY: int = 85
+IMAGE_FORMATS: List[str] = ["jpeg", "png", "gif", "webp"]
+# Claude counts about width * height / 750 tokens, at most this for an image within the limits above
+IMAGE_TOKENS: int = 1600
+
+
+# Context budget of a request, split by priority before it is sent
+CONTEXT_BUDGET_MIN_TEXT_TOKENS: int = 1000  # shorter remainders of a text are left out, not truncated
+
+
+# Attachments
+TEXT_FILE_EXTENSIONS: List[str] = [".json", ".md", ".pdf"]
+IMAGE_FILE_EXTENSIONS: List[str] = [".jpg", ".jpeg", ".png", ".gif", ".webp"]
+MAX_ATTACHMENT_CONCURRENCY: int = 4
+MAX_ATTACHMENT_TOTAL_BYTES: int = 1024 * 1024 * 30
+
+
+# Chat history write-behind buffer
+HISTORY_FLUSH_DELAY: float = 1.0  # seconds
+HISTORY_MAX_BUFFERED_STEPS: int = 25
+THREAD_LIST_CACHE_TTL: float = 10.0  # seconds
+
+# Memory snapshot persisted in the thread metadata, bump the version when the format changes
+MEMORY_SNAPSHOT_KEY: str = "memory_snapshot"
+MEMORY_SNAPSHOT_VERSION: int = 1
+
+# Session state shared by the workers, bump the format version when the encoding changes
+SESSION_STATE_FORMAT_VERSION: int = 1
+SESSION_STATE_KEY_PREFIX: str = "alps:session:"
+SESSION_STATE_TTL: int = 60 * 60 * 24 * 7  # seconds
+SESSION_STATE_MAX_RETRIES: int = 3
+
+# Live fan-out of the streamed messages to the other viewers of a thread
+BROADCAST_BUFFER_SIZE: int = 256  # events per viewer
+BROADCAST_SNAPSHOT_INTERVAL: float = 0.5  # seconds
+
+# Speculative rendering of the confirmed sections
+SPECULATIVE_IDLE_DELAY: float = 5.0  # seconds
+
+# Section groups of /save, balanced by the estimated output of their sections
+SAVE_SECTION_DEFAULT_TOKENS: int = 400  # sections without a draft in the conversation
+SAVE_GROUP_MAX_OUTPUT_TOKENS: int = MAX_TOKENS // 2  # headroom for locales longer than the drafts
+
+# Token estimator calibrated from the usage metadata of the model
+# prior tokens per character of each script, and per message for the request overhead
+TOKEN_ESTIMATOR_PRIOR: Dict[str, float] = {
+    "latin": 0.28,
+    "hangul": 1.0,
+    "cjk": 1.1,
+    "other": 0.6,
+    "message": 4.0,
+}
+# weight of the prior, in characters for the scripts and in messages for the overhead
+TOKEN_ESTIMATOR_PRIOR_WEIGHT: Dict[str, float] = {
+    "latin": 2000,
+    "hangul": 500,
+    "cjk": 500,
+    "other": 500,
+    "message": 10,
+}
+TOKEN_ESTIMATOR_DECAY: float = 0.98  # per observation, older usage fades out
+TOKEN_ESTIMATOR_MIN_SAMPLES: int = 20  # exact counting until the error bound is measured
+TOKEN_ESTIMATOR_ERROR_WINDOW: int = 200  # recent relative errors the bound is taken from
+TOKEN_ESTIMATOR_SAVE_INTERVAL: int = 10  # observations between calibration writes
+# a tokenizer that failed to load is loaded again after a doubling delay, counts are approximated meanwhile
+TOKENIZER_RETRY_DELAY: float = 30.0  # seconds
+TOKENIZER_RETRY_MAX_DELAY: float = 600.0  # seconds
+
+
+# Prompt cache cost model, prices relative to an uncached input token
+PROMPT_CACHE_TTL: float = 300.0  # seconds, every read refreshes it
+PROMPT_CACHE_WRITE_PRICE: float = 1.25
+PROMPT_CACHE_READ_PRICE: float = 0.1
+OUTPUT_TOKEN_PRICE: float = 5.0
+# chance the next turn arrives within the TTL, until the gaps of the session are seen
+PROMPT_CACHE_REUSE_PRIOR: float = 0.7
+PROMPT_CACHE_REUSE_PRIOR_WEIGHT: float = 2.0  # in turns
+PROMPT_CACHE_GAP_WINDOW: int = 20  # recent turn gaps the reuse chance is taken from
+# Prompt cache warming, single token requests reading a cached prefix before it expires
+CACHE_WARM_MARGIN: float = 30.0  # seconds before the expiry the warming request is sent
+CACHE_WARM_MAX_PER_IDLE: int = 2  # warming requests between two turns, about ten minutes
+CACHE_WARM_MIN_TOKENS: int = 4000  # shorter cached prefixes are cheap to write again
+CACHE_WARM_PROMPT: str = "Reply with OK."
+
+
+class PromptFamily(Enum):
+    """Requests sharing a system prompt, and so a prompt cache."""
+
+    COWRITER = "cowriter"
+    SECTION_PRINTER = "section_printer"
+
+
+class ContextEncoding(Enum):
+    COMPACT = "compact"
+    VERBOSE = "verbose"
+
+
 # Chainlit COMMANDS
 COMMANDS: List[CommandDict] = [
     {
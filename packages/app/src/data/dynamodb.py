@@ -0,0 +1,557 @@
+import json
+import time
+import random
+import asyncio
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from chainlit.config import config as chainlit_config
+from chainlit.context import ChainlitContextException
+from chainlit.data.dynamodb import DynamoDBDataLayer
+from chainlit.data.storage_clients.base import BaseStorageClient
+from chainlit.data.utils import queue_until_user_message
+from chainlit.session import WebsocketSession
+from chainlit.step import StepDict
+from chainlit.types import (
+    PageInfo,
+    PaginatedResponse,
+    Pagination,
+    ThreadDict,
+    ThreadFilter,
+)
+
+from src.constant import (
+    HISTORY_FLUSH_DELAY,
+    HISTORY_MAX_BUFFERED_STEPS,
+    THREAD_LIST_CACHE_TTL,
+)
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    from mypy_boto3_dynamodb import DynamoDBClient
+
+BATCH_WRITE_SIZE = 25  # DynamoDB limit of BatchWriteItem
+BATCH_GET_SIZE = 100  # DynamoDB limit of BatchGetItem
+
+# step ids are uuid4, their hex prefix splits the steps of a thread into contiguous
+# sort key ranges which are read in parallel ("$" is the character after "#")
+STEP_KEY_RANGES: List[Tuple[str, str]] = [
+    ("STEP#", "STEP#4"),
+    ("STEP#4", "STEP#8"),
+    ("STEP#8", "STEP#c"),
+    ("STEP#c", "STEP$"),
+]
+# step attributes needed to resume a thread, the heavy input/output/generation are left out
+RESUME_STEP_ATTRIBUTES: List[str] = [
+    "PK",
+    "SK",
+    "id",
+    "threadId",
+    "parentId",
+    "name",
+    "type",
+    "command",
+    "createdAt",
+    "start",
+    "end",
+    "isError",
+    "metadata",
+    "tags",
+    "streaming",
+    "waitForAnswer",
+    "showInput",
+    "defaultOpen",
+    "language",
+    "feedback",
+    "modes",
+]
+
+
+class NativeNumberDeserializer(TypeDeserializer):
+    """
+    Deserialize DynamoDB numbers straight into int/float instead of Decimal.
+
+    Decimals are not JSON serializable, converting them while the item is deserialized
+    keeps the normalization in one pass at the data layer boundary.
+    """
+
+    def _deserialize_n(self, value: str) -> int | float:
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+
+class BufferedDynamoDBDataLayer(DynamoDBDataLayer):
+    """
+    Write-behind DynamoDB data layer for the chat history.
+
+    Step writes are buffered per thread and flushed off the event loop:
+    - new steps are written with BatchWriteItem, repeated updates are merged into the pending put
+    - updates of already persisted steps are coalesced into a single UpdateItem per step
+    - a flush runs after `flush_delay` seconds, when `max_buffered_steps` is reached or when `flush` is awaited
+
+    Reads are trimmed as well:
+    - thread listing projects the summary attributes and is cached per user for `thread_list_cache_ttl` seconds
+    - threads are read with parallel queries over step key ranges
+    - resume reads leave out the generation, which the chat does not render
+    - with the chain of thought hidden, they fetch the outputs of message steps only, as the memory needs no more
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        client: Optional["DynamoDBClient"] = None,
+        storage_provider: Optional[BaseStorageClient] = None,
+        user_thread_limit: int = 10,
+        flush_delay: float = HISTORY_FLUSH_DELAY,
+        max_buffered_steps: int = HISTORY_MAX_BUFFERED_STEPS,
+        thread_list_cache_ttl: float = THREAD_LIST_CACHE_TTL,
+    ):
+        super().__init__(
+            table_name=table_name,
+            client=client,
+            storage_provider=storage_provider,
+            user_thread_limit=user_thread_limit,
+        )
+        self.flush_delay = flush_delay
+        self.max_buffered_steps = max_buffered_steps
+        self._type_deserializer = NativeNumberDeserializer()
+
+        # thread id -> step id -> item
+        self._pending_puts: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._pending_updates: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._flush_locks: Dict[str, asyncio.Lock] = {}
+        self._flush_timers: Dict[str, asyncio.Task] = {}
+
+        self.thread_list_cache_ttl = thread_list_cache_ttl
+        # (user id, cursor, search) -> (expires at, response)
+        self._thread_list_cache: Dict[
+            Tuple[Optional[str], Optional[str], Optional[str]],
+            Tuple[float, PaginatedResponse[ThreadDict]],
+        ] = {}
+
+    def _deserialize_item(self, item: dict[str, Any]) -> dict[str, Any]:
+        return {
+            key: self._type_deserializer.deserialize(value)
+            for key, value in item.items()
+        }
+
+    def _step_key(self, thread_id: str, step_id: str) -> Dict[str, str]:
+        return {"PK": f"THREAD#{thread_id}", "SK": f"STEP#{step_id}"}
+
+    def _pending_count(self, thread_id: str) -> int:
+        return len(self._pending_puts.get(thread_id, {})) + len(
+            self._pending_updates.get(thread_id, {})
+        )
+
+    @queue_until_user_message()
+    async def create_step(self, step_dict: "StepDict"):
+        thread_id, step_id = step_dict["threadId"], step_dict["id"]  # type: ignore
+        item = {
+            **self._pending_updates.get(thread_id, {}).pop(step_id, {}),
+            **step_dict,
+            **self._step_key(thread_id, step_id),
+        }
+        self._pending_puts.setdefault(thread_id, {})[step_id] = item
+        self._schedule_flush(thread_id)
+
+    @queue_until_user_message()
+    async def update_step(self, step_dict: "StepDict"):
+        thread_id, step_id = step_dict["threadId"], step_dict["id"]  # type: ignore
+        # falsy values are skipped like the unbuffered _update_item does, whether or not the put is pending
+        updates = {key: value for key, value in step_dict.items() if value}
+        pending_put = self._pending_puts.get(thread_id, {}).get(step_id)
+        if pending_put is not None:
+            # the step is not written yet, merge the update into the put
+            pending_put.update(updates)
+        else:
+            pending_updates = self._pending_updates.setdefault(thread_id, {})
+            pending_updates.setdefault(step_id, {}).update(updates)
+        self._schedule_flush(thread_id)
+
+    @queue_until_user_message()
+    async def delete_step(self, step_id: str):
+        thread_id = self.context.session.thread_id
+        # wait for an in-flight flush so that the delete is not overwritten by it
+        async with self._flush_locks.setdefault(thread_id, asyncio.Lock()):
+            self._pending_puts.get(thread_id, {}).pop(step_id, None)
+            self._pending_updates.get(thread_id, {}).pop(step_id, None)
+
+            await asyncio.to_thread(
+                self.client.delete_item,
+                TableName=self.table_name,
+                Key=self._serialize_item(self._step_key(thread_id, step_id)),
+            )
+
+    async def update_thread(
+        self,
+        thread_id: str,
+        name: Optional[str] = None,
+        user_id: Optional[str] = None,
+        metadata: Optional[Dict] = None,
+        tags: Optional[List[str]] = None,
+    ):
+        if name is not None or user_id is not None:
+            self._invalidate_thread_list(thread_id, user_id)
+        await super().update_thread(
+            thread_id, name=name, user_id=user_id, metadata=metadata, tags=tags
+        )
+
+    async def update_thread_metadata(self, thread_id: str, key: str, value: Any) -> None:
+        """
+        Write a single key of the thread metadata off the event loop, the other keys are left as they are.
+
+        Args:
+            thread_id (str): Thread id
+            key (str): Metadata key
+            value (Any): JSON serializable value
+        """
+        await asyncio.to_thread(self._set_metadata_key, thread_id, key, value)
+
+    def _set_metadata_key(self, thread_id: str, key: str, value: Any) -> None:
+        update_args: Dict[str, Any] = {
+            "TableName": self.table_name,
+            "Key": self._serialize_item({"PK": f"THREAD#{thread_id}", "SK": "THREAD"}),
+            "UpdateExpression": "SET #metadata.#key = :value",
+            "ExpressionAttributeNames": {"#metadata": "metadata", "#key": key},
+            "ExpressionAttributeValues": self._serialize_item({":value": value}),
+        }
+        try:
+            self.client.update_item(**update_args)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ValidationException":
+                raise
+            # the thread has no metadata map yet
+            self.client.update_item(
+                **{
+                    **update_args,
+                    "UpdateExpression": "SET #metadata = :metadata",
+                    "ExpressionAttributeNames": {"#metadata": "metadata"},
+                    "ExpressionAttributeValues": self._serialize_item({":metadata": {key: value}}),
+                }
+            )
+
+    async def delete_thread(self, thread_id: str):
+        self._pending_puts.pop(thread_id, None)
+        self._pending_updates.pop(thread_id, None)
+        self._invalidate_thread_list(thread_id)
+        await super().delete_thread(thread_id)
+
+    async def list_threads(
+        self, pagination: "Pagination", filters: "ThreadFilter"
+    ) -> "PaginatedResponse[ThreadDict]":
+        if filters.feedback:
+            logger.warning("DynamoDB: filters on feedback not supported")
+
+        cache_key = (filters.userId, pagination.cursor, filters.search)
+        cached = self._thread_list_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        query_args: Dict[str, Any] = {
+            "TableName": self.table_name,
+            "IndexName": "UserThread",
+            "ScanIndexForward": False,
+            "Limit": self.user_thread_limit,
+            "KeyConditionExpression": "#UserThreadPK = :pk",
+            # only the summary attributes, metadata holds the whole user session
+            "ProjectionExpression": "PK, UserThreadSK, #name",
+            "ExpressionAttributeNames": {
+                "#UserThreadPK": "UserThreadPK",
+                "#name": "name",
+            },
+            "ExpressionAttributeValues": {
+                ":pk": {"S": f"USER#{filters.userId}"},
+            },
+        }
+        if pagination.cursor:
+            query_args["ExclusiveStartKey"] = json.loads(pagination.cursor)
+        if filters.search:
+            query_args["FilterExpression"] = "contains(#name, :search)"
+            query_args["ExpressionAttributeValues"][":search"] = {"S": filters.search}
+
+        response = await asyncio.to_thread(self.client.query, **query_args)
+
+        paginated_response: PaginatedResponse[ThreadDict] = PaginatedResponse(
+            data=[],
+            pageInfo=PageInfo(
+                hasNextPage="LastEvaluatedKey" in response,
+                startCursor=pagination.cursor,
+                endCursor=(
+                    json.dumps(response["LastEvaluatedKey"])
+                    if "LastEvaluatedKey" in response
+                    else None
+                ),
+            ),
+        )
+        for item in response["Items"]:
+            deserialized_item = self._deserialize_item(item)
+            paginated_response.data.append(
+                ThreadDict(  # type: ignore
+                    id=deserialized_item["PK"].removeprefix("THREAD#"),
+                    createdAt=deserialized_item["UserThreadSK"].removeprefix("TS#"),
+                    name=deserialized_item.get("name"),
+                )
+            )
+
+        self._thread_list_cache[cache_key] = (
+            time.monotonic() + self.thread_list_cache_ttl,
+            paginated_response,
+        )
+        return paginated_response
+
+    def _invalidate_thread_list(self, thread_id: str, user_id: Optional[str] = None) -> None:
+        """Drop the cached thread lists of the user or the ones containing the thread."""
+        for key, (_, response) in list(self._thread_list_cache.items()):
+            if key[0] == user_id or any(t["id"] == thread_id for t in response.data):
+                self._thread_list_cache.pop(key, None)
+
+    async def get_thread(self, thread_id: str) -> "Optional[ThreadDict]":
+        # read your own writes
+        await self.flush(thread_id)
+
+        resume = self._is_resuming(thread_id)
+        # the resumed thread is rendered too, the steps shown with the chain of thought keep their input/output
+        messages_only = resume and chainlit_config.ui.cot == "hidden"
+        step_projection = None
+        if resume:
+            step_projection = (
+                RESUME_STEP_ATTRIBUTES
+                if messages_only
+                else [*RESUME_STEP_ATTRIBUTES, "input", "output"]
+            )
+        thread_items, element_items, *step_pages = await asyncio.gather(
+            asyncio.to_thread(self._query_range, thread_id, "THREAD", "THREAD"),
+            asyncio.to_thread(self._query_range, thread_id, "ELEMENT#", "ELEMENT$"),
+            *(
+                asyncio.to_thread(self._query_range, thread_id, lower, upper, step_projection)
+                for lower, upper in STEP_KEY_RANGES
+            ),
+        )
+        # BETWEEN is inclusive, a step on a range boundary is read twice
+        steps = list({step["SK"]: step for page in step_pages for step in page}.values())
+
+        if not thread_items:
+            if steps or element_items:
+                logger.warning("DynamoDB: found orphaned items", thread_id=thread_id)
+            return None
+
+        if messages_only:
+            await self._load_message_outputs(thread_id, steps)
+
+        for item in element_items:
+            if self.storage_provider is not None:
+                item["url"] = await self.storage_provider.get_read_url(
+                    object_key=item["objectKey"],
+                )
+        steps.sort(key=lambda i: i["createdAt"])
+        thread_dict: ThreadDict = thread_items[0]
+        thread_dict.update(
+            {
+                "steps": steps,
+                "elements": element_items,
+            }
+        )
+        logger.debug(
+            "DynamoDB: read thread",
+            thread_id=thread_id,
+            steps=len(steps),
+            resume=resume,
+        )
+        return thread_dict
+
+    def _is_resuming(self, thread_id: str) -> bool:
+        """Check if the thread is read to be resumed by the current websocket session."""
+        try:
+            session = self.context.session
+        except ChainlitContextException:
+            return False
+        return (
+            isinstance(session, WebsocketSession)
+            and session.thread_id_to_resume == thread_id
+        )
+
+    def _query_range(
+        self,
+        thread_id: str,
+        lower: str,
+        upper: str,
+        attributes: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Query every page of the thread items with a sort key between the bounds."""
+        query_args: Dict[str, Any] = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "#pk = :pk AND #sk BETWEEN :lower AND :upper",
+            "ExpressionAttributeNames": {"#pk": "PK", "#sk": "SK"},
+            "ExpressionAttributeValues": {
+                ":pk": {"S": f"THREAD#{thread_id}"},
+                ":lower": {"S": lower},
+                ":upper": {"S": upper},
+            },
+        }
+        if attributes:
+            names = {f"#a{i}": attribute for i, attribute in enumerate(attributes)}
+            query_args["ProjectionExpression"] = ", ".join(names.keys())
+            query_args["ExpressionAttributeNames"].update(names)
+
+        items: List[Dict[str, Any]] = []
+        while True:
+            response = self.client.query(**query_args)
+            items.extend(map(self._deserialize_item, response["Items"]))
+            if "LastEvaluatedKey" not in response:
+                return items
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    async def _load_message_outputs(
+        self, thread_id: str, steps: List[Dict[str, Any]]
+    ) -> None:
+        """Fetch the outputs of the message steps in parallel batches, other steps keep an empty output."""
+        messages = {step["id"]: step for step in steps if "message" in step["type"]}
+        for step in steps:
+            step.setdefault("input", "")
+            step.setdefault("output", "")
+
+        step_ids = list(messages.keys())
+        pages = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    self._batch_get_outputs, thread_id, step_ids[i : i + BATCH_GET_SIZE]
+                )
+                for i in range(0, len(step_ids), BATCH_GET_SIZE)
+            )
+        )
+        for page in pages:
+            for item in page:
+                messages[item["id"]]["output"] = item.get("output", "")
+
+    def _batch_get_outputs(
+        self, thread_id: str, step_ids: List[str]
+    ) -> List[Dict[str, Any]]:
+        """Read the outputs of the steps with BatchGetItem, retrying unprocessed keys with backoff."""
+        request_items: Dict[str, Any] = {
+            self.table_name: {
+                "Keys": [
+                    self._serialize_item(self._step_key(thread_id, step_id))
+                    for step_id in step_ids
+                ],
+                "ProjectionExpression": "id, #output",
+                "ExpressionAttributeNames": {"#output": "output"},
+            }
+        }
+        items: List[Dict[str, Any]] = []
+        backoff_time = 0.05
+        while request_items:
+            response = self.client.batch_get_item(RequestItems=request_items)
+            items.extend(
+                map(self._deserialize_item, response["Responses"].get(self.table_name, []))
+            )
+            request_items = response.get("UnprocessedKeys") or {}
+            if request_items:
+                time.sleep(min(backoff_time, 2) + random.uniform(0, 0.05))
+                backoff_time *= 2
+        return items
+
+    async def close(self) -> None:
+        await self.flush()
+        await super().close()
+
+    def _schedule_flush(self, thread_id: str) -> None:
+        """Flush the thread immediately when the buffer is full, otherwise after the flush delay."""
+        if self._pending_count(thread_id) >= self.max_buffered_steps:
+            asyncio.create_task(self.flush(thread_id))
+            return
+
+        timer = self._flush_timers.get(thread_id)
+        if timer is None or timer.done():
+            self._flush_timers[thread_id] = asyncio.create_task(
+                self._delayed_flush(thread_id)
+            )
+
+    async def _delayed_flush(self, thread_id: str) -> None:
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self.flush(thread_id)
+        except Exception as e:
+            logger.error("Failed to flush chat history", thread_id=thread_id, error=e)
+
+    async def flush(self, thread_id: Optional[str] = None) -> None:
+        """
+        Write the buffered steps to DynamoDB.
+
+        Args:
+            thread_id (Optional[str]): Thread to flush, all threads if not given
+        """
+        thread_ids = (
+            [thread_id]
+            if thread_id
+            else list({*self._pending_puts.keys(), *self._pending_updates.keys()})
+        )
+        for tid in thread_ids:
+            lock = self._flush_locks.setdefault(tid, asyncio.Lock())
+            async with lock:
+                await self._flush_thread(tid)
+
+    async def _flush_thread(self, thread_id: str) -> None:
+        puts = self._pending_puts.pop(thread_id, {})
+        updates = self._pending_updates.pop(thread_id, {})
+        if not puts and not updates:
+            return
+
+        puts_written = False
+        written_updates = set()
+        try:
+            if puts:
+                await asyncio.to_thread(self._batch_put, list(puts.values()))
+                puts_written = True
+            for step_id, step_dict in updates.items():
+                await asyncio.to_thread(
+                    self._update_item, self._step_key(thread_id, step_id), step_dict
+                )
+                written_updates.add(step_id)
+        except Exception:
+            # requeue what was not written, writes buffered in the meantime take precedence
+            if puts and not puts_written:
+                pending_puts = self._pending_puts.setdefault(thread_id, {})
+                pending_updates = self._pending_updates.setdefault(thread_id, {})
+                for step_id, item in puts.items():
+                    pending_puts[step_id] = {
+                        **item,
+                        **pending_updates.pop(step_id, {}),
+                        **pending_puts.get(step_id, {}),
+                    }
+            for step_id, step_dict in updates.items():
+                if step_id not in written_updates:
+                    pending_updates = self._pending_updates.setdefault(thread_id, {})
+                    pending_updates[step_id] = {
+                        **step_dict,
+                        **pending_updates.get(step_id, {}),
+                    }
+            self._schedule_flush(thread_id)
+            raise
+
+        logger.debug(
+            "Flushed chat history",
+            thread_id=thread_id,
+            puts=len(puts),
+            updates=len(updates),
+        )
+
+    def _batch_put(self, items: List[Dict[str, Any]]) -> None:
+        """Write the items with BatchWriteItem, retrying unprocessed items with backoff."""
+        for i in range(0, len(items), BATCH_WRITE_SIZE):
+            request_items = {
+                self.table_name: [
+                    {"PutRequest": {"Item": self._serialize_item(item)}}
+                    for item in items[i : i + BATCH_WRITE_SIZE]
+                ]
+            }
+            backoff_time = 0.05
+            while request_items:
+                response = self.client.batch_write_item(RequestItems=request_items)
+                request_items = response.get("UnprocessedItems") or {}
+                if request_items:
+                    # Cap the backoff time at 2 seconds & add jitter
+                    time.sleep(min(backoff_time, 2) + random.uniform(0, 0.05))
+                    backoff_time *= 2
@@ -0,0 +1,225 @@
+import time
+import uuid
+import sqlite3
+import asyncio
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from src.utils.logger import logger
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS save_jobs (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    locale TEXT NOT NULL,
+    history_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    file_path TEXT,
+    error TEXT,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_save_jobs_thread ON save_jobs (thread_id, updated_at);
+CREATE TABLE IF NOT EXISTS save_job_groups (
+    job_id TEXT NOT NULL REFERENCES save_jobs (id) ON DELETE CASCADE,
+    group_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (job_id, group_index)
+);
+"""
+
+
+class SaveJobStore:
+    """
+    Durable queue of the /save document generation jobs in a local SQLite database.
+
+    Every generated section group is checkpointed, so an interrupted or failed job
+    resumes from the first missing group. Jobs run as tasks of the process owning the
+    database, so the jobs left running by the previous process are marked interrupted on start.
+    """
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlite-save-jobs"
+        )
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._connect).result()
+
+    def _connect(self) -> None:
+        Path(self.database_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.database_path, timeout=5.0, check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        interrupted = self._conn.execute(
+            "UPDATE save_jobs SET status = 'interrupted', error = 'interrupted by a restart', updated_at = ? WHERE status = 'running'",
+            (time.time(),),
+        ).rowcount
+        self._conn.commit()
+        logger.info(
+            "Save job store initialized",
+            database_path=self.database_path,
+            interrupted_jobs=interrupted,
+        )
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run the function with the connection on the dedicated thread in a transaction."""
+
+        def run() -> T:
+            with self._conn:
+                return fn(self._conn)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    async def create_job(self, thread_id: str, locale: str, history_hash: str) -> str:
+        """
+        Create a running job.
+
+        Args:
+            thread_id (str): Thread id
+            locale (str): Document locale
+            history_hash (str): Fingerprint of the conversation the document is generated from
+
+        Returns:
+            str: Job id
+        """
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        await self._run(
+            lambda conn: conn.execute(
+                "INSERT INTO save_jobs (id, thread_id, locale, history_hash, status, created_at, updated_at) VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                (job_id, thread_id, locale, history_hash, now, now),
+            )
+        )
+        return job_id
+
+    async def find_resumable_job(
+        self, thread_id: str, locale: str, history_hash: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find the latest unfinished job for the same conversation and locale.
+
+        Args:
+            thread_id (str): Thread id
+            locale (str): Document locale
+            history_hash (str): Fingerprint of the conversation
+
+        Returns:
+            Optional[Dict[str, Any]]: Job, None if there is nothing to resume
+        """
+
+        def find(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                "SELECT * FROM save_jobs WHERE thread_id = ? AND locale = ? AND history_hash = ? AND status != 'done' ORDER BY updated_at DESC LIMIT 1",
+                (thread_id, locale, history_hash),
+            ).fetchone()
+            return dict(row) if row else None
+
+        return await self._run(find)
+
+    async def get_checkpoints(self, job_id: str) -> Dict[int, str]:
+        """
+        Return the generated section groups of the job.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            Dict[int, str]: Content by section group index
+        """
+
+        def get(conn: sqlite3.Connection) -> Dict[int, str]:
+            rows = conn.execute(
+                "SELECT group_index, content FROM save_job_groups WHERE job_id = ?",
+                (job_id,),
+            ).fetchall()
+            return {row["group_index"]: row["content"] for row in rows}
+
+        return await self._run(get)
+
+    async def save_checkpoint(self, job_id: str, group_index: int, content: str) -> None:
+        """
+        Save a generated section group.
+
+        Args:
+            job_id (str): Job id
+            group_index (int): Section group index
+            content (str): Generated content
+        """
+
+        def save(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                "INSERT OR REPLACE INTO save_job_groups (job_id, group_index, content) VALUES (?, ?, ?)",
+                (job_id, group_index, content),
+            )
+            conn.execute(
+                "UPDATE save_jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+        await self._run(save)
+
+    async def update_job(
+        self,
+        job_id: str,
+        status: str,
+        file_path: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """
+        Update the status of the job, a job running again is delivered again once done.
+
+        Args:
+            job_id (str): Job id
+            status (str): running, failed, interrupted or done
+            file_path (Optional[str]): Saved document path of a done job
+            error (Optional[str]): Error of a failed job
+        """
+        await self._run(
+            lambda conn: conn.execute(
+                "UPDATE save_jobs SET status = ?, file_path = ?, error = ?, updated_at = ?, delivered = CASE WHEN ? = 'running' THEN 0 ELSE delivered END WHERE id = ?",
+                (status, file_path, error, time.time(), status, job_id),
+            )
+        )
+
+    async def list_undelivered_jobs(self, thread_id: str) -> List[Dict[str, Any]]:
+        """
+        Return the done jobs of the thread whose document was not delivered to the user,
+        and the interrupted jobs the user was not told about.
+
+        Args:
+            thread_id (str): Thread id
+
+        Returns:
+            List[Dict[str, Any]]: Done and interrupted jobs, oldest first
+        """
+
+        def list_jobs(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            rows = conn.execute(
+                "SELECT * FROM save_jobs WHERE thread_id = ? AND status IN ('done', 'interrupted') AND delivered = 0 ORDER BY updated_at",
+                (thread_id,),
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        return await self._run(list_jobs)
+
+    async def mark_delivered(self, job_id: str) -> None:
+        """
+        Mark the document or the interruption of the job as delivered to the user.
+
+        Args:
+            job_id (str): Job id
+        """
+        await self._run(
+            lambda conn: conn.execute(
+                "UPDATE save_jobs SET delivered = 1 WHERE id = ?", (job_id,)
+            )
+        )
@@ -0,0 +1,250 @@
+import time
+import sqlite3
+import asyncio
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from src.constant import SESSION_STATE_KEY_PREFIX, SESSION_STATE_TTL
+from src.utils.logger import logger
+
+T = TypeVar("T")
+
+# (version, serialized state)
+SessionStateRecord = Tuple[int, bytes]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_state (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SessionStateConflictError(Exception):
+    """Raised when the stored session state was updated by another worker."""
+
+    def __init__(self, key: str, expected_version: int):
+        super().__init__(
+            f"Session state {key} is not at version {expected_version}"
+        )
+        self.key = key
+        self.expected_version = expected_version
+
+
+class SessionStateStore(ABC):
+    """
+    Versioned key-value store for the serialized conversation state.
+
+    Every write carries the version the writer has read, so concurrent workers
+    never overwrite each other silently.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[SessionStateRecord]:
+        """
+        Read the session state.
+
+        Args:
+            key (str): Session state key, the thread id
+
+        Returns:
+            Optional[SessionStateRecord]: Version and serialized state, None if not stored
+        """
+        pass
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes, expected_version: int) -> int:
+        """
+        Write the session state if it is still at the expected version.
+
+        Args:
+            key (str): Session state key, the thread id
+            data (bytes): Serialized state
+            expected_version (int): Version read by the writer, 0 if the state is not stored yet
+
+        Returns:
+            int: New version of the state
+
+        Raises:
+            SessionStateConflictError: If the stored version is not the expected version
+        """
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemorySessionStateStore(SessionStateStore):
+    """Session state store in the process memory, for a single worker."""
+
+    def __init__(self):
+        self._records: Dict[str, SessionStateRecord] = {}
+
+    async def get(self, key: str) -> Optional[SessionStateRecord]:
+        return self._records.get(key)
+
+    async def put(self, key: str, data: bytes, expected_version: int) -> int:
+        # no await between the check and the write, so the update is atomic on the event loop
+        version, _ = self._records.get(key, (0, b""))
+        if version != expected_version:
+            raise SessionStateConflictError(key, expected_version)
+        self._records[key] = (version + 1, data)
+        return version + 1
+
+
+class SQLiteSessionStateStore(SessionStateStore):
+    """
+    Session state store in a local SQLite database in WAL mode.
+
+    Shared by the workers of a single node, and survives restarts.
+    """
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlite-session-store"
+        )
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._connect).result()
+
+    def _connect(self) -> None:
+        # workers of other processes may hold the write lock for a moment
+        self._conn = sqlite3.connect(
+            self.database_path, timeout=5.0, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        logger.info(
+            "SQLite session state store initialized", database_path=self.database_path
+        )
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run the function with the connection on the dedicated thread in a transaction."""
+
+        def run() -> T:
+            with self._conn:
+                return fn(self._conn)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    async def get(self, key: str) -> Optional[SessionStateRecord]:
+        def get(conn: sqlite3.Connection) -> Optional[SessionStateRecord]:
+            row = conn.execute(
+                "SELECT version, data FROM session_state WHERE key = ?", (key,)
+            ).fetchone()
+            return (row[0], row[1]) if row else None
+
+        return await self._run(get)
+
+    async def put(self, key: str, data: bytes, expected_version: int) -> int:
+        def put(conn: sqlite3.Connection) -> int:
+            if expected_version == 0:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO session_state (key, version, data, updated_at) VALUES (?, 1, ?, ?)",
+                    (key, data, time.time()),
+                )
+            else:
+                cursor = conn.execute(
+                    "UPDATE session_state SET version = version + 1, data = ?, updated_at = ? WHERE key = ? AND version = ?",
+                    (data, time.time(), key, expected_version),
+                )
+            if cursor.rowcount != 1:
+                raise SessionStateConflictError(key, expected_version)
+            return expected_version + 1
+
+        return await self._run(put)
+
+    async def close(self) -> None:
+        def close() -> None:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, close)
+        self._executor.shutdown(wait=True)
+
+
+class RedisSessionStateStore(SessionStateStore):
+    """
+    Session state store in Redis, or any server speaking the Redis protocol (Valkey, ElastiCache).
+
+    Shared by the workers of every node. Versions are checked in a WATCH/MULTI transaction.
+    """
+
+    def __init__(self, url: str, ttl: int = SESSION_STATE_TTL):
+        """
+        Args:
+            url (str): Redis URL, e.g. redis://localhost:6379/0
+            ttl (int): Expiration of the idle session states in seconds, 0 to keep them forever
+        """
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis package is required for the redis:// session store, install it with `uv sync --extra redis`"
+            ) from e
+
+        self._client = Redis.from_url(url)
+        self.ttl = ttl
+        logger.info("Redis session state store initialized", host=urlparse(url).hostname)
+
+    def _name(self, key: str) -> str:
+        return f"{SESSION_STATE_KEY_PREFIX}{key}"
+
+    async def get(self, key: str) -> Optional[SessionStateRecord]:
+        version, data = await self._client.hmget(self._name(key), ["v", "d"])
+        if version is None or data is None:
+            return None
+        return int(version), data
+
+    async def put(self, key: str, data: bytes, expected_version: int) -> int:
+        from redis.exceptions import WatchError
+
+        name = self._name(key)
+        async with self._client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(name)
+                version = await pipe.hget(name, "v")
+                if int(version or 0) != expected_version:
+                    raise SessionStateConflictError(key, expected_version)
+
+                pipe.multi()
+                pipe.hset(name, mapping={"v": expected_version + 1, "d": data})
+                if self.ttl:
+                    pipe.expire(name, self.ttl)
+                await pipe.execute()
+            except WatchError as e:
+                raise SessionStateConflictError(key, expected_version) from e
+        return expected_version + 1
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_session_state_store(url: str) -> Optional[SessionStateStore]:
+    """
+    Create the session state store for the URL.
+
+    Args:
+        url (str): memory://, sqlite:///path/to/session.db or redis://host:port/db, empty to disable
+
+    Returns:
+        Optional[SessionStateStore]: Session state store, None if disabled
+    """
+    if not url:
+        return None
+
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return InMemorySessionStateStore()
+    if scheme == "sqlite":
+        return SQLiteSessionStateStore(url.removeprefix("sqlite://").removeprefix("/") or "session.db")
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisSessionStateStore(url)
+    raise ValueError(f"Unsupported session store URL: {url}")
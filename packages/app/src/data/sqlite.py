@@ -0,0 +1,476 @@
+import json
+import uuid
+import sqlite3
+import asyncio
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, TypeVar
+
+import aiofiles
+from chainlit.context import context
+from chainlit.data.base import BaseDataLayer
+from chainlit.data.storage_clients.base import BaseStorageClient
+from chainlit.data.utils import queue_until_user_message
+from chainlit.element import ElementDict
+from chainlit.step import StepDict
+from chainlit.types import (
+    Feedback,
+    PageInfo,
+    PaginatedResponse,
+    Pagination,
+    ThreadDict,
+    ThreadFilter,
+)
+from chainlit.user import PersistedUser, User
+
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    from chainlit.element import Element
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    identifier TEXT NOT NULL UNIQUE,
+    metadata TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS threads (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    user_id TEXT,
+    user_identifier TEXT,
+    tags TEXT,
+    metadata TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+-- listed by the creation time, which never changes while the user pages through the threads
+DROP INDEX IF EXISTS idx_threads_user_updated;
+CREATE INDEX IF NOT EXISTS idx_threads_user_created ON threads (user_id, created_at, id);
+CREATE TABLE IF NOT EXISTS steps (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_steps_thread_created ON steps (thread_id, created_at);
+CREATE TABLE IF NOT EXISTS elements (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_elements_thread ON elements (thread_id);
+CREATE TABLE IF NOT EXISTS feedbacks (
+    id TEXT PRIMARY KEY,
+    for_id TEXT NOT NULL UNIQUE,
+    thread_id TEXT,
+    value INTEGER NOT NULL,
+    comment TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_feedbacks_thread ON feedbacks (thread_id);
+"""
+
+
+class SQLiteDataLayer(BaseDataLayer):
+    """
+    Chainlit data layer backed by a local SQLite database in WAL mode.
+
+    The connection is owned by a dedicated worker thread, every query runs there
+    so the event loop is never blocked by disk I/O.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        storage_provider: Optional[BaseStorageClient] = None,
+    ):
+        self.database_path = database_path
+        self.storage_provider = storage_provider
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlite-data-layer"
+        )
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._connect).result()
+
+    def _connect(self) -> None:
+        self._conn = sqlite3.connect(self.database_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        logger.info("SQLite data layer initialized", database_path=self.database_path)
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """Run the function with the connection on the dedicated thread in a transaction."""
+
+        def run() -> T:
+            with self._conn:
+                return fn(self._conn)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    def _get_current_timestamp(self) -> str:
+        return datetime.now().isoformat() + "Z"
+
+    @property
+    def context(self):
+        return context
+
+    async def get_user(self, identifier: str) -> Optional["PersistedUser"]:
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT * FROM users WHERE identifier = ?", (identifier,)
+            ).fetchone()
+        )
+        if row is None:
+            return None
+
+        return PersistedUser(
+            id=row["id"],
+            identifier=row["identifier"],
+            createdAt=row["created_at"],
+            metadata=json.loads(row["metadata"]),
+        )
+
+    async def create_user(self, user: "User") -> Optional["PersistedUser"]:
+        ts = self._get_current_timestamp()
+        user_id = str(uuid.uuid4())
+        metadata = json.dumps(user.metadata or {}, ensure_ascii=False)
+
+        def create(conn: sqlite3.Connection) -> sqlite3.Row:
+            conn.execute(
+                """
+                INSERT INTO users (id, identifier, metadata, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (identifier) DO UPDATE SET metadata = excluded.metadata
+                """,
+                (user_id, user.identifier, metadata, ts),
+            )
+            return conn.execute(
+                "SELECT * FROM users WHERE identifier = ?", (user.identifier,)
+            ).fetchone()
+
+        row = await self._run(create)
+        return PersistedUser(
+            id=row["id"],
+            identifier=row["identifier"],
+            createdAt=row["created_at"],
+            metadata=json.loads(row["metadata"]),
+        )
+
+    async def delete_feedback(self, feedback_id: str) -> bool:
+        await self._run(
+            lambda conn: conn.execute(
+                "DELETE FROM feedbacks WHERE id = ?", (feedback_id,)
+            )
+        )
+        return True
+
+    async def upsert_feedback(self, feedback: Feedback) -> str:
+        feedback_id = feedback.id or str(uuid.uuid4())
+
+        def upsert(conn: sqlite3.Connection) -> str:
+            conn.execute(
+                """
+                INSERT INTO feedbacks (id, for_id, thread_id, value, comment) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (for_id) DO UPDATE SET value = excluded.value, comment = excluded.comment
+                """,
+                (
+                    feedback_id,
+                    feedback.forId,
+                    feedback.threadId,
+                    feedback.value,
+                    feedback.comment,
+                ),
+            )
+            return conn.execute(
+                "SELECT id FROM feedbacks WHERE for_id = ?", (feedback.forId,)
+            ).fetchone()["id"]
+
+        return await self._run(upsert)
+
+    @queue_until_user_message()
+    async def create_element(self, element: "Element"):
+        if not element.for_id:
+            return
+
+        if not self.storage_provider:
+            logger.warning("SQLite: create_element skipped, no storage_provider is configured")
+            return
+
+        content = element.content
+        if content is None and element.path:
+            async with aiofiles.open(element.path, "rb") as f:
+                content = await f.read()
+        if content is None:
+            raise ValueError("Element path or content must be provided")
+
+        context_user = self.context.session.user
+        user_folder = getattr(context_user, "id", "unknown")
+        uploaded_file = await self.storage_provider.upload_file(
+            object_key=f"{user_folder}/{element.thread_id}/{element.id}",
+            data=content,
+            mime=element.mime or "application/octet-stream",
+            overwrite=True,
+        )
+
+        element_dict: Dict[str, Any] = element.to_dict()  # type: ignore
+        element_dict.update(
+            {
+                "url": uploaded_file.get("url"),
+                "objectKey": uploaded_file.get("object_key"),
+            }
+        )
+        data = json.dumps(element_dict, ensure_ascii=False)
+        await self._run(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO elements (id, thread_id, data) VALUES (?, ?, ?)",
+                (element.id, element.thread_id, data),
+            )
+        )
+
+    async def get_element(
+        self, thread_id: str, element_id: str
+    ) -> Optional["ElementDict"]:
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT data FROM elements WHERE id = ? AND thread_id = ?",
+                (element_id, thread_id),
+            ).fetchone()
+        )
+        return json.loads(row["data"]) if row else None
+
+    @queue_until_user_message()
+    async def delete_element(self, element_id: str, thread_id: Optional[str] = None):
+        await self._run(
+            lambda conn: conn.execute("DELETE FROM elements WHERE id = ?", (element_id,))
+        )
+
+    @queue_until_user_message()
+    async def create_step(self, step_dict: "StepDict"):
+        await self._run(lambda conn: self._upsert_step(conn, step_dict))
+
+    @queue_until_user_message()
+    async def update_step(self, step_dict: "StepDict"):
+        await self._run(lambda conn: self._upsert_step(conn, step_dict))
+
+    def _upsert_step(self, conn: sqlite3.Connection, step_dict: "StepDict") -> None:
+        """Insert the step or merge the non-empty fields into the stored step."""
+        ts = self._get_current_timestamp()
+        thread_id = step_dict["threadId"]  # type: ignore
+        conn.execute(
+            "INSERT OR IGNORE INTO threads (id, created_at, updated_at) VALUES (?, ?, ?)",
+            (thread_id, ts, ts),
+        )
+
+        row = conn.execute(
+            "SELECT data FROM steps WHERE id = ?", (step_dict["id"],)  # type: ignore
+        ).fetchone()
+        data = json.loads(row["data"]) if row else {}
+        data.update({k: v for k, v in step_dict.items() if v is not None})
+        data.pop("feedback", None)  # stored in the feedbacks table
+
+        conn.execute(
+            "INSERT OR REPLACE INTO steps (id, thread_id, created_at, data) VALUES (?, ?, ?, ?)",
+            (
+                data["id"],
+                thread_id,
+                data.get("createdAt") or ts,
+                json.dumps(data, ensure_ascii=False),
+            ),
+        )
+
+    @queue_until_user_message()
+    async def delete_step(self, step_id: str):
+        def delete(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM feedbacks WHERE for_id = ?", (step_id,))
+            conn.execute("DELETE FROM steps WHERE id = ?", (step_id,))
+
+        await self._run(delete)
+
+    async def get_thread_author(self, thread_id: str) -> str:
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT user_identifier FROM threads WHERE id = ?", (thread_id,)
+            ).fetchone()
+        )
+        if row is None or row["user_identifier"] is None:
+            raise ValueError(f"Author not found for thread_id {thread_id}")
+        return row["user_identifier"]
+
+    async def delete_thread(self, thread_id: str):
+        def delete(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM feedbacks WHERE thread_id = ?", (thread_id,))
+            conn.execute("DELETE FROM elements WHERE thread_id = ?", (thread_id,))
+            conn.execute("DELETE FROM steps WHERE thread_id = ?", (thread_id,))
+            conn.execute("DELETE FROM threads WHERE id = ?", (thread_id,))
+
+        await self._run(delete)
+
+    async def list_threads(
+        self, pagination: "Pagination", filters: "ThreadFilter"
+    ) -> "PaginatedResponse[ThreadDict]":
+        """List the threads of the user, newest created first, with keyset pagination from the thread id cursor."""
+        query = "SELECT id, name, created_at FROM threads WHERE user_id = ?"
+        params: List[Any] = [filters.userId]
+
+        if pagination.cursor:
+            query += " AND (created_at, id) < (SELECT created_at, id FROM threads WHERE id = ?)"
+            params.append(pagination.cursor)
+        if filters.search:
+            query += " AND name LIKE ?"
+            params.append(f"%{filters.search}%")
+        if filters.feedback is not None:
+            query += " AND EXISTS (SELECT 1 FROM feedbacks WHERE feedbacks.thread_id = threads.id AND feedbacks.value = ?)"
+            params.append(filters.feedback)
+
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(pagination.first + 1)
+
+        rows = await self._run(lambda conn: conn.execute(query, params).fetchall())
+        has_next_page = len(rows) > pagination.first
+        rows = rows[: pagination.first]
+
+        return PaginatedResponse(
+            data=[
+                ThreadDict(  # type: ignore
+                    id=row["id"],
+                    createdAt=row["created_at"],
+                    name=row["name"],
+                )
+                for row in rows
+            ],
+            pageInfo=PageInfo(
+                hasNextPage=has_next_page,
+                startCursor=pagination.cursor,
+                endCursor=rows[-1]["id"] if rows else None,
+            ),
+        )
+
+    async def get_thread(self, thread_id: str) -> "Optional[ThreadDict]":
+        def load(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            thread = conn.execute(
+                "SELECT * FROM threads WHERE id = ?", (thread_id,)
+            ).fetchone()
+            if thread is None:
+                return None
+
+            steps = conn.execute(
+                "SELECT data FROM steps WHERE thread_id = ? ORDER BY created_at",
+                (thread_id,),
+            ).fetchall()
+            feedbacks = conn.execute(
+                "SELECT * FROM feedbacks WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            elements = conn.execute(
+                "SELECT data FROM elements WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            return {
+                "thread": thread,
+                "steps": [json.loads(row["data"]) for row in steps],
+                "feedbacks": {row["for_id"]: row for row in feedbacks},
+                "elements": [json.loads(row["data"]) for row in elements],
+            }
+
+        result = await self._run(load)
+        if result is None:
+            return None
+
+        for step in result["steps"]:
+            feedback = result["feedbacks"].get(step["id"])
+            if feedback:
+                step["feedback"] = {
+                    "id": feedback["id"],
+                    "forId": feedback["for_id"],
+                    "value": feedback["value"],
+                    "comment": feedback["comment"],
+                }
+
+        if self.storage_provider is not None:
+            for element in result["elements"]:
+                if element.get("objectKey"):
+                    element["url"] = await self.storage_provider.get_read_url(
+                        object_key=element["objectKey"],
+                    )
+
+        thread = result["thread"]
+        return ThreadDict(
+            id=thread["id"],
+            createdAt=thread["created_at"],
+            name=thread["name"],
+            userId=thread["user_id"],
+            userIdentifier=thread["user_identifier"],
+            tags=json.loads(thread["tags"]) if thread["tags"] else None,
+            metadata=json.loads(thread["metadata"]) if thread["metadata"] else {},
+            steps=result["steps"],
+            elements=result["elements"],
+        )
+
+    async def update_thread(
+        self,
+        thread_id: str,
+        name: Optional[str] = None,
+        user_id: Optional[str] = None,
+        metadata: Optional[Dict] = None,
+        tags: Optional[List[str]] = None,
+    ):
+        ts = self._get_current_timestamp()
+        params = (
+            thread_id,
+            name,
+            user_id,
+            user_id,
+            json.dumps(tags) if tags is not None else None,
+            json.dumps(metadata, ensure_ascii=False) if metadata is not None else None,
+            ts,
+            ts,
+        )
+        await self._run(
+            lambda conn: conn.execute(
+                """
+                INSERT INTO threads (id, name, user_id, user_identifier, tags, metadata, created_at, updated_at)
+                VALUES (?, ?, ?, (SELECT identifier FROM users WHERE id = ?), ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    name = COALESCE(excluded.name, threads.name),
+                    user_id = COALESCE(excluded.user_id, threads.user_id),
+                    user_identifier = COALESCE(excluded.user_identifier, threads.user_identifier),
+                    tags = COALESCE(excluded.tags, threads.tags),
+                    metadata = COALESCE(excluded.metadata, threads.metadata),
+                    updated_at = excluded.updated_at
+                """,
+                params,
+            )
+        )
+
+    async def update_thread_metadata(self, thread_id: str, key: str, value: Any) -> None:
+        """
+        Write a single key of the thread metadata, the other keys are left as they are.
+
+        Args:
+            thread_id (str): Thread id
+            key (str): Metadata key
+            value (Any): JSON serializable value
+        """
+        await self._run(
+            lambda conn: conn.execute(
+                """
+                UPDATE threads
+                SET metadata = json_set(COALESCE(metadata, '{}'), '$.' || ?, json(?)), updated_at = ?
+                WHERE id = ?
+                """,
+                (key, json.dumps(value, ensure_ascii=False), self._get_current_timestamp(), thread_id),
+            )
+        )
+
+    async def build_debug_url(self) -> str:
+        return ""
+
+    async def close(self) -> None:
+        if self.storage_provider:
+            await self.storage_provider.close()
+        await self._run(lambda conn: conn.execute("PRAGMA optimize"))
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,109 @@
+import asyncio
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from chainlit.element import ElementBased
+
+from src.handlers.file_handler import FileLoadHandler
+from src.handlers.image_file_handler import ImageFileLoadHandler
+from src.constant import (
+    IMAGE_FILE_EXTENSIONS,
+    MAX_ATTACHMENT_CONCURRENCY,
+    MAX_ATTACHMENT_TOTAL_BYTES,
+    TEXT_FILE_EXTENSIONS,
+)
+from src.utils.logger import logger
+
+
+class AttachmentHandler:
+    """Handler for all attachments of a single message"""
+
+    def __init__(
+        self,
+        file_handler: FileLoadHandler,
+        image_file_handler: ImageFileLoadHandler,
+        max_concurrency: int = MAX_ATTACHMENT_CONCURRENCY,
+        max_total_bytes: int = MAX_ATTACHMENT_TOTAL_BYTES,
+    ):
+        """
+        Args:
+            file_handler (FileLoadHandler): Text file handler instance
+            image_file_handler (ImageFileLoadHandler): Image file handler instance
+            max_concurrency (int): Maximum number of attachments parsed at once per message
+            max_total_bytes (int): Maximum total size of the attachments per message
+        """
+        self.file_handler = file_handler
+        self.image_file_handler = image_file_handler
+        self.max_concurrency = max_concurrency
+        self.max_total_bytes = max_total_bytes
+
+    @property
+    def available_file_extensions(self) -> List[str]:
+        return TEXT_FILE_EXTENSIONS + IMAGE_FILE_EXTENSIONS
+
+    def validate(self, elements: List[ElementBased]) -> Optional[str]:
+        """
+        Check the file formats and the total size of the attachments.
+
+        Args:
+            elements (List[ElementBased]): Attached elements of the message
+
+        Returns:
+            Optional[str]: Error message for the user, None if the attachments are valid
+        """
+        total_bytes = 0
+        for element in self._local_elements(elements):
+            file_path = Path(element.path)
+            if file_path.suffix.lower() not in self.available_file_extensions:
+                return f"file format is not supported: {file_path.name}\n**supported file formats:** {self.available_file_extensions}"
+            total_bytes += file_path.stat().st_size
+
+        if total_bytes > self.max_total_bytes:
+            return f"attachments are too large: {total_bytes // (1024 * 1024)} MB\n**maximum total size:** {self.max_total_bytes // (1024 * 1024)} MB"
+        return None
+
+    async def handle(
+        self, elements: List[ElementBased]
+    ) -> Tuple[Optional[str], List[dict]]:
+        """
+        Parse all attachments concurrently and combine them into one context.
+
+        Args:
+            elements (List[ElementBased]): Attached elements of the message
+
+        Returns:
+            Tuple[Optional[str], List[dict]]: Combined text context and image contents
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def load(element: ElementBased) -> Optional[str | dict]:
+            async with semaphore:
+                if Path(element.path).suffix.lower() in IMAGE_FILE_EXTENSIONS:
+                    return await self.image_file_handler.handle(element)
+                return await self.file_handler.handle(element)
+
+        local_elements = self._local_elements(elements)
+        results = await asyncio.gather(*(load(element) for element in local_elements))
+
+        text_contexts: List[str] = []
+        image_contexts: List[dict] = []
+        for element, result in zip(local_elements, results):
+            if result is None:
+                continue
+            if isinstance(result, dict):
+                image_contexts.append(result)
+            else:
+                text_contexts.append(f'<file name="{element.name}">\n{result}\n</file>')
+
+        logger.info(
+            "Attachments processed",
+            count=len(local_elements),
+            text_count=len(text_contexts),
+            image_count=len(image_contexts),
+        )
+        text_context = "\n\n".join(text_contexts) if text_contexts else None
+        return text_context, image_contexts
+
+    def _local_elements(self, elements: List[ElementBased]) -> List[ElementBased]:
+        """Return only the elements uploaded as local files."""
+        return [element for element in elements if element.path]
@@ -1,17 +1,31 @@
 import os
 import json
+import asyncio
 import traceback
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional
 
-import pdfplumber
 import chainlit as cl
 from chainlit.element import ElementBased
 
+from src.constant import ContextEncoding
+from src.utils.context_encoder import (
+    encode_json,
+    encode_pdf_pages,
+    normalize_whitespace,
+    report_token_reduction,
+)
 from src.utils.logger import logger
 
 
 class FileLoadHandler:
+    def __init__(self, context_encoding: ContextEncoding = ContextEncoding.COMPACT):
+        """
+        Args:
+            context_encoding (ContextEncoding): Encoding of the file contents for the model context
+        """
+        self.context_encoding = context_encoding
+
     async def handle(self, file: ElementBased) -> Optional[str | dict]:
         """
         Process uploaded files and return file contents.
@@ -32,12 +46,14 @@ class FileLoadHandler:
                          size=file_path.stat().st_size,
                          extension=file_ext)
 
+            # parsing is blocking, run it in a worker thread so that
+            # multiple attachments can be parsed concurrently
             if file_ext == ".pdf":
-                return await self._parse_pdf(file_path)
+                return await asyncio.to_thread(self._parse_pdf, file_path)
             elif file_ext == ".json":
-                return self._parse_json(file_path)
+                return await asyncio.to_thread(self._parse_json, file_path)
             else:  # .md
-                return self._parse_text(file_path)
+                return await asyncio.to_thread(self._parse_text, file_path)
         except Exception as e:
             logger.error(
                 "Error occurred while processing the file",
@@ -48,7 +64,7 @@ class FileLoadHandler:
             ).send()
             return None
 
-    async def _parse_pdf(self, file_path: Path) -> str:
+    def _parse_pdf(self, file_path: Path) -> str:
         """
         Parse a PDF file and convert it to text.
 
@@ -58,7 +74,7 @@ class FileLoadHandler:
         Returns:
             str: Extracted text
         """
-        text_parts = []
+        pages: List[Dict[str, Any]] = []
         pdf_path = str(file_path.absolute())
 
         logger.info("Start parsing the PDF file",
@@ -76,6 +92,9 @@ class FileLoadHandler:
                     f"No read permission for the PDF file: {pdf_path}"
                 )
 
+            # imported on the first PDF, it is not needed at startup
+            import pdfplumber
+
             with pdfplumber.open(pdf_path) as pdf:
                 logger.debug("PDF information",
                              page_count=len(pdf.pages))
@@ -87,11 +106,17 @@ class FileLoadHandler:
                 for page_num, page in enumerate(pdf.pages, 1):
                     logger.debug("Processing page",
                                  page_num=page_num)
+                    extracted: Dict[str, Any] = {
+                        "page_num": page_num,
+                        "text": None,
+                        "tables": [],
+                        "error": None,
+                    }
+                    pages.append(extracted)
                     try:
                         text = page.extract_text(layout=True)
                         if text:
-                            text_parts.append(f"\n=== Page {page_num} ===\n")
-                            text_parts.append(text)
+                            extracted["text"] = text
                             logger.debug(
                                 "Successfully extracted text",
                                 page_num=page_num,
@@ -103,35 +128,23 @@ class FileLoadHandler:
                                 "Found tables",
                                 page_num=page_num,
                                 length=len(tables))
-                            text_parts.append(
-                                f"\n=== Page {page_num} tables ===\n")
-                            for table_num, table in enumerate(tables, 1):
-                                text_parts.append(f"\n[Table {table_num}]\n")
-                                for row in table:
-                                    row_text = " | ".join(
-                                        [
-                                            str(cell) if cell is not None else ""
-                                            for cell in row
-                                        ]
-                                    )
-                                    text_parts.append(row_text)
-                                text_parts.append("-" * 40)
+                            extracted["tables"] = tables
 
                     except Exception as e:
                         logger.error(
                             "Error occurred while processing the page",
                             page_num=page_num,
                             traceback=traceback.format_exc())
-                        text_parts.append(
-                            f"\n[Error occurred while processing the page {page_num}: {str(e)}]\n"
-                        )
+                        extracted["error"] = str(e)
                         continue
 
-            if not text_parts:
+            result = self._encode(
+                file_path, lambda encoding: encode_pdf_pages(pages, encoding)
+            )
+            if not result:
                 logger.warning("Could not extract text from the PDF file")
                 return "Could not extract text from the PDF file."
 
-            result = "\n".join(text_parts)
             logger.info(
                 "PDF parsing completed",
                 length=len(result))
@@ -149,9 +162,42 @@ class FileLoadHandler:
         """Parse a JSON file and convert it to a string."""
         with open(file_path, "r", encoding="utf-8") as file:
             data = json.load(file)
-            return json.dumps(data, ensure_ascii=False, indent=2)
+            return self._encode(file_path, lambda encoding: encode_json(data, encoding))
 
     def _parse_text(self, file_path: Path) -> str:
         """Read a text file (markdown, etc.) and return it."""
         with open(file_path, "r", encoding="utf-8") as file:
-            return file.read()
+            text = file.read()
+            # the text as read is its verbose encoding, it is not rendered again for the report
+            return self._encode(
+                file_path,
+                lambda encoding: (
+                    text if encoding == ContextEncoding.VERBOSE else normalize_whitespace(text)
+                ),
+                verbose_context=text,
+            )
+
+    def _encode(
+        self,
+        file_path: Path,
+        render: Callable[[ContextEncoding], str],
+        verbose_context: Optional[str] = None,
+    ) -> str:
+        """
+        Render the file contents with the configured context encoding.
+        The compact encoding also reports the token reduction against the verbose encoding.
+
+        Args:
+            file_path (Path): File path
+            render (Callable[[ContextEncoding], str]): Renders the parsed contents in the given encoding
+            verbose_context (Optional[str]): Verbose encoding already at hand, rendered when None
+
+        Returns:
+            str: Encoded file contents
+        """
+        context = render(self.context_encoding)
+        if self.context_encoding == ContextEncoding.COMPACT:
+            if verbose_context is None:
+                verbose_context = render(ContextEncoding.VERBOSE)
+            report_token_reduction(file_path.name, verbose_context, context)
+        return context
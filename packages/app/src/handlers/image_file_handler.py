@@ -1,14 +1,24 @@
 import io
+import asyncio
 import traceback
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Tuple
 from pathlib import Path
 
 import chainlit as cl
 from chainlit.element import ElementBased
-from PIL import Image
-
+from src.constant import (
+    IMAGE_FILE_EXTENSIONS,
+    IMAGE_FORMATS,
+    JPEG_QUALITY,
+    MAX_IMAGE_BYTES,
+    MAX_IMAGE_LONG_EDGE,
+    WEBP_QUALITY,
+)
 from src.utils.logger import logger
 
+if TYPE_CHECKING:
+    from PIL import Image
+
 
 class ImageFileLoadHandler:
     async def handle(self, file: ElementBased) -> Optional[str | dict]:
@@ -31,7 +41,7 @@ class ImageFileLoadHandler:
             )
 
             # Process image files
-            if file_ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
+            if file_ext in IMAGE_FILE_EXTENSIONS:
                 return await self._process_image(file_path)
             else:
                 return None
@@ -47,7 +57,8 @@ class ImageFileLoadHandler:
 
     async def _process_image(self, file_path: Path) -> dict:
         """
-        Process image files and convert them to a base64 encoded string.
+        Process image files and convert them to the Bedrock image content format.
+        Decoding and re-encoding run in a worker thread to keep the event loop free.
 
         Args:
             file_path (Path): Image file path
@@ -56,22 +67,96 @@ class ImageFileLoadHandler:
             dict: Dictionary containing image information
         """
         try:
-            # Open the image file
-            with Image.open(file_path) as img:
-                # Convert the image to bytes
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format=img.format)
-                img_byte_arr = img_byte_arr.getvalue()
-
-                return {
-                    "image": {
-                        "format": img.format.lower(),
-                        "source": {"bytes": img_byte_arr},
-                    }
+            original_size = file_path.stat().st_size
+            image_format, image_bytes = await asyncio.to_thread(
+                self._prepare_image, file_path
+            )
+            logger.info(
+                "Image prepared",
+                file_path=file_path,
+                format=image_format,
+                original_bytes=original_size,
+                encoded_bytes=len(image_bytes),
+                bytes_saved=original_size - len(image_bytes),
+            )
+
+            return {
+                "image": {
+                    "format": image_format,
+                    "source": {"bytes": image_bytes},
                 }
+            }
         except Exception as e:
             logger.error(
                 "Error occurred while processing the image",
                 traceback=traceback.format_exc(),
             )
             raise Exception(f"Failed to process the image: {str(e)}")
+
+    def _prepare_image(self, file_path: Path) -> Tuple[str, bytes]:
+        """
+        Fit the image into the model limits.
+        Images that are already compliant are passed through without re-encoding.
+
+        Args:
+            file_path (Path): Image file path
+
+        Returns:
+            Tuple[str, bytes]: Image format and image bytes
+        """
+        raw_bytes = file_path.read_bytes()
+        # imported on the first image, it is not needed at startup
+        from PIL import Image
+
+        with Image.open(io.BytesIO(raw_bytes)) as img:
+            image_format = (img.format or "").lower()
+            if (
+                image_format in IMAGE_FORMATS
+                and max(img.size) <= MAX_IMAGE_LONG_EDGE
+                and len(raw_bytes) <= MAX_IMAGE_BYTES
+            ):
+                return image_format, raw_bytes
+
+            return self._reencode_image(img, image_format)
+
+    def _reencode_image(self, img: "Image.Image", image_format: str) -> Tuple[str, bytes]:
+        """
+        Downscale the image to the longest edge limit and re-encode it.
+        PNG and GIF (screenshots, diagrams) stay lossless so text remains readable,
+        and fall back to WebP only when the lossless output is still too large.
+
+        Args:
+            img (Image.Image): Decoded image
+            image_format (str): Original image format
+
+        Returns:
+            Tuple[str, bytes]: Image format and image bytes
+        """
+        from PIL import Image, ImageOps
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in img.mode or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+        if max(img.size) > MAX_IMAGE_LONG_EDGE:
+            img.thumbnail(
+                (MAX_IMAGE_LONG_EDGE, MAX_IMAGE_LONG_EDGE), Image.Resampling.LANCZOS
+            )
+
+        if image_format == "jpeg":
+            return "jpeg", self._encode_image(
+                img.convert("RGB"), "JPEG", quality=JPEG_QUALITY, optimize=True
+            )
+
+        if image_format in ("png", "gif"):
+            encoded = self._encode_image(img, "PNG", optimize=True)
+            if len(encoded) <= MAX_IMAGE_BYTES:
+                return "png", encoded
+
+        return "webp", self._encode_image(img, "WEBP", quality=WEBP_QUALITY, method=4)
+
+    def _encode_image(self, img: "Image.Image", image_format: str, **params) -> bytes:
+        """Encode the image into bytes with the given format."""
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format=image_format, **params)
+        return img_byte_arr.getvalue()
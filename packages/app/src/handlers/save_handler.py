@@ -1,20 +1,52 @@
 import os
+import json
+import asyncio
+import hashlib
 import datetime
 import traceback
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 from pathlib import Path
 
 import chainlit as cl
-from strands.types.content import Message
+from chainlit.session import WebsocketSession
 
-from src.services.section_printer import SectionPrinterService
+from src.constant import SAVE_GROUP_MAX_OUTPUT_TOKENS, SECTIONS
+from src.data.save_jobs import SaveJobStore
+from src.services.section_printer import IncompleteSectionError, SectionPrinterService
+from src.utils.section_groups import (
+    SectionGroup,
+    estimate_section_tokens,
+    partition_sections,
+    section_numbers,
+)
+from src.utils.stop_message import find_missing_section
 from src.utils.logger import logger
 
+if TYPE_CHECKING:
+    from strands.types.content import Message
+
+
+class SectionGroupError(Exception):
+    """Raised when a section group could not be generated, the job fails with the error."""
+
+    def __init__(self, error: str, output: str):
+        super().__init__(error)
+        self.error = error
+        # shown in the document generation step
+        self.output = output
+
 
 class SaveHandler:
-    def __init__(self, section_printer_service: SectionPrinterService):
+    def __init__(
+        self,
+        section_printer_service: SectionPrinterService,
+        job_store: SaveJobStore,
+        parallelism: int = 1,
+    ):
         self.section_printer_service = section_printer_service
-        self.section_groups = [
+        self.job_store = job_store
+        # groups rendered ahead of time by the speculative printer, /save plans its groups per document
+        self.section_groups: List[SectionGroup] = [
             (
                 "Section 1",
                 "Section 2",
@@ -26,78 +58,264 @@ class SaveHandler:
             ("Section 7",),
             ("Section 8", "Section 9"),
         ]
+        # the template slices are compiled and versioned at startup with the other prompts
+        self.section_printer_service.register_section_groups(self.section_groups)
+        # section groups printed at the same time
+        self.parallelism = max(parallelism, 1)
+        # jobs generated by this process, they outlive the websocket handler
+        self._running_jobs: Dict[str, asyncio.Task] = {}
+        self._thread_jobs: Dict[str, str] = {}
 
-    async def handle_save_command(
-        self, message: cl.Message, recent_history: List[Message]
-    ) -> None:
+    def get_locale(self, message: cl.Message) -> str:
         """
-        Handle the /save command to generate and save a document in the specified locale.
+        Extract the locale from the /save command.
 
         Args:
             message (cl.Message): The user message containing the /save command
+
+        Returns:
+            str: Requested locale, English if not specified
         """
-        # Extract locale from the message
         locale = message.content.replace("/save", "").strip()
         if not locale:
             locale = "English"  # Default to English if no locale specified
+        return locale
+
+    def plan_section_groups(
+        self,
+        recent_history: List["Message"],
+        prerendered: Optional[Dict[SectionGroup, str]] = None,
+    ) -> List[SectionGroup]:
+        """
+        Split the sections into groups of balanced estimated output, up to the parallelism.
+        The groups rendered ahead of time are kept as they are.
+
+        Args:
+            recent_history (List[Message]): Conversation history
+            prerendered (Optional[Dict[SectionGroup, str]]): Section groups rendered ahead of time in the locale
+
+        Returns:
+            List[SectionGroup]: Section groups in document order
+        """
+        kept = [section_group for section_group in self.section_groups if section_group in (prerendered or {})]
+        covered = {number for section_group in kept for number in section_numbers(section_group)}
+        remaining = [number for number in range(1, len(SECTIONS) + 1) if number not in covered]
+
+        section_tokens = estimate_section_tokens(recent_history)
+        planned = [
+            tuple(f"Section {number}" for number in numbers)
+            for numbers in partition_sections(
+                remaining, section_tokens, self.parallelism, SAVE_GROUP_MAX_OUTPUT_TOKENS
+            )
+        ]
+        section_groups = sorted([*kept, *planned], key=lambda section_group: section_numbers(section_group)[0])
+        logger.info(
+            "Planned section groups",
+            section_groups=[", ".join(section_group) for section_group in section_groups],
+            estimated_tokens=[
+                sum(section_tokens.get(number, 0) for number in section_numbers(section_group))
+                for section_group in section_groups
+            ],
+            prerendered=len(kept),
+            parallelism=self.parallelism,
+        )
+        return section_groups
+
+    async def handle_save_command(
+        self,
+        message: cl.Message,
+        recent_history: List["Message"],
+        prerendered: Optional[Dict[SectionGroup, str]] = None,
+        section_groups: Optional[List[SectionGroup]] = None,
+        staggered: bool = True,
+    ) -> None:
+        """
+        Handle the /save command to generate and save a document in the specified locale.
+        The generation runs as a resumable job, an unfinished job of the same conversation, locale and groups is resumed.
+
+        Args:
+            message (cl.Message): The user message containing the /save command
+            recent_history (List[Message]): Conversation history with cache points
+            prerendered (Optional[Dict[SectionGroup, str]]): Section groups rendered ahead of time in the locale
+            section_groups (Optional[List[SectionGroup]]): Groups planned by plan_section_groups, planned here if None
+            staggered (bool): Start the other groups once the first one streams, False if the history is already cached
+        """
+        locale = self.get_locale(message)
+        if section_groups is None:
+            section_groups = self.plan_section_groups(recent_history, prerendered)
 
-        document_sections = {}
+        thread_id = message.thread_id
+        history_hash = self._fingerprint_history(recent_history, section_groups)
+        job = await self.job_store.find_resumable_job(thread_id, locale, history_hash)
+        if job and job["id"] in self._running_jobs:
+            await cl.Message(
+                content=f"The document in {locale} is still being generated.",
+                metadata={"exclude_from_history": True},
+            ).send()
+            return
+
+        if job:
+            job_id = job["id"]
+            checkpoints = await self.job_store.get_checkpoints(job_id)
+            logger.info(
+                "Resuming save job",
+                job_id=job_id,
+                locale=locale,
+                done_groups=sorted(checkpoints),
+            )
+            await self.job_store.update_job(job_id, "running")
+        else:
+            job_id = await self.job_store.create_job(thread_id, locale, history_hash)
+            checkpoints = {}
+            logger.info("Created save job", job_id=job_id, locale=locale)
+
+        # speculative renders become checkpoints of the job
+        for group_index, section_group in enumerate(section_groups):
+            if group_index not in checkpoints and section_group in (prerendered or {}):
+                checkpoints[group_index] = prerendered[section_group]
+                await self.job_store.save_checkpoint(
+                    job_id, group_index, checkpoints[group_index]
+                )
+
+        task = asyncio.create_task(
+            self._run_job(job_id, recent_history, locale, section_groups, checkpoints, staggered)
+        )
+        self._running_jobs[job_id] = task
+        self._thread_jobs[thread_id] = job_id
+        task.add_done_callback(lambda _: self._forget_job(thread_id, job_id))
+        # the job keeps running if the user leaves, the document is delivered on resume
+        await asyncio.shield(task)
+
+    def cancel_job(self, thread_id: str) -> bool:
+        """
+        Cancel the running save job of the thread, the generated sections stay checkpointed.
+
+        Args:
+            thread_id (str): Thread id
+
+        Returns:
+            bool: True if a job was cancelled
+        """
+        task = self._running_jobs.get(self._thread_jobs.get(thread_id, ""))
+        if not task or task.done():
+            return False
+
+        logger.info("Cancelling save job", thread_id=thread_id)
+        task.cancel()
+        return True
+
+    def _forget_job(self, thread_id: str, job_id: str) -> None:
+        self._running_jobs.pop(job_id, None)
+        if self._thread_jobs.get(thread_id) == job_id:
+            del self._thread_jobs[thread_id]
+
+    async def deliver_finished_jobs(self, thread_id: str) -> None:
+        """
+        Send the documents generated while the user was away, and report the jobs a restart interrupted.
+
+        Args:
+            thread_id (str): Thread id
+        """
+        for job in await self.job_store.list_undelivered_jobs(thread_id):
+            if job["status"] == "interrupted":
+                await cl.Message(
+                    content=f"Generating the document in {job['locale']} was interrupted by a restart. Run `/save {job['locale']}` again to resume it, the generated sections are kept.",
+                    metadata={"exclude_from_history": True},
+                ).send()
+                await self.job_store.mark_delivered(job["id"])
+                logger.info("Reported interrupted save job", job_id=job["id"])
+                continue
+
+            if not job["file_path"] or not os.path.exists(job["file_path"]):
+                await self.job_store.mark_delivered(job["id"])
+                continue
+
+            await self._send_document(job["file_path"], job["locale"])
+            await self.job_store.mark_delivered(job["id"])
+            logger.info("Delivered saved document", job_id=job["id"])
+
+    async def _run_job(
+        self,
+        job_id: str,
+        recent_history: List["Message"],
+        locale: str,
+        section_groups: List[SectionGroup],
+        checkpoints: Dict[int, str],
+        staggered: bool = True,
+    ) -> None:
+        """
+        Generate the missing section groups of the job, up to the parallelism at a time, and save the document.
+
+        Args:
+            job_id (str): Job id
+            recent_history (List[Message]): Conversation history with cache points
+            locale (str): Document locale
+            section_groups (List[SectionGroup]): Section groups of the job in document order
+            checkpoints (Dict[int, str]): Already generated content by section group index
+            staggered (bool): Start the other groups once the first one streams
+        """
+        document_sections: Dict[SectionGroup, str] = {}
+        saved = False
         async with cl.Step(name="Generating document", type="tool") as step:
             try:
-                # Generate the document in batches using section groups
-                for section_group in self.section_groups:
-                    group_name = ", ".join(section_group)
-
-                    # Create a step to show progress
-                    async with cl.Step(name=group_name, type="tool") as each_step:
-                        each_step.input = f"Generating {group_name} in {locale}"
-
-                        # Build messages for section printer
-                        messages = (
-                            self.section_printer_service.build_section_printer_messages(
-                                recent_history=recent_history,
-                                section=section_group,
-                                locale=locale,
-                            )
-                        )
+                # stop before calling the model if a remaining section was never discussed
+                missing_section = find_missing_section(
+                    recent_history,
+                    [
+                        section
+                        for group_index, section_group in enumerate(section_groups)
+                        if group_index not in checkpoints
+                        for section in section_group
+                    ],
+                )
+                if missing_section is not None:
+                    await self._fail_incomplete(job_id, step, locale, missing_section)
+                    return
 
-                        # Collect section content
-                        section_content = ""
-                        try:
-                            async for (
-                                chunk
-                            ) in self.section_printer_service.stream_llm_response(
-                                messages,
-                                system_prompt=self.section_printer_service.get_system_prompt(),
-                            ):
-                                section_content += chunk
-                                await each_step.stream_token(chunk)
-                            logger.info(
-                                "Generated section",
-                                group_name=group_name,
-                                locale=locale,
-                                length=len(section_content),
-                            )
-                        except Exception as e:
-                            logger.error("Error on streaming LLM response", error=e)
-                            step.output = (
-                                f"An error occurred while saving the document: {str(e)}"
-                            )
-                            return
-
-                        # check if the section is complete, heuristic: if the section is less than 100 words, it is incomplete
-                        if len(section_content.strip()) < 100:
-                            logger.info(
-                                "Incomplete section",
-                                group_name=group_name,
-                                locale=locale,
-                                length=len(section_content),
-                            )
-                            step.output = f"{group_name} is incomplete. Stopping..."
-                            return
+                for group_index, section_group in enumerate(section_groups):
+                    if group_index in checkpoints:
+                        logger.info(
+                            "Reusing generated section",
+                            job_id=job_id,
+                            group_name=", ".join(section_group),
+                        )
+                        document_sections[section_group] = checkpoints[group_index]
 
-                        # Store the section in the document_sections dictionary
-                        document_sections[section_group] = section_content
+                # Generate the missing section groups, a failed group stops the others.
+                # Unless the history was warmed, the first group writes the cached history
+                # and the others start once it streams and read it.
+                semaphore = asyncio.Semaphore(self.parallelism)
+                history_cached = asyncio.Event()
+                if not staggered:
+                    history_cached.set()
+                pending = [
+                    (group_index, section_group)
+                    for group_index, section_group in enumerate(section_groups)
+                    if group_index not in checkpoints
+                ]
+                tasks = [
+                    asyncio.create_task(
+                        self._generate_group(
+                            job_id,
+                            group_index,
+                            section_group,
+                            recent_history,
+                            locale,
+                            semaphore,
+                            history_cached,
+                            document_sections,
+                            first=i == 0,
+                        )
+                    )
+                    for i, (group_index, section_group) in enumerate(pending)
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
 
                 async with cl.Step(name="Save document", type="tool"):
                     # Combine all sections into a final document
@@ -107,37 +325,230 @@ class SaveHandler:
                     file_path = await self._save_document_to_file(
                         final_document, locale
                     )
+                    await self.job_store.update_job(job_id, "done", file_path=file_path)
+                    saved = True
 
-                    # Create a downloadable file
-                    file = cl.File(name=os.path.basename(file_path), path=file_path)
-
-                    # Send the message with the document link, exclude the message from the history
-                    await cl.Message(
-                        content=f"Document has been generated in {locale}. Click the attachment to download.",
-                        elements=[file],
-                        metadata={"exclude_from_history": True},
-                    ).send()
+                    # a message sent while disconnected would be persisted and sent again on resume
+                    if not self._is_connected():
+                        logger.info("Session disconnected, the document is delivered on resume", job_id=job_id)
+                    else:
+                        try:
+                            await self._send_document(file_path, locale)
+                        except Exception:
+                            # the job stays done and undelivered, deliver_finished_jobs sends it on resume
+                            logger.warning(
+                                "Error on sending the document, it is delivered on resume",
+                                job_id=job_id,
+                                traceback=traceback.format_exc(),
+                            )
+                        else:
+                            await self.job_store.mark_delivered(job_id)
 
+            except IncompleteSectionError as e:
+                await self._fail_incomplete(job_id, step, locale, e.section)
+            except SectionGroupError as e:
+                await self.job_store.update_job(job_id, "failed", error=e.error)
+                step.output = e.output
+            except asyncio.CancelledError:
+                if saved:
+                    # stopped while sending, the finished document is delivered on resume
+                    raise
+                group_name = next(
+                    (
+                        ", ".join(section_group)
+                        for section_group in section_groups
+                        if section_group not in document_sections
+                    ),
+                    ", ".join(section_groups[-1]),
+                )
+                await self.job_store.update_job(job_id, "failed", error="stopped by the user")
+                step.output = f"Stopped by the user.\n{self._retry_hint(locale, group_name)}"
+                raise
             except Exception as e:
                 logger.error(
                     "Error on generating document", traceback=traceback.format_exc()
                 )
+                await self.job_store.update_job(job_id, "failed", error=str(e))
                 step.output = f"An error occurred while saving the document: {str(e)}"
 
-    def _combine_document_sections(self, document_sections: Dict[str, str]) -> str:
+    async def _generate_group(
+        self,
+        job_id: str,
+        group_index: int,
+        section_group: SectionGroup,
+        recent_history: List["Message"],
+        locale: str,
+        semaphore: asyncio.Semaphore,
+        history_cached: asyncio.Event,
+        document_sections: Dict[SectionGroup, str],
+        first: bool = False,
+    ) -> None:
+        """
+        Generate a section group and checkpoint it.
+
+        Args:
+            job_id (str): Job id
+            group_index (int): Index of the group in the job
+            section_group (SectionGroup): Sections to print
+            recent_history (List[Message]): Conversation history with cache points
+            locale (str): Document locale
+            semaphore (asyncio.Semaphore): Limits the groups generated at the same time
+            history_cached (asyncio.Event): Set once the first group has written the cached history
+            document_sections (Dict[SectionGroup, str]): Generated content by section group, updated in place
+            first (bool): Whether this group writes the cached history for the others
+
+        Raises:
+            IncompleteSectionError: If the model reports an incomplete section
+            SectionGroupError: If the group could not be generated
+        """
+        group_name = ", ".join(section_group)
+        if not first:
+            # the prompt cache serves a prefix once the request writing it streams
+            await history_cached.wait()
+        async with semaphore:
+            # Create a step to show progress
+            async with cl.Step(name=group_name, type="tool") as each_step:
+                each_step.input = f"Generating {group_name} in {locale}"
+
+                # Build messages for section printer
+                messages = self.section_printer_service.build_section_printer_messages(
+                    recent_history=recent_history,
+                    section=section_group,
+                    locale=locale,
+                )
+
+                # Collect section content
+                section_content = ""
+                stream = self.section_printer_service.stream_section(messages)
+                try:
+                    async for chunk in stream:
+                        history_cached.set()
+                        section_content += chunk
+                        await each_step.stream_token(chunk)
+                    logger.info(
+                        "Generated section",
+                        group_name=group_name,
+                        locale=locale,
+                        length=len(section_content),
+                    )
+                except (IncompleteSectionError, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    logger.error("Error on streaming LLM response", error=e)
+                    raise SectionGroupError(
+                        str(e),
+                        f"An error occurred while saving the document: {str(e)}\n{self._retry_hint(locale, group_name)}",
+                    ) from e
+                finally:
+                    # aborts the model request when the job is stopped
+                    await stream.aclose()
+                    # a failed first group stops the others anyway
+                    history_cached.set()
+
+                # fallback when the stop message is not detected, heuristic: if the section is less than 100 words, it is incomplete
+                if len(section_content.strip()) < 100:
+                    logger.info(
+                        "Incomplete section",
+                        group_name=group_name,
+                        locale=locale,
+                        length=len(section_content),
+                    )
+                    raise SectionGroupError(
+                        f"{group_name} is incomplete", f"{group_name} is incomplete. Stopping..."
+                    )
+
+                # Store the section in the document_sections dictionary
+                document_sections[section_group] = section_content
+                await self.job_store.save_checkpoint(job_id, group_index, section_content)
+
+    async def _fail_incomplete(
+        self, job_id: str, step: cl.Step, locale: str, section: int
+    ) -> None:
+        """
+        Fail the job on an incomplete section.
+
+        Args:
+            job_id (str): Job id
+            step (cl.Step): Document generation step
+            locale (str): Document locale
+            section (int): Incomplete section number
+        """
+        logger.info("Incomplete section", section=section, locale=locale)
+        await self.job_store.update_job(
+            job_id, "failed", error=f"Section {section} is incomplete"
+        )
+        step.output = f"Section {section} is incomplete. Please complete it before saving the document."
+
+    async def _send_document(self, file_path: str, locale: str) -> None:
+        """
+        Send the saved document as a downloadable file.
+
+        Args:
+            file_path (str): Saved document path
+            locale (str): Document locale
+        """
+        # Create a downloadable file
+        file = cl.File(name=os.path.basename(file_path), path=file_path)
+
+        # Send the message with the document link, exclude the message from the history
+        await cl.Message(
+            content=f"Document has been generated in {locale}. Click the attachment to download.",
+            elements=[file],
+            metadata={"exclude_from_history": True},
+        ).send()
+
+    def _is_connected(self) -> bool:
+        """Check if the websocket session of the job is still connected."""
+        session = cl.context.session
+        return (
+            isinstance(session, WebsocketSession)
+            and WebsocketSession.get_by_id(session.id) is not None
+        )
+
+    def _retry_hint(self, locale: str, group_name: str) -> str:
+        return f"Run `/save {locale}` again to retry from {group_name}, the generated sections are kept."
+
+    def _fingerprint_history(
+        self, recent_history: List["Message"], section_groups: Sequence[SectionGroup]
+    ) -> str:
+        """
+        Fingerprint the conversation, the section groups and their prompts, ignoring the cache points.
+        The checkpoints are indexed by group, so a job only resumes with the same groups.
+
+        Args:
+            recent_history (List[Message]): Conversation history
+            section_groups (Sequence[SectionGroup]): Section groups of the job
+
+        Returns:
+            str: SHA-256 of the prompt versions and the roles and texts of the history
+        """
+        texts: List[Tuple[str, str]] = [
+            ("system", self.section_printer_service.get_prompt_version(section_groups)),
+            *(
+                (message["role"], block["text"])
+                for message in recent_history
+                for block in message["content"]
+                if "text" in block
+            ),
+        ]
+        return hashlib.sha256(
+            json.dumps(texts, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def _combine_document_sections(self, document_sections: Dict[SectionGroup, str]) -> str:
         """
         Combines all document sections into a single document.
 
         Args:
-            document_sections (Dict[str, str]): Dictionary of section IDs to their content
+            document_sections (Dict[SectionGroup, str]): Dictionary of section groups to their content
 
         Returns:
             str: The combined document
         """
         combined_document = "# ALPS Document\n\n"
 
-        # Add sections in order
-        for key in document_sections:
+        # Add sections in document order, the groups finish in any order
+        for key in sorted(document_sections, key=section_numbers):
             combined_document += document_sections[key] + "\n\n"
 
         return combined_document
@@ -0,0 +1,37 @@
+from typing import Any, Dict
+
+from strands.models.anthropic import AnthropicModel
+
+CACHE_CONTROL: Dict[str, str] = {"type": "ephemeral"}
+
+
+class CachingAnthropicModel(AnthropicModel):
+    """
+    Anthropic model provider with the prompt caching of the Bedrock provider.
+
+    The system prompt, which carries the ALPS template, gets a cache breakpoint like Bedrock's cache_prompt.
+    The cachePoint blocks of the history are mapped to cache_control by the base provider.
+    The usage metadata reports the cache reads and writes under the Bedrock keys, so the metrics match.
+    """
+
+    def format_request(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        request = super().format_request(*args, **kwargs)
+        system = request.get("system")
+        if isinstance(system, str):
+            request["system"] = [{"type": "text", "text": system, "cache_control": CACHE_CONTROL}]
+        elif isinstance(system, list) and system:
+            if not any("cache_control" in block for block in system):
+                system[-1]["cache_control"] = CACHE_CONTROL
+        return request
+
+    def format_chunk(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        chunk = super().format_chunk(event)
+        if event.get("type") == "metadata":
+            usage = chunk["metadata"]["usage"]
+            cache_read = event["usage"].get("cache_read_input_tokens") or 0
+            cache_write = event["usage"].get("cache_creation_input_tokens") or 0
+            if cache_read:
+                usage.setdefault("cacheReadInputTokens", cache_read)
+            if cache_write:
+                usage.setdefault("cacheWriteInputTokens", cache_write)
+        return chunk
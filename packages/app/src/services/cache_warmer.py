@@ -0,0 +1,348 @@
+import time
+import asyncio
+import traceback
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, List, Optional, Tuple
+
+from src.constant import (
+    CACHE_WARM_MARGIN,
+    CACHE_WARM_MAX_PER_IDLE,
+    CACHE_WARM_MIN_TOKENS,
+    OUTPUT_TOKEN_PRICE,
+    CACHE_WARM_PROMPT,
+    PROMPT_CACHE_READ_PRICE,
+    PROMPT_CACHE_TTL,
+    PROMPT_CACHE_WRITE_PRICE,
+    PromptFamily,
+)
+from src.services.llm import LLMService
+from src.services.prompt_cache import CachePlan, PromptCacheService, PromptCacheState
+from src.utils.memory import RecentMemoryManager
+from src.utils.token_estimator import token_estimator
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    from strands.types.content import Message
+
+# model service and system prompt of the requests of each prompt family
+PromptSource = Tuple[LLMService, Callable[[], str]]
+
+REASONS = ("keep_warm", "save")
+
+
+class CacheWarmer:
+    """
+    Keeps the prompt cache of the active sessions warm with single token requests.
+
+    Before the cowriter prefix of an idle session expires, a request reading it refreshes the TTL,
+    when the chance of the user returning within the next TTL makes the read cheaper than writing it again.
+    Before /save the history prefix is written once, so section groups running together all read it.
+    The requests of a worker share an hourly budget in uncached input token equivalents,
+    and the metrics compare their cost with the cache writes they saved.
+    """
+
+    def __init__(
+        self,
+        prompt_cache_service: PromptCacheService,
+        prompt_sources: Dict[PromptFamily, PromptSource],
+        hourly_budget: int,
+        margin: float = CACHE_WARM_MARGIN,
+    ):
+        """
+        Args:
+            prompt_cache_service (PromptCacheService): Prompt cache service
+            prompt_sources (Dict[PromptFamily, PromptSource]): Model service and system prompt getter by prompt family
+            hourly_budget (int): Uncached input token equivalents the warming requests may spend per hour
+            margin (float): Seconds before the expiry the keep-warm request is sent
+        """
+        self.prompt_cache_service = prompt_cache_service
+        self.prompt_sources = prompt_sources
+        self.hourly_budget = hourly_budget
+        self.margin = margin
+        self._timers: Dict[str, asyncio.Task] = {}
+        # cost of the recent warming requests, for the rolling hourly budget
+        self._spent: Deque[Tuple[float, float]] = deque()
+        # requests, cost and saved cost by reason, in uncached input token equivalents
+        self.metrics: Dict[str, Dict[str, float]] = {
+            reason: {"requests": 0, "cost": 0.0, "saved": 0.0} for reason in REASONS
+        }
+
+    def schedule(
+        self,
+        session_id: str,
+        state: PromptCacheState,
+        recent_memory: RecentMemoryManager,
+        is_active: Callable[[], bool],
+    ) -> None:
+        """
+        Keep the cowriter prefix of the session warm until the next turn.
+
+        Args:
+            session_id (str): Chat session id
+            state (PromptCacheState): Prompt cache state of the session
+            recent_memory (RecentMemoryManager): Recent memory of the session
+            is_active (Callable[[], bool]): Whether the user is still connected
+        """
+        self.cancel(session_id)
+        task = asyncio.create_task(self._keep_warm(state, recent_memory, is_active))
+        self._timers[session_id] = task
+        task.add_done_callback(lambda task: self._forget(session_id, task))
+
+    def cancel(self, session_id: str) -> None:
+        """Stop keeping the session warm, the next turn or the disconnect takes over."""
+        task = self._timers.pop(session_id, None)
+        if task:
+            task.cancel()
+
+    async def warm_before_save(
+        self,
+        recent_memory: RecentMemoryManager,
+        plan: CachePlan,
+        concurrent_calls: int,
+    ) -> bool:
+        """
+        Write the history prefix planned for /save ahead of the section groups.
+
+        Without it the groups are staggered, the first one writes the prefix and the others start once it streams
+        and read it. Warming gets the same reuse, so it saves only the write of the first group, which the warming
+        request pays instead. It costs one more read and its output, and gains the wait for the first group.
+        A single group writes the prefix itself, the warming request would only add its cost.
+
+        Args:
+            recent_memory (RecentMemoryManager): Recent memory of the session
+            plan (CachePlan): Plan of the section printer requests
+            concurrent_calls (int): Section printer requests sent at the same time
+
+        Returns:
+            bool: Whether the prefix was written, otherwise the first group writes it
+        """
+        if plan.write_index is None:
+            return False
+        if (PROMPT_CACHE_WRITE_PRICE - PROMPT_CACHE_READ_PRICE) * concurrent_calls <= PROMPT_CACHE_WRITE_PRICE:
+            logger.debug("Skipping cache warming before save", concurrent_calls=concurrent_calls)
+            return False
+
+        token_counts = recent_memory.get_token_counts()
+        expected_cost = PROMPT_CACHE_WRITE_PRICE * sum(token_counts[: plan.write_index + 1])
+        if not self._within_budget(expected_cost):
+            return False
+
+        history = recent_memory.get_conversation_history()
+        started_at = time.perf_counter()
+        usage = await self._warm(
+            PromptFamily.SECTION_PRINTER,
+            self.prompt_cache_service.add_cache_points_to_messages(
+                plan.cache_point_indices, history[: plan.write_index + 1]
+            ),
+            "save",
+        )
+        if usage is not None:
+            # against the staggered run, only the first group reads the prefix instead of writing it
+            self._credit(
+                "save",
+                (PROMPT_CACHE_WRITE_PRICE - PROMPT_CACHE_READ_PRICE)
+                * usage.get("cacheWriteInputTokens", 0),
+            )
+            # the other groups would have waited about as long for the first one to write the prefix
+            logger.info(
+                "Cache warming before save started the groups together",
+                concurrent_calls=concurrent_calls,
+                latency_gained=round(time.perf_counter() - started_at, 3),
+            )
+        return usage is not None
+
+    def credit(self, state: PromptCacheState, family: PromptFamily, plan: CachePlan) -> None:
+        """
+        Count the cache write saved by warming, if the turn read a prefix that had expired without it.
+
+        Args:
+            state (PromptCacheState): Prompt cache state of the session
+            family (PromptFamily): Prompt family of the turn
+            plan (CachePlan): Plan the turn was sent with
+        """
+        warmed = state.warmed.pop(family.value, {})
+        if plan.read_index is None or plan.read_index not in warmed:
+            return
+
+        expires_at, cached_tokens = warmed[plan.read_index]
+        if expires_at < time.time():
+            self._credit(
+                "keep_warm",
+                (PROMPT_CACHE_WRITE_PRICE - PROMPT_CACHE_READ_PRICE) * cached_tokens,
+            )
+
+    async def _keep_warm(
+        self,
+        state: PromptCacheState,
+        recent_memory: RecentMemoryManager,
+        is_active: Callable[[], bool],
+    ) -> None:
+        family = PromptFamily.COWRITER
+        _, get_system_prompt = self.prompt_sources[family]
+        while True:
+            prefix = self.prompt_cache_service.cached_prefix(state, family)
+            if prefix is None:
+                return
+            index, expires_at = prefix
+            await asyncio.sleep(max(expires_at - self.margin - time.time(), 0.0))
+
+            if not is_active():
+                return
+            if state.idle_warms >= CACHE_WARM_MAX_PER_IDLE:
+                logger.info("Cache warming stopped, the session is idle", idle_warms=state.idle_warms)
+                return
+
+            history = recent_memory.get_conversation_history()
+            if index >= len(history):
+                return
+            cached_tokens = sum(recent_memory.get_token_counts()[: index + 1]) + token_estimator.count(
+                get_system_prompt()
+            )
+            if cached_tokens < CACHE_WARM_MIN_TOKENS:
+                return
+
+            # the next turn reads the prefix instead of writing it again, if it arrives within the refreshed TTL
+            now = time.time()
+            return_probability = self.prompt_cache_service.return_probability(
+                state, now - (state.last_turn_at or now), PROMPT_CACHE_TTL
+            )
+            expected_saving = (
+                return_probability
+                * (PROMPT_CACHE_WRITE_PRICE - PROMPT_CACHE_READ_PRICE)
+                * cached_tokens
+            )
+            expected_cost = PROMPT_CACHE_READ_PRICE * cached_tokens + OUTPUT_TOKEN_PRICE
+            if expected_saving <= expected_cost:
+                logger.info(
+                    "Cache warming not worth it",
+                    return_probability=round(return_probability, 3),
+                    cached_tokens=cached_tokens,
+                )
+                return
+            if not self._within_budget(expected_cost):
+                return
+
+            # a prefix warmed again keeps the expiry it had without any warming
+            natural_expiry = state.warmed.get(family.value, {}).get(index, (expires_at, 0))[0]
+            usage = await self._warm(
+                family,
+                self.prompt_cache_service.add_cache_points_to_messages([index], history[: index + 1]),
+                "keep_warm",
+            )
+            if usage is None:
+                return
+
+            self.prompt_cache_service.record_request(
+                state,
+                family,
+                CachePlan(
+                    cache_point_indices=[index],
+                    read_index=index,
+                    write_index=None,
+                    expected_reuses=round(return_probability, 3),
+                    expected_cost=expected_cost,
+                    uncached_cost=float(cached_tokens),
+                ),
+                turn=False,
+            )
+            state.warmed.setdefault(family.value, {})[index] = (
+                natural_expiry,
+                usage.get("cacheReadInputTokens", 0),
+            )
+            state.idle_warms += 1
+
+    async def _warm(
+        self, family: PromptFamily, messages: List["Message"], reason: str
+    ) -> Optional[Dict[str, int]]:
+        """
+        Send a warming request over the history prefix with its cache points.
+
+        Args:
+            family (PromptFamily): Prompt family of the cached prefix
+            messages (List[Message]): History prefix with cache points
+            reason (str): keep_warm or save
+
+        Returns:
+            Optional[Dict[str, int]]: Usage metadata, None if the request failed
+        """
+        if not messages:
+            return None
+
+        # the prefix up to the last cache point stays as cached, the question goes after it
+        tail = {"text": CACHE_WARM_PROMPT}
+        if messages[-1]["role"] == "user":
+            messages[-1]["content"].append(tail)
+        else:
+            messages.append({"role": "user", "content": [tail]})
+
+        service, get_system_prompt = self.prompt_sources[family]
+        try:
+            usage = await service.warm_cache(messages, system_prompt=get_system_prompt())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning(
+                "Error on warming the prompt cache",
+                family=family.value,
+                traceback=traceback.format_exc(),
+            )
+            return None
+
+        cost = (
+            PROMPT_CACHE_READ_PRICE * usage.get("cacheReadInputTokens", 0)
+            + PROMPT_CACHE_WRITE_PRICE * usage.get("cacheWriteInputTokens", 0)
+            + usage.get("inputTokens", 0)
+            + OUTPUT_TOKEN_PRICE * usage.get("outputTokens", 0)
+        )
+        self._spent.append((time.time(), cost))
+        metrics = self.metrics[reason]
+        metrics["requests"] += 1
+        metrics["cost"] += cost
+        logger.info(
+            "Warmed prompt cache",
+            family=family.value,
+            reason=reason,
+            cache_read_input_tokens=usage.get("cacheReadInputTokens", 0),
+            cache_write_input_tokens=usage.get("cacheWriteInputTokens", 0),
+            cost=round(cost, 1),
+            **self._summary(reason),
+        )
+        return usage
+
+    def _credit(self, reason: str, saved: float) -> None:
+        self.metrics[reason]["saved"] += saved
+        logger.info(
+            "Prompt cache warming saved a write",
+            reason=reason,
+            saved=round(saved, 1),
+            **self._summary(reason),
+        )
+
+    def _summary(self, reason: str) -> Dict[str, float]:
+        metrics = self.metrics[reason]
+        return {
+            "total_requests": int(metrics["requests"]),
+            "total_cost": round(metrics["cost"], 1),
+            "total_saved": round(metrics["saved"], 1),
+            # positive once warming paid for itself
+            "net_saved": round(metrics["saved"] - metrics["cost"], 1),
+        }
+
+    def _within_budget(self, cost: float) -> bool:
+        now = time.time()
+        while self._spent and self._spent[0][0] < now - 3600:
+            self._spent.popleft()
+        spent = sum(spent_cost for _, spent_cost in self._spent)
+        if spent + cost > self.hourly_budget:
+            logger.info(
+                "Cache warming budget exhausted",
+                spent=round(spent, 1),
+                hourly_budget=self.hourly_budget,
+            )
+            return False
+        return True
+
+    def _forget(self, session_id: str, task: asyncio.Task) -> None:
+        # a cancelled timer may finish after its replacement was scheduled
+        if self._timers.get(session_id) is task:
+            del self._timers[session_id]
@@ -1,76 +1,267 @@
 import asyncio
-from typing import List, AsyncGenerator, Optional
-
-import boto3
-from strands.models.bedrock import BedrockModel
-from strands.models.anthropic import AnthropicModel
-from strands.types.content import Message
+import inspect
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, AsyncGenerator, Optional
 
 from src.config import config
 from src.constant import MAX_TOKENS, TEMPERATURE, LLMBackend
+from src.utils.token_estimator import token_estimator
 from src.utils.logger import logger
 
+if TYPE_CHECKING:
+    from strands.models.anthropic import AnthropicModel
+    from strands.models.bedrock import BedrockModel
+    from strands.types.content import Message
+
 
 class LLMService:
     def __init__(self, llm_backend: LLMBackend, model_id: str):
         self.llm_backend = llm_backend
         self.model_id = model_id
-        self.model: Optional[BedrockModel | AnthropicModel] = None
+        self._model: Optional["BedrockModel | AnthropicModel"] = None
+        # one token model for the cache warming requests
+        self._warm_model: Optional["BedrockModel | AnthropicModel"] = None
+        self._aborts_on_cancel: Optional[bool] = None
+        # the startup warmup creates the model in a worker thread
+        self._model_lock = threading.Lock()
+        # output token metrics, the average completed output estimates the tokens saved by a cancellation
+        self.completed_streams = 0
+        self.completed_output_tokens = 0
+        self.cancelled_streams = 0
+        self.saved_output_tokens = 0
+        # prompt cache metrics, both backends report the Bedrock usage keys
+        self.input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.cache_write_input_tokens = 0
+
+        if self.llm_backend not in (LLMBackend.AWS, LLMBackend.ANTHROPIC):
+            raise ValueError(f"Unsupported LLM backend: {self.llm_backend}")
+
+    @property
+    def model(self) -> "BedrockModel | AnthropicModel":
+        """Model provider, created on first use so the provider SDKs are not imported at startup."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._create_model()
+        return self._model
+
+    @property
+    def warm_model(self) -> "BedrockModel | AnthropicModel":
+        """Model provider answering with a single token, for the cache warming requests."""
+        if self._warm_model is None:
+            with self._model_lock:
+                if self._warm_model is None:
+                    self._warm_model = self._create_model(max_tokens=1)
+        return self._warm_model
 
+    @property
+    def aborts_on_cancel(self) -> bool:
+        """Whether closing a stream early stops the generation on the provider, so the rest is not billed."""
+        if self._aborts_on_cancel is None:
+            if self.llm_backend == LLMBackend.ANTHROPIC:
+                # the SDK stream is an async context manager, leaving it closes the HTTP response
+                self._aborts_on_cancel = True
+            else:
+                # BedrockModel reads the event stream in a worker thread, only the cancel signal closes it
+                self._aborts_on_cancel = "cancel_signal" in inspect.signature(self.model.stream).parameters
+                if not self._aborts_on_cancel:
+                    logger.warning("Bedrock provider ignores cancel_signal, stopped streams run to completion")
+        return self._aborts_on_cancel
+
+    def warmup(self) -> None:
+        """Create the model provider and its client ahead of the first request, blocking."""
+        self.model
+        self.aborts_on_cancel
+
+    def _create_model(self, max_tokens: int = MAX_TOKENS) -> "BedrockModel | AnthropicModel":
         if self.llm_backend == LLMBackend.AWS:
+            import boto3
+            from strands.models.bedrock import BedrockModel
+
             AWS_PROFILE = config.aws_profile
             logger.info("AWS profile configuration", profile_name=AWS_PROFILE)
             # Configure Bedrock model
             session = boto3.Session(profile_name=AWS_PROFILE)
-            self.model = BedrockModel(
+            return BedrockModel(
                 boto_session=session,
                 model_id=self.model_id,
                 temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS,
+                max_tokens=max_tokens,
                 cache_prompt="default",
                 cache_tools="default",
             )
-        elif self.llm_backend == LLMBackend.ANTHROPIC:
-            # Configure Anthropic model
-            self.model = AnthropicModel(
-                model_id=self.model_id,
-                params={"temperature": TEMPERATURE},
-                max_tokens=MAX_TOKENS,
-            )
-        else:
-            raise ValueError(f"Unsupported LLM backend: {self.llm_backend}")
+
+        from src.services.anthropic_model import CachingAnthropicModel
+
+        # Configure Anthropic model, caching the system prompt like the Bedrock one
+        return CachingAnthropicModel(
+            model_id=self.model_id,
+            params={"temperature": TEMPERATURE},
+            max_tokens=max_tokens,
+        )
 
     async def stream_llm_response(
         self,
-        messages: List[Message],
+        messages: List["Message"],
         system_prompt: Optional[str] = None,
+        on_usage: Optional[Callable[[Dict[str, int]], None]] = None,
     ) -> AsyncGenerator[str, None]:
         """
         Stream model responses using Strands Agents model providers.
+        Closing the generator early aborts the in-flight request.
 
         Args:
             messages: List of strands Message dicts
             system_prompt: Optional system prompt string
+            on_usage: Optional callback receiving the usage metadata of a completed response
 
         Yields:
             Text chunks as they stream from the provider
         """
         usage = None
-        async for event in self.model.stream(
+        cancel_signal = threading.Event()
+        stream = self.model.stream(
             messages=messages,
             system_prompt=system_prompt,
-        ):
-            # Text deltas
-            delta = event.get("contentBlockDelta") if isinstance(event, dict) else None
-            if delta:
-                d = delta.get("delta", {})
-                text = d.get("text") if isinstance(d, dict) else None
-                if text:
-                    yield text
-            # Usage/metadata capture
+            cancel_signal=cancel_signal,
+        )
+        completed = False
+        output_chunks: List[str] = []
+        try:
+            async for event in stream:
+                # Text deltas
+                delta = event.get("contentBlockDelta") if isinstance(event, dict) else None
+                if delta:
+                    d = delta.get("delta", {})
+                    text = d.get("text") if isinstance(d, dict) else None
+                    if text:
+                        output_chunks.append(text)
+                        yield text
+                # Usage/metadata capture
+                metadata = event.get("metadata") if isinstance(event, dict) else None
+                if metadata:
+                    usage = metadata.get("usage", usage)
+                await asyncio.sleep(0)
+            completed = True
+        finally:
+            if not completed:
+                # Bedrock closes the event stream on the signal, Anthropic when the generator is closed
+                cancel_signal.set()
+                await stream.aclose()
+                self._record_cancellation("".join(output_chunks))
+        if usage:
+            logger.info("Usage metadata", usage=usage)
+            self.completed_streams += 1
+            self.completed_output_tokens += usage.get("outputTokens", 0)
+            self._record_cache_usage(usage)
+            self._calibrate(messages, system_prompt, "".join(output_chunks), usage)
+            if on_usage:
+                on_usage(usage)
+
+    def _record_cache_usage(self, usage: dict) -> None:
+        """
+        Accumulate the prompt cache reads and writes of a response.
+
+        Args:
+            usage (dict): Usage metadata of the response
+        """
+        self.input_tokens += usage.get("inputTokens", 0)
+        self.cache_read_input_tokens += usage.get("cacheReadInputTokens", 0)
+        self.cache_write_input_tokens += usage.get("cacheWriteInputTokens", 0)
+        prompt_tokens = (
+            self.input_tokens + self.cache_read_input_tokens + self.cache_write_input_tokens
+        )
+        logger.info(
+            "Prompt cache usage",
+            backend=self.llm_backend.value,
+            cache_read_input_tokens=usage.get("cacheReadInputTokens", 0),
+            cache_write_input_tokens=usage.get("cacheWriteInputTokens", 0),
+            total_cache_read_input_tokens=self.cache_read_input_tokens,
+            total_cache_write_input_tokens=self.cache_write_input_tokens,
+            cache_hit_ratio=round(self.cache_read_input_tokens / prompt_tokens, 3)
+            if prompt_tokens
+            else 0.0,
+        )
+
+    def _calibrate(
+        self,
+        messages: List["Message"],
+        system_prompt: Optional[str],
+        output: str,
+        usage: dict,
+    ) -> None:
+        """
+        Feed the token counts of the usage metadata to the token estimator.
+
+        Args:
+            messages (List[Message]): Request messages
+            system_prompt (Optional[str]): Request system prompt
+            output (str): Streamed output
+            usage (dict): Usage metadata of the response
+        """
+        token_estimator.observe([output], 0, usage.get("outputTokens", 0))
+
+        texts = [system_prompt] if system_prompt else []
+        for message in messages:
+            for block in message.get("content", []):
+                if "text" in block:
+                    texts.append(block["text"])
+                elif "cachePoint" not in block:
+                    # images and documents are counted by other rules
+                    return
+        # cached prompt tokens are reported apart from the input tokens
+        input_tokens = (
+            usage.get("inputTokens", 0)
+            + usage.get("cacheReadInputTokens", 0)
+            + usage.get("cacheWriteInputTokens", 0)
+        )
+        token_estimator.observe(texts, len(messages) + bool(system_prompt), input_tokens)
+
+    async def warm_cache(
+        self, messages: List["Message"], system_prompt: Optional[str] = None
+    ) -> Dict[str, int]:
+        """
+        Send a single token request, which reads the cached prefix of the messages and refreshes its TTL.
+
+        Args:
+            messages: List of strands Message dicts with cache points, ending with a user message
+            system_prompt: Optional system prompt string
+
+        Returns:
+            Dict[str, int]: Usage metadata of the request
+        """
+        usage: Dict[str, int] = {}
+        async for event in self.warm_model.stream(messages=messages, system_prompt=system_prompt):
             metadata = event.get("metadata") if isinstance(event, dict) else None
             if metadata:
                 usage = metadata.get("usage", usage)
-            await asyncio.sleep(0)
-        if usage:
-            logger.info("Usage metadata", usage=usage)
+        return usage
+
+    def _record_cancellation(self, output: str) -> None:
+        """
+        Count the output tokens saved by a cancelled stream, if the provider stopped generating.
+
+        Args:
+            output (str): Output streamed before the cancellation
+        """
+        streamed_tokens = token_estimator.count(output)
+        average_output_tokens = (
+            self.completed_output_tokens // self.completed_streams
+            if self.completed_streams
+            else 0
+        )
+        # a provider generating on is billed for the whole response
+        saved_tokens = (
+            max(average_output_tokens - streamed_tokens, 0) if self.aborts_on_cancel else 0
+        )
+        self.cancelled_streams += 1
+        self.saved_output_tokens += saved_tokens
+        logger.info(
+            "Stream cancelled",
+            aborted=self.aborts_on_cancel,
+            streamed_output_tokens=streamed_tokens,
+            saved_output_tokens=saved_tokens,
+            cancelled_streams=self.cancelled_streams,
+            total_saved_output_tokens=self.saved_output_tokens,
+        )
@@ -1,105 +1,267 @@
-from typing import List
+import time
 from copy import deepcopy
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-from strands.types.content import Message
-
-from src.utils.token_counter import count_tokens
 from src.utils.logger import logger
-from src.constant import LLMBackend
+from src.constant import (
+    PROMPT_CACHE_GAP_WINDOW,
+    PROMPT_CACHE_READ_PRICE,
+    PROMPT_CACHE_REUSE_PRIOR,
+    PROMPT_CACHE_REUSE_PRIOR_WEIGHT,
+    PROMPT_CACHE_TTL,
+    PROMPT_CACHE_WRITE_PRICE,
+    LLMBackend,
+    PromptFamily,
+)
+
+if TYPE_CHECKING:
+    from strands.types.content import Message
+
+
+@dataclass
+class PromptCacheState:
+    """Prompt cache entries the planner expects the provider to hold for a session."""
+
+    # expiry of the cached history prefixes by prompt family and last history index
+    entries: Dict[str, Dict[int, float]] = field(default_factory=dict)
+    # seconds between the recent cowriter turns
+    gaps: List[float] = field(default_factory=list)
+    last_turn_at: Optional[float] = None
+    # expiry without warming and cached tokens of the prefixes kept alive by warming requests
+    warmed: Dict[str, Dict[int, Tuple[float, int]]] = field(default_factory=dict)
+    # warming requests since the last turn
+    idle_warms: int = 0
+
+
+@dataclass
+class CachePlan:
+    """Cache breakpoints of a request and the expected cost they were chosen for."""
+
+    cache_point_indices: List[int]
+    read_index: Optional[int]
+    write_index: Optional[int]
+    expected_reuses: float
+    expected_cost: float
+    uncached_cost: float
 
 
 class PromptCacheService:
     """
-    Service to manage prompt caching for Claude 3.7.
+    Service to manage prompt caching for Claude on Bedrock and the Anthropic API.
 
     This service handles:
-    - Creating cache points based on token thresholds
-    - Storing cache points in user session
-    - Recovering cache points for message building
+    - Planning the cache points of each request with a cost model
+    - Tracking which history prefixes are expected to be cached
+    - Adding cache points to the messages
     """
 
     MAX_CACHE_POINTS = 3  # 1 has been used for the system message
-    MIN_TOKENS_FOR_CACHE = 2000
 
     def __init__(self, llm_backend: LLMBackend):
         self.llm_backend = llm_backend
 
-    def should_create_cache_point(
-        self, cache_point_indices: List[int], messages: List[Message]
-    ) -> bool:
+    def expected_reuses(
+        self, state: PromptCacheState, family: PromptFamily, upcoming_calls: int = 1
+    ) -> float:
         """
-        Determine if a cache point should be created based on the token count of the messages from the last cache point to the end of the message history.
+        Estimate how many later requests read the prefix written by the next request.
 
         Args:
-            cache_point_indices (List[int]): List of cache point indices
-            messages (List[Message]): List of messages in the current history
+            state (PromptCacheState): Prompt cache state of the session
+            family (PromptFamily): Prompt family of the request
+            upcoming_calls (int): Requests sent back to back with the same history, including this one
 
         Returns:
-            bool: True if a cache point should be created
+            float: Expected number of reads within the TTL
         """
-        last_cache_point_index = cache_point_indices[-1] if cache_point_indices else 0
-
-        # Calculate the total token count of messages from the last cache point to the end of the message history
-        total_tokens = 0
-        for i in range(last_cache_point_index, len(messages)):
-            message = messages[i]
-            content = ""
+        reuses = float(upcoming_calls - 1)
+        if family == PromptFamily.COWRITER:
+            # the next turn reads the history if the user answers within the TTL
+            quick_turns = sum(1 for gap in state.gaps if gap < PROMPT_CACHE_TTL)
+            reuses += (quick_turns + PROMPT_CACHE_REUSE_PRIOR * PROMPT_CACHE_REUSE_PRIOR_WEIGHT) / (
+                len(state.gaps) + PROMPT_CACHE_REUSE_PRIOR_WEIGHT
+            )
+        return reuses
 
-            # Extract the content of the message (only text is processed)
-            for item in message.get("content", []):
-                if isinstance(item, dict) and "text" in item:
-                    content += item.get("text", "")
+    def return_probability(self, state: PromptCacheState, idle_for: float, window: float) -> float:
+        """
+        Estimate the chance the next cowriter turn arrives within the window, given the user is idle so far.
 
-            # Calculate the token count and sum it up
-            message_tokens = count_tokens(content)
-            total_tokens += message_tokens
-            logger.debug("Message token count", index=i, token_count=message_tokens)
+        Args:
+            state (PromptCacheState): Prompt cache state of the session
+            idle_for (float): Seconds since the last turn
+            window (float): Seconds ahead
 
-        logger.info(
-            "Total tokens since last cache point",
-            total_tokens=total_tokens,
-            last_cache_point_index=last_cache_point_index,
+        Returns:
+            float: Chance of a turn within the window
+        """
+        # gaps longer than the idle time so far, and the share of them ending within the window
+        survivors = [gap for gap in state.gaps if gap > idle_for]
+        returns = sum(1 for gap in survivors if gap <= idle_for + window)
+        return (returns + PROMPT_CACHE_REUSE_PRIOR * PROMPT_CACHE_REUSE_PRIOR_WEIGHT) / (
+            len(survivors) + PROMPT_CACHE_REUSE_PRIOR_WEIGHT
         )
 
-        if total_tokens < self.MIN_TOKENS_FOR_CACHE:
-            logger.info(
-                "No cache point created",
-                total_tokens=total_tokens,
-                min_tokens=self.MIN_TOKENS_FOR_CACHE,
-            )
-            return False
+    def cached_prefix(
+        self, state: PromptCacheState, family: PromptFamily, now: Optional[float] = None
+    ) -> Optional[Tuple[int, float]]:
+        """
+        Find the longest history prefix expected to be cached.
 
-        logger.info(
-            "Cache point should be created",
-            total_tokens=total_tokens,
-            min_tokens=self.MIN_TOKENS_FOR_CACHE,
-        )
-        return True
+        Args:
+            state (PromptCacheState): Prompt cache state of the session
+            family (PromptFamily): Prompt family
+            now (Optional[float]): Current time, defaults to the current time
 
-    def create_cache_point(
-        self, history_index: int, cache_point_indices: List[int]
-    ) -> List[int]:
+        Returns:
+            Optional[Tuple[int, float]]: Last history index of the prefix and its expiry, None if nothing is cached
         """
-        Create a cache point at the specified history index.
+        now = time.time() if now is None else now
+        cached = [
+            (index, expires_at)
+            for index, expires_at in state.entries.get(family.value, {}).items()
+            if expires_at > now
+        ]
+        return max(cached) if cached else None
+
+    def plan_cache_points(
+        self,
+        state: PromptCacheState,
+        family: PromptFamily,
+        token_counts: List[int],
+        anchors: Optional[List[int]] = None,
+        upcoming_calls: int = 1,
+        now: Optional[float] = None,
+    ) -> CachePlan:
+        """
+        Place the cache points of a request over the history by minimizing the expected input cost.
+
+        The request reads the longest prefix expected to be cached and may write a longer one.
+        A write costs the premium now and saves the difference to the read price on each expected reuse,
+        so every frontier from the cached prefix to the end of the history is priced and the cheapest is taken.
 
         Args:
-            history_index: Index in the message history
-            cache_point_indices: List of cache point indices
+            state (PromptCacheState): Prompt cache state of the session
+            family (PromptFamily): Prompt family of the request
+            token_counts (List[int]): Token counts of the history messages
+            anchors (Optional[List[int]]): Cache points of earlier requests, kept as free breakpoints
+            upcoming_calls (int): Requests sent back to back with the same history, including this one
+            now (Optional[float]): Request time, defaults to the current time
 
         Returns:
-            List[int]: Updated list of cache point indices
+            CachePlan: Cache points and the expected cost in uncached input tokens
         """
+        now = time.time() if now is None else now
+        size = len(token_counts)
+        cached = [
+            index
+            for index, expires_at in state.entries.get(family.value, {}).items()
+            if expires_at > now and index < size
+        ]
+        read_index = max(cached) if cached else None
+        reuses = self.expected_reuses(state, family, upcoming_calls)
+
+        prefix_tokens = [0] * (size + 1)
+        for i, token_count in enumerate(token_counts):
+            prefix_tokens[i + 1] = prefix_tokens[i] + token_count
+        total_tokens = prefix_tokens[size]
+        read_tokens = prefix_tokens[read_index + 1] if read_index is not None else 0
+
+        def cost(cached_tokens: int, written_tokens: int) -> float:
+            # this request, then each reuse reads the cached prefix and processes the rest
+            current = (
+                PROMPT_CACHE_READ_PRICE * read_tokens
+                + PROMPT_CACHE_WRITE_PRICE * written_tokens
+                + (total_tokens - read_tokens - written_tokens)
+            )
+            reuse = PROMPT_CACHE_READ_PRICE * cached_tokens + (total_tokens - cached_tokens)
+            return current + reuses * reuse
+
+        write_index = None
+        expected_cost = cost(read_tokens, 0)
+        first_candidate = read_index + 1 if read_index is not None else 0
+        for index in range(first_candidate, size):
+            candidate_cost = cost(prefix_tokens[index + 1], prefix_tokens[index + 1] - read_tokens)
+            if candidate_cost < expected_cost:
+                write_index, expected_cost = index, candidate_cost
+
+        # the cached prefix needs a cache point close to it to be found, earlier points are free fallbacks
+        cache_point_indices = sorted(
+            {i for i in (read_index, write_index) if i is not None}
+        )
+        for index in sorted({*cached, *(anchors or [])}, reverse=True):
+            if len(cache_point_indices) >= self.MAX_CACHE_POINTS:
+                break
+            if index < size and index not in cache_point_indices:
+                cache_point_indices = sorted([*cache_point_indices, index])
+
+        plan = CachePlan(
+            cache_point_indices=cache_point_indices,
+            read_index=read_index,
+            write_index=write_index,
+            expected_reuses=round(reuses, 3),
+            expected_cost=round(expected_cost, 1),
+            uncached_cost=float(total_tokens * (1 + reuses)),
+        )
         logger.info(
-            "Created cache point",
-            history_index=history_index,
-            total=len(cache_point_indices),
+            "Planned cache points",
+            family=family.value,
+            cache_point_indices=cache_point_indices,
+            read_index=read_index,
+            write_index=write_index,
+            history_tokens=total_tokens,
+            expected_reuses=plan.expected_reuses,
+            expected_cost=plan.expected_cost,
+            uncached_cost=plan.uncached_cost,
         )
+        return plan
+
+    def record_request(
+        self,
+        state: PromptCacheState,
+        family: PromptFamily,
+        plan: CachePlan,
+        now: Optional[float] = None,
+        turn: bool = True,
+    ) -> None:
+        """
+        Track the prefixes the request read or wrote, and the gap since the previous turn.
+
+        Args:
+            state (PromptCacheState): Prompt cache state of the session
+            family (PromptFamily): Prompt family of the request
+            plan (CachePlan): Plan the request was sent with
+            now (Optional[float]): Request time, defaults to the current time
+            turn (bool): False for the warming requests, which are not user activity
+        """
+        now = time.time() if now is None else now
+        entries = {
+            index: expires_at
+            for index, expires_at in state.entries.get(family.value, {}).items()
+            if expires_at > now
+        }
+        for index in (plan.read_index, plan.write_index):
+            if index is not None:
+                entries[index] = now + PROMPT_CACHE_TTL
+        state.entries[family.value] = entries
+        state.warmed[family.value] = {
+            index: warmed
+            for index, warmed in state.warmed.get(family.value, {}).items()
+            if index in entries
+        }
 
-        return [*cache_point_indices, history_index][-self.MAX_CACHE_POINTS :]
+        if not turn:
+            return
+        state.idle_warms = 0
+        if family == PromptFamily.COWRITER:
+            if state.last_turn_at is not None:
+                state.gaps = [*state.gaps, now - state.last_turn_at][-PROMPT_CACHE_GAP_WINDOW:]
+            state.last_turn_at = now
 
     def add_cache_points_to_messages(
-        self, cache_point_indices: List[int], messages: List[Message]
-    ) -> List[Message]:
+        self, cache_point_indices: List[int], messages: List["Message"]
+    ) -> List["Message"]:
         """
         Add cache point markers to the messages.
 
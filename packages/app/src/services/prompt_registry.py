@@ -0,0 +1,192 @@
+import os
+import json
+import hashlib
+import threading
+import traceback
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Sequence
+
+from src.config import config
+from src.constant import PromptFamily
+from src.prompts.cowriter import SYSTEM_PROMPT as COWRITER_SYSTEM_PROMPT
+from src.prompts.section_printer import SYSTEM_PROMPT as SECTION_PRINTER_SYSTEM_PROMPT
+from src.prompts.web_qa import SYSTEM_PROMPT as WEB_QA_SYSTEM_PROMPT
+from src.utils.context import load_alps_context, slice_alps_context
+from src.utils.logger import logger
+
+WEB_QA = "web_qa"
+
+
+@dataclass(frozen=True)
+class SystemPrompt:
+    """System prompt or static prompt part built once, versioned by its content."""
+
+    name: str
+    text: str
+    # first 12 hex digits of the SHA-256 of the UTF-8 text
+    version: str
+
+
+def build_cowriter_prompt() -> str:
+    """Builds the system prompt of the ALPS cowriter, including the ALPS template."""
+    return "\n".join(
+        [
+            COWRITER_SYSTEM_PROMPT,
+            f"<alps-template>{load_alps_context()}</alps-template>",
+            "Please answer in user's language, if you don't know the language, answer in English.",
+        ]
+    )
+
+
+def build_section_printer_prompt() -> str:
+    """
+    Builds the system prompt of the section printer.
+    The ALPS template is sliced per section group and sent after the history,
+    so every group shares this prompt and the cached history prefix.
+    """
+    return "\n".join(
+        [
+            SECTION_PRINTER_SYSTEM_PROMPT,
+            "Please print the section in the requested locale.",
+        ]
+    )
+
+
+def section_template_name(section_numbers: Sequence[int]) -> str:
+    """Name of the ALPS template slice of the sections in the registry."""
+    return "alps_template:" + ",".join(str(number) for number in sorted(set(section_numbers)))
+
+
+def build_section_template(section_numbers: Sequence[int]) -> str:
+    """Builds the ALPS template slice of the sections, in the tags of the full template."""
+    return f"<alps-template>{slice_alps_context(section_numbers)}</alps-template>"
+
+
+class PromptRegistry:
+    """
+    Builds every system prompt once and versions it by a hash of its content.
+
+    Provider prompt caches match on the exact bytes of the prefix, so the texts are normalized
+    and built from the same sources in every worker, and equal versions mean equal bytes.
+    The versions are kept in a manifest, a deploy changing a prompt is logged as it starts the caches cold.
+    """
+
+    def __init__(self, manifest_path: Optional[str] = None):
+        """
+        Args:
+            manifest_path (Optional[str]): JSON file the versions of the last start are kept in, None skips the comparison
+        """
+        self.manifest_path = manifest_path
+        self._builders: Dict[str, Callable[[], str]] = {}
+        self._prompts: Dict[str, SystemPrompt] = {}
+        # the startup warmup builds the prompts in a worker thread
+        self._lock = threading.Lock()
+
+    def register(self, name: str, build: Callable[[], str]) -> None:
+        """
+        Register the builder of a system prompt.
+
+        Args:
+            name (str): Prompt name
+            build (Callable[[], str]): Builds the prompt text, called once
+        """
+        self._builders[name] = build
+
+    def get_or_register(self, name: str, build: Callable[[], str]) -> SystemPrompt:
+        """
+        Return the prompt, registering its builder first if the name is new.
+
+        Args:
+            name (str): Prompt name
+            build (Callable[[], str]): Builds the prompt text, called once
+
+        Returns:
+            SystemPrompt: Prompt text and version
+        """
+        self._builders.setdefault(name, build)
+        return self.get(name)
+
+    def get(self, name: str) -> SystemPrompt:
+        """
+        Return the system prompt, built on first use.
+
+        Args:
+            name (str): Prompt name
+
+        Returns:
+            SystemPrompt: Prompt text and version
+
+        Raises:
+            KeyError: If no prompt is registered under the name
+        """
+        prompt = self._prompts.get(name)
+        if prompt is None:
+            with self._lock:
+                prompt = self._prompts.get(name)
+                if prompt is None:
+                    prompt = self._build(name)
+                    self._prompts[name] = prompt
+        return prompt
+
+    def versions(self) -> Dict[str, str]:
+        """Return the versions of every registered prompt, building them if needed."""
+        return {name: self.get(name).version for name in sorted(self._builders)}
+
+    def compile(self) -> None:
+        """Build every registered prompt and log the ones changed since the last start, blocking."""
+        versions = self.versions()
+        logger.info("System prompts compiled", versions=versions)
+        if not self.manifest_path:
+            return
+
+        previous: Dict[str, str] = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    previous = json.load(f)
+            except Exception:
+                logger.warning(
+                    "Error loading the prompt manifest",
+                    manifest_path=self.manifest_path,
+                    traceback=traceback.format_exc(),
+                )
+
+        changed = {
+            name: version
+            for name, version in versions.items()
+            if name in previous and previous[name] != version
+        }
+        for name, version in changed.items():
+            logger.warning(
+                "System prompt changed, its prompt cache starts cold",
+                name=name,
+                previous_version=previous[name],
+                version=version,
+            )
+        if versions == previous:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(versions, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.manifest_path)
+        except Exception:
+            logger.warning(
+                "Error saving the prompt manifest",
+                manifest_path=self.manifest_path,
+                traceback=traceback.format_exc(),
+            )
+
+    def _build(self, name: str) -> SystemPrompt:
+        # line endings of the template files depend on the checkout, the cached bytes must not
+        text = self._builders[name]().replace("\r\n", "\n")
+        version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        return SystemPrompt(name=name, text=text, version=version)
+
+
+prompt_registry = PromptRegistry(config.prompt_manifest_path or None)
+prompt_registry.register(PromptFamily.COWRITER.value, build_cowriter_prompt)
+prompt_registry.register(PromptFamily.SECTION_PRINTER.value, build_section_printer_prompt)
+prompt_registry.register(WEB_QA, lambda: WEB_QA_SYSTEM_PROMPT)
@@ -1,46 +1,44 @@
-from typing import List
-
-from strands.types.content import Message
+from functools import partial
+from typing import TYPE_CHECKING, AsyncGenerator, Callable, Dict, List, Optional, Sequence, Tuple
 
 from src.services.llm import LLMService
-from src.prompts.section_printer import SYSTEM_PROMPT
-from src.constant import LLMBackend
-from src.utils.context import load_alps_context
+from src.services.prompt_registry import (
+    SystemPrompt,
+    build_section_template,
+    prompt_registry,
+    section_template_name,
+)
+from src.constant import LLMBackend, PromptFamily
+from src.utils.section_groups import section_numbers
+from src.utils.stop_message import StopMessageDetector
 from src.utils.logger import logger
 
+if TYPE_CHECKING:
+    from strands.types.content import Message
 
-class SectionPrinterService(LLMService):
-    def __init__(self, llm_backend: LLMBackend, model_id: str):
-        super().__init__(llm_backend, model_id)
 
-        self.alps_context = load_alps_context()
-        self.section_printer_system_prompt = SYSTEM_PROMPT
+class IncompleteSectionError(Exception):
+    """Raised when the section printer reports an incomplete section."""
 
-    def _build_system_prompt(self) -> str:
-        """
-        Builds a system message for ALPS template generation.
+    def __init__(self, section: int):
+        super().__init__(f"Section {section} is incomplete")
+        self.section = section
 
-        Returns:
-            str: The system prompt string including ALPS template and instruction
-        """
-        system_message_contents: List[str] = [
-            self.section_printer_system_prompt,
-            f"<alps-template>{self.alps_context}</alps-template>",
-            "Please print the section in the requested locale.",
-        ]
 
-        return "\n".join(system_message_contents)
+class SectionPrinterService(LLMService):
+    def __init__(self, llm_backend: LLMBackend, model_id: str):
+        super().__init__(llm_backend, model_id)
 
     def build_section_printer_messages(
-        self, recent_history: List[Message], section: str, locale: str
-    ) -> List[Message]:
+        self, recent_history: List["Message"], section: Tuple[str, ...], locale: str
+    ) -> List["Message"]:
         """
-        Builds a list of messages for section printer.
+        Builds a list of messages for section printer, with the ALPS template of the sections only.
         Prompt cache should be added to the history before building the messages.
 
         Args:
             recent_history (List[Message]): Recent conversation history
-            section (str): Section to print
+            section (Tuple[str, ...]): Section group to print
             locale (str): Locale to print the section in
 
         Returns:
@@ -52,7 +50,7 @@ class SectionPrinterService(LLMService):
             "role": "user",
             "content": [
                 {
-                    "text": f"<locale>{locale}</locale>\n<section>{section}</section>\nPlease print the section in the requested locale.",
+                    "text": f"{self.get_section_template(section).text}\n<locale>{locale}</locale>\n<section>{section}</section>\nPlease print the section in the requested locale.",
                 },
             ],
         }
@@ -60,4 +58,100 @@ class SectionPrinterService(LLMService):
         return [*recent_history, user_message]
 
     def get_system_prompt(self) -> str:
-        return self._build_system_prompt()
+        # built once by the registry, byte identical in every worker
+        return prompt_registry.get(PromptFamily.SECTION_PRINTER.value).text
+
+    def register_section_groups(self, section_groups: Sequence[Sequence[str]]) -> None:
+        """
+        Register the ALPS template slices of the section groups, built with the other prompts.
+
+        Args:
+            section_groups (Sequence[Sequence[str]]): Section groups printed by /save
+        """
+        for section_group in section_groups:
+            numbers = section_numbers(section_group)
+            prompt_registry.register(
+                section_template_name(numbers), partial(build_section_template, numbers)
+            )
+
+    def get_section_template(self, section_group: Sequence[str]) -> SystemPrompt:
+        """
+        Return the ALPS template slice of the section group, static so every /save sends the same bytes.
+
+        Args:
+            section_group (Sequence[str]): Section group, e.g. ("Section 8", "Section 9")
+
+        Returns:
+            SystemPrompt: Template slice and its version
+        """
+        numbers = section_numbers(section_group)
+        return prompt_registry.get_or_register(
+            section_template_name(numbers), partial(build_section_template, numbers)
+        )
+
+    def get_prompt_version(self, section_groups: Sequence[Sequence[str]]) -> str:
+        """
+        Versions of the system prompt and of the template slices, outputs of other versions are not reused.
+
+        Args:
+            section_groups (Sequence[Sequence[str]]): Section groups printed by /save
+
+        Returns:
+            str: Versions joined in order
+        """
+        return "+".join(
+            [
+                prompt_registry.get(PromptFamily.SECTION_PRINTER.value).version,
+                *(self.get_section_template(section_group).version for section_group in section_groups),
+            ]
+        )
+
+    def warmup(self) -> None:
+        """Build the system prompt and create the model provider, blocking."""
+        self.get_system_prompt()
+        super().warmup()
+
+    async def stream_section(
+        self,
+        messages: List["Message"],
+        on_usage: Optional[Callable[[Dict[str, int]], None]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream the printed section, aborting the request as soon as the stop message is detected.
+
+        Args:
+            messages (List[Message]): Messages built by build_section_printer_messages
+            on_usage (Optional[Callable[[Dict[str, int]], None]]): Receives the usage metadata of a completed response
+
+        Yields:
+            str: Text chunks of the section
+
+        Raises:
+            IncompleteSectionError: If the model outputs the stop message
+        """
+        detector = StopMessageDetector()
+        stream = self.stream_llm_response(
+            messages, system_prompt=self.get_system_prompt(), on_usage=on_usage
+        )
+        try:
+            async for chunk in stream:
+                text = detector.feed(chunk)
+                if detector.incomplete_section is not None:
+                    # the provider stops generating the group only if it aborts on cancel
+                    logger.info(
+                        "Stop message detected, aborting the section request",
+                        section=detector.incomplete_section,
+                        aborted=self.aborts_on_cancel,
+                    )
+                    raise IncompleteSectionError(detector.incomplete_section)
+                if text:
+                    yield text
+        finally:
+            # cancels the upstream request when the stream is left early
+            await stream.aclose()
+
+        text = detector.flush()
+        if detector.incomplete_section is not None:
+            raise IncompleteSectionError(detector.incomplete_section)
+        if text:
+            yield text
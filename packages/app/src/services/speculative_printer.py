@@ -0,0 +1,303 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Sequence
+
+from src.constant import (
+    OUTPUT_TOKEN_PRICE,
+    PROMPT_CACHE_READ_PRICE,
+    PROMPT_CACHE_WRITE_PRICE,
+    SAVE_SECTION_DEFAULT_TOKENS,
+    SPECULATIVE_IDLE_DELAY,
+)
+from src.services.section_printer import IncompleteSectionError, SectionPrinterService
+from src.utils.section_groups import (
+    SectionGroup,
+    estimate_section_tokens,
+    find_section_number,
+    section_numbers,
+)
+from src.utils.token_estimator import token_estimator
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    from strands.types.content import Message
+
+
+@dataclass
+class RenderCost:
+    """Cost reserved for a speculative render and what its request actually used."""
+
+    reserved: float
+    # estimated input cost, charged when the request ends without usage metadata
+    input_cost: float
+    requested: bool = False
+    output: str = ""
+    usage: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class PrerenderState:
+    """Speculative renders of a single chat session."""
+
+    locale: str
+    # uncached input token equivalents left, the running renders hold a reservation on it
+    token_budget: float
+    max_section: int = 0
+    rendered: Dict[SectionGroup, str] = field(default_factory=dict)
+    tasks: Dict[SectionGroup, asyncio.Task] = field(default_factory=dict)
+
+
+class SpeculativeSectionPrinter:
+    """
+    Renders the confirmed section groups in the background, so /save mostly assembles finished parts.
+
+    A section group is confirmed once the conversation moved past its last section,
+    and a render is dropped as soon as the conversation returns to one of its sections.
+    Each render reserves its estimated input and output cost from the session budget before
+    it is scheduled, and settles against the usage of its request once it ends.
+    """
+
+    def __init__(
+        self,
+        section_printer_service: SectionPrinterService,
+        section_groups: Sequence[SectionGroup],
+        token_budget: int,
+        idle_delay: float = SPECULATIVE_IDLE_DELAY,
+    ):
+        """
+        Args:
+            section_printer_service (SectionPrinterService): Section printer service
+            section_groups (Sequence[SectionGroup]): Section groups printed by /save
+            token_budget (int): Uncached input token equivalents a session may spend on speculative renders
+            idle_delay (float): Seconds to wait after a turn before rendering
+        """
+        self.section_printer_service = section_printer_service
+        self.section_groups = section_groups
+        self.token_budget = token_budget
+        self.idle_delay = idle_delay
+
+    def create_state(self, locale: str) -> PrerenderState:
+        """
+        Create the speculative render state of a chat session.
+
+        Args:
+            locale (str): Locale the sections are rendered in
+
+        Returns:
+            PrerenderState: Empty state with the full token budget
+        """
+        return PrerenderState(locale=locale, token_budget=self.token_budget)
+
+    def on_assistant_message(
+        self, state: PrerenderState, recent_history: List["Message"], content: str
+    ) -> None:
+        """
+        Track the section of the assistant message, drop the renders it changes and schedule the confirmed groups.
+
+        Args:
+            state (PrerenderState): Speculative render state of the session
+            recent_history (List[Message]): Conversation history with cache points, including the message
+            content (str): Assistant message content
+        """
+        section = find_section_number(content)
+        if section is None:
+            return
+
+        editing = None
+        for section_group in self.section_groups:
+            numbers = section_numbers(section_group)
+            if numbers[0] <= section <= numbers[-1]:
+                self.invalidate(state, section_group)
+                editing = section_group
+        state.max_section = max(state.max_section, section)
+
+        history_tokens = None
+        section_tokens: Dict[int, int] = {}
+        for section_group in self.section_groups:
+            confirmed = section_numbers(section_group)[-1] < state.max_section
+            # the group being edited is rendered once the conversation moves on from it
+            if (
+                not confirmed
+                or section_group == editing
+                or section_group in state.rendered
+                or section_group in state.tasks
+            ):
+                continue
+
+            if history_tokens is None:
+                # the history is sent with every group, reserved at the uncached price
+                history_tokens = self._estimate_input_tokens(recent_history)
+                section_tokens = estimate_section_tokens(recent_history)
+            template_tokens = token_estimator.count(
+                self.section_printer_service.get_section_template(section_group).text
+            )
+            output_tokens = sum(
+                section_tokens.get(number, SAVE_SECTION_DEFAULT_TOKENS)
+                for number in section_numbers(section_group)
+            )
+            input_cost = history_tokens + template_tokens
+            reserved = input_cost + OUTPUT_TOKEN_PRICE * output_tokens
+            if reserved > state.token_budget:
+                logger.info(
+                    "Speculative render skipped, over the budget",
+                    section_group=section_group,
+                    reserved=round(reserved),
+                    token_budget=round(state.token_budget),
+                )
+                continue
+
+            state.token_budget -= reserved
+            cost = RenderCost(reserved=reserved, input_cost=input_cost)
+            task = asyncio.create_task(self._render(state, section_group, recent_history, cost))
+            state.tasks[section_group] = task
+            # settled when the task is done, also if it is cancelled before it starts
+            task.add_done_callback(
+                lambda task, section_group=section_group, cost=cost: self._forget(
+                    state, section_group, task, cost
+                )
+            )
+
+    def invalidate(self, state: PrerenderState, section_group: SectionGroup) -> None:
+        """
+        Drop the render of the section group and cancel it if it is running.
+
+        Args:
+            state (PrerenderState): Speculative render state of the session
+            section_group (SectionGroup): Changed section group
+        """
+        task = state.tasks.pop(section_group, None)
+        if task:
+            task.cancel()
+        if state.rendered.pop(section_group, None) is not None or task:
+            logger.info("Speculative render invalidated", section_group=section_group)
+
+    def take_rendered(self, state: PrerenderState, locale: str) -> Dict[SectionGroup, str]:
+        """
+        Return the finished renders for the locale.
+
+        Args:
+            state (PrerenderState): Speculative render state of the session
+            locale (str): Requested document locale
+
+        Returns:
+            Dict[SectionGroup, str]: Rendered content by section group
+        """
+        if locale != state.locale:
+            return {}
+        return dict(state.rendered)
+
+    def switch_locale(self, state: PrerenderState, locale: str) -> None:
+        """
+        Render the next sections in the locale of the latest /save.
+
+        Args:
+            state (PrerenderState): Speculative render state of the session
+            locale (str): Document locale
+        """
+        if locale == state.locale:
+            return
+        self.cancel(state)
+        state.rendered.clear()
+        state.locale = locale
+
+    def cancel(self, state: PrerenderState) -> None:
+        """Cancel every running render of the session."""
+        for task in list(state.tasks.values()):
+            task.cancel()
+
+    def _estimate_input_tokens(self, recent_history: List["Message"]) -> int:
+        """Estimate the prompt tokens of the history and the system prompt, sent with every group."""
+        texts = [self.section_printer_service.get_system_prompt()]
+        for message in recent_history:
+            texts.extend(block["text"] for block in message["content"] if "text" in block)
+        return sum(token_estimator.count(text) for text in texts)
+
+    async def _render(
+        self,
+        state: PrerenderState,
+        section_group: SectionGroup,
+        recent_history: List["Message"],
+        cost: RenderCost,
+    ) -> None:
+        # wait for the user to go idle, a change to the group cancels the render meanwhile
+        await asyncio.sleep(self.idle_delay)
+        group_name = ", ".join(section_group)
+        # same request as /save, so the render reuses its prompt cache
+        messages = self.section_printer_service.build_section_printer_messages(
+            recent_history=recent_history,
+            section=section_group,
+            locale=state.locale,
+        )
+
+        cost.requested = True
+        stream = self.section_printer_service.stream_section(messages, on_usage=cost.usage.update)
+        try:
+            async for chunk in stream:
+                cost.output += chunk
+        except asyncio.CancelledError:
+            raise
+        except IncompleteSectionError as e:
+            logger.info("Speculative render stopped", group_name=group_name, section=e.section)
+            return
+        except Exception as e:
+            logger.warning("Speculative render failed", group_name=group_name, error=e)
+            return
+        finally:
+            # aborts the model request when the render is invalidated
+            await stream.aclose()
+
+        section_content = cost.output
+        # same completeness heuristic as /save, an incomplete group is rendered again later
+        if len(section_content.strip()) < 100:
+            logger.info("Speculative render incomplete", group_name=group_name)
+            return
+
+        state.rendered[section_group] = section_content
+        logger.info(
+            "Speculative render finished",
+            group_name=group_name,
+            locale=state.locale,
+            reserved=round(cost.reserved),
+            usage=cost.usage,
+        )
+
+    def _settle(self, state: PrerenderState, cost: RenderCost) -> None:
+        """
+        Charge the actual cost of a render to the budget and refund the rest of its reservation.
+
+        Args:
+            state (PrerenderState): Speculative render state of the session
+            cost (RenderCost): Reservation and usage of the render
+        """
+        usage = cost.usage
+        if usage:
+            spent = (
+                usage.get("inputTokens", 0)
+                + PROMPT_CACHE_READ_PRICE * usage.get("cacheReadInputTokens", 0)
+                + PROMPT_CACHE_WRITE_PRICE * usage.get("cacheWriteInputTokens", 0)
+                + OUTPUT_TOKEN_PRICE * usage.get("outputTokens", 0)
+            )
+        elif cost.requested:
+            # an aborted request reports no usage, its input is billed and its output up to the abort
+            spent = cost.input_cost + OUTPUT_TOKEN_PRICE * token_estimator.count(cost.output)
+        else:
+            spent = 0.0
+        state.token_budget += cost.reserved - spent
+        logger.info(
+            "Speculative render settled",
+            reserved=round(cost.reserved),
+            spent=round(spent),
+            token_budget=round(state.token_budget),
+        )
+
+    def _forget(
+        self,
+        state: PrerenderState,
+        section_group: SectionGroup,
+        task: asyncio.Task,
+        cost: RenderCost,
+    ) -> None:
+        self._settle(state, cost)
+        # a cancelled render may finish after its replacement was scheduled
+        if state.tasks.get(section_group) is task:
+            del state.tasks[section_group]
@@ -0,0 +1,220 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from chainlit.emitter import BaseChainlitEmitter
+from chainlit.message import MessageBase
+from chainlit.step import StepDict
+
+from src.constant import BROADCAST_BUFFER_SIZE, BROADCAST_SNAPSHOT_INTERVAL
+from src.utils.logger import logger
+
+# ("start", step_dict) | ("token", step_id, token) | ("step", step_dict) | ("snapshot",)
+Event = Tuple[Any, ...]
+
+
+class ThreadSubscriber:
+    """Connected viewer of a thread, fed from a bounded buffer by its own task."""
+
+    def __init__(
+        self,
+        broadcaster: "ThreadBroadcaster",
+        thread_id: str,
+        session_id: str,
+        emitter: BaseChainlitEmitter,
+        buffer_size: int,
+    ):
+        self.broadcaster = broadcaster
+        self.thread_id = thread_id
+        self.session_id = session_id
+        self.emitter = emitter
+        self.queue: asyncio.Queue[Event] = asyncio.Queue(maxsize=buffer_size)
+        # a slow viewer skips the tokens and receives periodic snapshots of the streams instead
+        self.snapshot_mode = False
+        # a snapshot is in the queue, so at most one waits at a time
+        self._snapshot_pending = False
+        self._started: Set[str] = set()
+        self._task = asyncio.create_task(self._pump())
+
+    def deliver(self, event: Event) -> None:
+        """Buffer the event without ever waiting for the viewer."""
+        if self.snapshot_mode and event[0] in ("start", "token"):
+            return
+
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.info(
+                "Viewer is lagging, switching to snapshot mode",
+                thread_id=self.thread_id,
+                session_id=self.session_id,
+            )
+            self.snapshot_mode = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self._snapshot_pending = False
+            self._queue_snapshot()
+            if event[0] == "step":
+                self.queue.put_nowait(event)
+
+    def _queue_snapshot(self) -> None:
+        if self._snapshot_pending:
+            return
+        try:
+            self.queue.put_nowait(("snapshot",))
+            self._snapshot_pending = True
+        except asyncio.QueueFull:
+            # the next delivered event finds the queue full and queues the snapshot after clearing it
+            pass
+
+    async def _pump(self) -> None:
+        while True:
+            event = await self.queue.get()
+            try:
+                await self._emit(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Failed to send to viewer", session_id=self.session_id, error=e
+                )
+
+    async def _emit(self, event: Event) -> None:
+        kind = event[0]
+        if kind == "start":
+            self._started.add(event[1]["id"])
+            await self.emitter.stream_start(event[1])
+        elif kind == "token":
+            await self.emitter.send_token(id=event[1], token=event[2])
+        elif kind == "step":
+            self._started.discard(event[1]["id"])
+            await self.emitter.send_step(event[1])
+            if self.snapshot_mode and not self.broadcaster.live_steps(self.thread_id):
+                self.snapshot_mode = False
+        elif kind == "snapshot":
+            self._snapshot_pending = False
+            await self._emit_snapshot()
+
+    async def _emit_snapshot(self) -> None:
+        live_steps = self.broadcaster.live_steps(self.thread_id)
+        for step_dict in live_steps:
+            if step_dict["id"] in self._started:
+                await self.emitter.update_step(step_dict)
+            else:
+                self._started.add(step_dict["id"])
+                await self.emitter.stream_start(step_dict)
+
+        if not live_steps:
+            self.snapshot_mode = False
+            return
+
+        await asyncio.sleep(BROADCAST_SNAPSHOT_INTERVAL)
+        # queued behind the steps delivered meanwhile, until the live steps end
+        if self.snapshot_mode:
+            self._queue_snapshot()
+
+    def close(self) -> None:
+        self._task.cancel()
+
+
+class ThreadBroadcaster:
+    """
+    Fan-out of the messages of a thread to every connected viewer.
+
+    Tokens are produced once by the author's stream and copied into bounded per-viewer buffers,
+    so a slow viewer never applies backpressure to the author.
+    """
+
+    def __init__(self, buffer_size: int = BROADCAST_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers: Dict[str, Dict[str, ThreadSubscriber]] = {}
+        # messages being streamed, their content grows with every token
+        self._streams: Dict[str, Dict[str, MessageBase]] = {}
+
+    def subscribe(
+        self, thread_id: str, session_id: str, emitter: BaseChainlitEmitter
+    ) -> None:
+        """
+        Start sending the messages of the thread to the session.
+
+        Args:
+            thread_id (str): Thread id
+            session_id (str): Chainlit session id of the viewer
+            emitter (BaseChainlitEmitter): Emitter of the viewer session
+        """
+        self.unsubscribe(thread_id, session_id)
+        subscriber = ThreadSubscriber(
+            self, thread_id, session_id, emitter, self.buffer_size
+        )
+        self._subscribers.setdefault(thread_id, {})[session_id] = subscriber
+        # join the messages already being streamed with their content so far
+        for step_dict in self.live_steps(thread_id):
+            subscriber.deliver(("start", step_dict))
+
+    def unsubscribe(self, thread_id: str, session_id: str) -> None:
+        """
+        Stop sending the messages of the thread to the session.
+
+        Args:
+            thread_id (str): Thread id
+            session_id (str): Chainlit session id of the viewer
+        """
+        subscribers = self._subscribers.get(thread_id, {})
+        subscriber = subscribers.pop(session_id, None)
+        if subscriber:
+            subscriber.close()
+        if not subscribers:
+            self._subscribers.pop(thread_id, None)
+
+    def live_steps(self, thread_id: str) -> List[StepDict]:
+        """Return snapshots of the messages being streamed in the thread."""
+        return [message.to_dict() for message in self._streams.get(thread_id, {}).values()]
+
+    def publish_token(
+        self, thread_id: str, message: MessageBase, token: str, exclude: Optional[str] = None
+    ) -> None:
+        """
+        Fan out a token streamed into the message.
+
+        Args:
+            thread_id (str): Thread id
+            message (MessageBase): Streamed message, after the token was added
+            token (str): Streamed token
+            exclude (Optional[str]): Session id of the author
+        """
+        if not self._has_viewers(thread_id, exclude):
+            return
+
+        streams = self._streams.setdefault(thread_id, {})
+        if message.id not in streams:
+            streams[message.id] = message
+            event: Event = ("start", message.to_dict())
+        else:
+            event = ("token", message.id, token)
+        self._deliver(thread_id, event, exclude)
+
+    def publish_step(
+        self, thread_id: str, step_dict: StepDict, exclude: Optional[str] = None
+    ) -> None:
+        """
+        Fan out a complete message, which also ends its stream.
+
+        Args:
+            thread_id (str): Thread id
+            step_dict (StepDict): Complete message
+            exclude (Optional[str]): Session id of the author
+        """
+        streams = self._streams.get(thread_id, {})
+        streams.pop(step_dict["id"], None)
+        if not streams:
+            self._streams.pop(thread_id, None)
+        self._deliver(thread_id, ("step", step_dict), exclude)
+
+    def _has_viewers(self, thread_id: str, exclude: Optional[str]) -> bool:
+        return any(
+            session_id != exclude for session_id in self._subscribers.get(thread_id, {})
+        )
+
+    def _deliver(self, thread_id: str, event: Event, exclude: Optional[str]) -> None:
+        for session_id, subscriber in self._subscribers.get(thread_id, {}).items():
+            if session_id != exclude:
+                subscriber.deliver(event)
@@ -1,10 +1,14 @@
 import os
+import re
+from functools import lru_cache
+from typing import Dict, Sequence, Tuple
 
 from src.utils.logger import logger
 
 
+@lru_cache(maxsize=None)
 def load_alps_context() -> str:
-    """Read the ALPS.md file and return it as a context."""
+    """Read the ALPS.md file once and return it as a context."""
     try:
         alps_path = os.path.join("./templates", "ALPS.md")
         with open(alps_path, "r", encoding="utf-8") as f:
@@ -12,3 +16,52 @@ def load_alps_context() -> str:
     except Exception as e:
         logger.error("Failed to load ALPS context", error=e)
         raise e
+
+
+# every section of the ALPS template starts with a "## Section <number>. <title>" header
+_SECTION_HEADER = re.compile(r"^## Section (\d+)\.", re.MULTILINE)
+_SECTION_SEPARATOR = "\n\n---\n\n"
+
+
+@lru_cache(maxsize=None)
+def load_alps_sections() -> Tuple[str, Dict[int, str]]:
+    """
+    Split the ALPS template into its title and its sections.
+
+    Returns:
+        Tuple[str, Dict[int, str]]: Title of the template and the text of each section by number
+    """
+    template = load_alps_context().replace("\r\n", "\n")
+    headers = list(_SECTION_HEADER.finditer(template))
+    if not headers:
+        raise ValueError("No sections found in the ALPS template")
+
+    def strip_separator(text: str) -> str:
+        return text.strip().removesuffix("---").strip()
+
+    sections = {
+        int(header.group(1)): strip_separator(
+            template[header.start() : headers[i + 1].start() if i + 1 < len(headers) else len(template)]
+        )
+        for i, header in enumerate(headers)
+    }
+    return strip_separator(template[: headers[0].start()]), sections
+
+
+def slice_alps_context(section_numbers: Sequence[int]) -> str:
+    """
+    Build the ALPS template with only the given sections, in the layout of the full template.
+
+    Args:
+        section_numbers (Sequence[int]): Section numbers to keep
+
+    Returns:
+        str: Title of the template followed by the sections
+
+    Raises:
+        KeyError: If a section is not in the template
+    """
+    title, sections = load_alps_sections()
+    return _SECTION_SEPARATOR.join(
+        [title, *(sections[number] for number in sorted(set(section_numbers)))]
+    )
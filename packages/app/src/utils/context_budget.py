@@ -0,0 +1,170 @@
+import time
+from functools import lru_cache
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from src.config import config
+from src.constant import CONTEXT_BUDGET_MIN_TEXT_TOKENS, IMAGE_TOKENS, MAX_TOKENS
+from src.utils.token_estimator import token_estimator
+from src.utils.logger import logger
+
+TRUNCATION_NOTE = "\n\n[... truncated to fit the context window]"
+
+
+@dataclass
+class ContextAllocation:
+    """Parts of a request kept within the context window, in the order they were given the budget."""
+
+    # False if the system prompt and the user message alone exceed the budget
+    fits: bool
+    # first history message kept, the older ones are left out
+    history_start: int = 0
+    text_context: Optional[str] = None
+    # leading images kept
+    image_count: int = 0
+    web_result: Optional[str] = None
+    # allocated tokens by component
+    tokens: Dict[str, int] = field(default_factory=dict)
+    # components trimmed or left out, for the user notice
+    trimmed: List[str] = field(default_factory=list)
+
+
+@lru_cache(maxsize=8)
+def _count_system_prompt(system_prompt: str) -> int:
+    # the registry builds each prompt once, so the same string object comes back every turn
+    return token_estimator.count(system_prompt)
+
+
+def _truncate(text: str, tokens: int, allowed: int) -> str:
+    """Cut the text to about the allowed tokens, assuming the tokens are spread evenly."""
+    return text[: len(text) * allowed // tokens] + TRUNCATION_NOTE
+
+
+def allocate_context_budget(
+    system_prompt: str,
+    message_content: str,
+    history_token_counts: Sequence[int] = (),
+    text_context: Optional[str] = None,
+    image_count: int = 0,
+    web_result: Optional[str] = None,
+    context_window: int = config.context_window,
+    max_tokens: int = MAX_TOKENS,
+) -> ContextAllocation:
+    """
+    Split the context window of a request across its parts by priority, before it is sent.
+
+    The output reservation, the system prompt and the user message are required.
+    The history comes next, newest turn first, then the images, the attached file text and the web results.
+    Texts that do not fit are truncated, images and older turns are left out, so the model never
+    rejects the request after a long upload. History counts come from the memory ledger,
+    and the total is inflated by the estimator's error bound when the decision is within it.
+
+    Args:
+        system_prompt (str): System prompt of the request
+        message_content (str): User message
+        history_token_counts (Sequence[int]): Token counts of the history messages, user and assistant pairs
+        text_context (Optional[str]): Text of the attached files
+        image_count (int): Number of attached images
+        web_result (Optional[str]): Web search results
+        context_window (int): Input and output tokens the model accepts
+        max_tokens (int): Output tokens reserved for the response
+
+    Returns:
+        ContextAllocation: Parts kept and the tokens allocated to each
+    """
+    started_at = time.perf_counter()
+    budget = context_window - max_tokens
+    # per message overhead learned by the estimator
+    overhead = round(token_estimator.ratios[-1])
+
+    tokens = {
+        "system_prompt": _count_system_prompt(system_prompt) + overhead,
+        "message": token_estimator.count(message_content) + overhead,
+        "history": sum(history_token_counts) + overhead * len(history_token_counts),
+        "images": IMAGE_TOKENS * image_count,
+        "text_context": token_estimator.count(text_context) if text_context else 0,
+        "web_result": token_estimator.count(web_result) if web_result else 0,
+    }
+    total = sum(tokens.values())
+    allocation = ContextAllocation(
+        fits=True,
+        text_context=text_context,
+        image_count=image_count,
+        web_result=web_result,
+        tokens=tokens,
+    )
+
+    # estimated counts close to the budget may be on either side of it
+    scale = 1.0
+    if token_estimator.is_uncertain(total, budget):
+        scale = 1.0 + token_estimator.error_bound
+    if total * scale <= budget:
+        logger.debug(
+            "Context budget allocated",
+            budget=budget,
+            total=total,
+            elapsed_ms=round((time.perf_counter() - started_at) * 1000, 3),
+        )
+        return allocation
+
+    remaining = budget / scale - tokens["system_prompt"] - tokens["message"]
+    if remaining < 0:
+        allocation.fits = False
+        logger.warning(
+            "Request exceeds the context window",
+            budget=budget,
+            system_prompt_tokens=tokens["system_prompt"],
+            message_tokens=tokens["message"],
+        )
+        return allocation
+
+    # whole turns from the newest, so the history still starts with a user message
+    kept = 0
+    start = len(history_token_counts)
+    while start >= 2:
+        turn = sum(history_token_counts[start - 2 : start]) + overhead * 2
+        if kept + turn > remaining:
+            break
+        kept += turn
+        start -= 2
+    if start > 0:
+        allocation.history_start = start
+        turns = start // 2
+        allocation.trimmed.append(
+            f"the {turns} oldest turns of the conversation" if turns > 1 else "the oldest turn of the conversation"
+        )
+    tokens["history"] = kept
+    remaining -= kept
+
+    allocation.image_count = min(image_count, max(int(remaining // IMAGE_TOKENS), 0))
+    if allocation.image_count < image_count:
+        allocation.trimmed.append(f"{image_count - allocation.image_count} of the attached images")
+    tokens["images"] = IMAGE_TOKENS * allocation.image_count
+    remaining -= tokens["images"]
+
+    for name, description in (("text_context", "the attached files"), ("web_result", "the web results")):
+        text = getattr(allocation, name)
+        if not text or tokens[name] <= remaining:
+            remaining -= tokens[name]
+            continue
+        if remaining < CONTEXT_BUDGET_MIN_TEXT_TOKENS:
+            setattr(allocation, name, None)
+            allocation.trimmed.append(description)
+            tokens[name] = 0
+            continue
+        setattr(allocation, name, _truncate(text, tokens[name], int(remaining)))
+        allocation.trimmed.append(f"the end of {description}")
+        tokens[name] = int(remaining)
+        remaining = 0
+
+    logger.info(
+        "Context budget trimmed the request",
+        budget=budget,
+        requested=total,
+        allocated=sum(tokens.values()),
+        tokens=tokens,
+        trimmed=allocation.trimmed,
+        uncertain=scale > 1.0,
+        elapsed_ms=round((time.perf_counter() - started_at) * 1000, 3),
+    )
+    return allocation
@@ -0,0 +1,140 @@
+import io
+import re
+import csv
+import json
+from typing import Any, Dict, List, Optional
+
+from src.constant import ContextEncoding
+from src.utils.token_estimator import token_estimator
+from src.utils.logger import logger
+
+Table = List[List[Optional[str]]]
+
+_TRAILING_SPACES = re.compile(r"[ \t]+\n")
+_INLINE_SPACES = re.compile(r"[ \t]{2,}")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def normalize_whitespace(text: str, collapse_spaces: bool = False) -> str:
+    """
+    Strip trailing spaces and collapse blank lines of the text.
+
+    Args:
+        text (str): Text to normalize
+        collapse_spaces (bool): Also collapse runs of spaces inside the lines (e.g. padded PDF layout text)
+
+    Returns:
+        str: Normalized text
+    """
+    text = _TRAILING_SPACES.sub("\n", text)
+    if collapse_spaces:
+        text = "\n".join(line.strip() for line in text.split("\n"))
+        text = _INLINE_SPACES.sub(" ", text)
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def encode_json(data: Any, encoding: ContextEncoding) -> str:
+    """
+    Serialize the JSON data for the model context.
+
+    Args:
+        data (Any): Parsed JSON data
+        encoding (ContextEncoding): Context encoding
+
+    Returns:
+        str: Serialized JSON string
+    """
+    if encoding == ContextEncoding.VERBOSE:
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_table(table: Table, encoding: ContextEncoding) -> List[str]:
+    """
+    Render an extracted table as lines for the model context.
+    The compact encoding renders CSV rows without cell padding and separators.
+
+    Args:
+        table (Table): Table rows extracted from the document
+        encoding (ContextEncoding): Context encoding
+
+    Returns:
+        List[str]: Rendered table lines
+    """
+    rows = [["" if cell is None else str(cell) for cell in row] for row in table]
+    if encoding == ContextEncoding.VERBOSE:
+        return [" | ".join(row) for row in rows] + ["-" * 40]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        if any(cell.strip() for cell in row):
+            writer.writerow([" ".join(cell.split()) for cell in row])
+    return [buffer.getvalue().rstrip("\n")]
+
+
+def encode_pdf_pages(pages: List[Dict[str, Any]], encoding: ContextEncoding) -> str:
+    """
+    Render the extracted PDF pages for the model context.
+
+    Args:
+        pages (List[Dict[str, Any]]): Extracted pages with page_num, text, tables and error
+        encoding (ContextEncoding): Context encoding
+
+    Returns:
+        str: Rendered PDF text, empty if nothing was extracted
+    """
+    verbose = encoding == ContextEncoding.VERBOSE
+    text_parts: List[str] = []
+    for page in pages:
+        page_num = page["page_num"]
+        if page["text"]:
+            if verbose:
+                text_parts.append(f"\n=== Page {page_num} ===\n")
+                text_parts.append(page["text"])
+            else:
+                text_parts.append(f"=== Page {page_num} ===")
+                text_parts.append(normalize_whitespace(page["text"], collapse_spaces=True))
+
+        if page["tables"]:
+            text_parts.append(
+                f"\n=== Page {page_num} tables ===\n" if verbose else f"=== Page {page_num} tables ==="
+            )
+            for table_num, table in enumerate(page["tables"], 1):
+                text_parts.append(f"\n[Table {table_num}]\n" if verbose else f"[Table {table_num}]")
+                text_parts.extend(encode_table(table, encoding))
+
+        if page["error"]:
+            text_parts.append(
+                f"\n[Error occurred while processing the page {page_num}: {page['error']}]\n"
+            )
+
+    return "\n".join(text_parts)
+
+
+def report_token_reduction(file_name: str, verbose_context: str, compact_context: str) -> int:
+    """
+    Log the token reduction of the compact encoding against the verbose encoding.
+    Both are sized with the token estimator, so a calibrated estimator tokenizes neither.
+
+    Args:
+        file_name (str): Name of the encoded file
+        verbose_context (str): Context in the verbose encoding
+        compact_context (str): Context in the compact encoding
+
+    Returns:
+        int: Number of tokens saved
+    """
+    verbose_tokens = token_estimator.count(verbose_context)
+    compact_tokens = token_estimator.count(compact_context)
+    saved_tokens = verbose_tokens - compact_tokens
+    logger.info(
+        "Context encoded",
+        file_name=file_name,
+        verbose_tokens=verbose_tokens,
+        compact_tokens=compact_tokens,
+        saved_tokens=saved_tokens,
+        reduction=f"{saved_tokens / verbose_tokens:.1%}" if verbose_tokens else "0.0%",
+        estimated=token_estimator.calibrated,
+    )
+    return saved_tokens
@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Any
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Tuple
 
-from strands.types.content import Message
+from src.utils.token_estimator import token_estimator
+
+if TYPE_CHECKING:
+    from strands.types.content import Message
 
 
 class MemoryManager(ABC):
@@ -54,31 +57,49 @@ class RecentMemoryManager(MemoryManager):
 
     def __init__(self):
         self._history: List[Message] = []
-
-    def add_user_message(self, message_content: str) -> None:
+        # ledgers aligned with the history, used for snapshots and cache point decisions
+        self._message_ids: List[Optional[str]] = []
+        self._token_counts: List[Optional[int]] = []
+
+    def _append(
+        self,
+        role: str,
+        text: str,
+        message_id: Optional[str] = None,
+        token_count: Optional[int] = None,
+    ) -> None:
         self._history.append(
             {
-                "role": "user",
-                "content": [{"text": message_content}],
+                "role": role,
+                "content": [{"text": text}],
             }
         )
+        self._message_ids.append(message_id)
+        self._token_counts.append(token_count)
 
-    def add_ai_message(self, user_message: str, ai_message: str) -> None:
+    def add_user_message(self, message_content: str) -> None:
+        self._append("user", message_content)
+
+    def add_ai_message(
+        self,
+        user_message: str,
+        ai_message: str,
+        message_ids: Optional[Tuple[str, str]] = None,
+    ) -> None:
+        """
+        Add AI response to memory.
+
+        Args:
+            user_message (str): User message content
+            ai_message (str): AI response content
+            message_ids (Optional[Tuple[str, str]]): Persisted ids of the user and AI messages
+        """
+        user_message_id, ai_message_id = message_ids or (None, None)
         # Append both for parity with previous behavior
-        self._history.append(
-            {
-                "role": "user",
-                "content": [{"text": user_message}],
-            }
-        )
-        self._history.append(
-            {
-                "role": "assistant",
-                "content": [{"text": ai_message}],
-            }
-        )
+        self._append("user", user_message, user_message_id)
+        self._append("assistant", ai_message, ai_message_id)
 
-    def get_conversation_history(self) -> List[Message]:
+    def get_conversation_history(self) -> List["Message"]:
         """
         Return the stored conversation history as a list of messages.
 
@@ -87,15 +108,34 @@ class RecentMemoryManager(MemoryManager):
         """
         return list(self._history)
 
+    def get_message_ids(self) -> List[Optional[str]]:
+        """
+        Return the persisted message ids aligned with the conversation history.
+
+        Returns:
+            List[Optional[str]]: Message ids, None for messages which are not persisted
+        """
+        return list(self._message_ids)
+
+    def get_token_counts(self) -> List[int]:
+        """
+        Return the token count of each message in the conversation history.
+        Counts are estimated once per message and kept in the ledger.
+
+        Returns:
+            List[int]: Token counts aligned with the conversation history
+        """
+        for i, token_count in enumerate(self._token_counts):
+            if token_count is None:
+                self._token_counts[i] = token_estimator.count(
+                    self._history[i]["content"][0]["text"]
+                )
+        return list(self._token_counts)
+
     def add_message_history(self, message_history: List[Dict[str, Any]]) -> None:
         """Add thread history into internal message list."""
         for item in message_history:
             role = item.get("role")
             content = item.get("content", "")
             if role in ("user", "assistant") and isinstance(content, str):
-                self._history.append(
-                    {
-                        "role": role,
-                        "content": [{"text": content}],
-                    }
-                )
+                self._append(role, content, item.get("id"), item.get("token_count"))
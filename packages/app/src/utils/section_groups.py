@@ -0,0 +1,103 @@
+import re
+import math
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from src.constant import SAVE_SECTION_DEFAULT_TOKENS
+from src.utils.token_estimator import token_estimator
+
+if TYPE_CHECKING:
+    from strands.types.content import Message
+
+SectionGroup = Tuple[str, ...]
+
+# the cowriter starts every message with the section it is working on, e.g. "## Section 3. Demo Scenario"
+_SECTION_HEADER = re.compile(r"Section\s+(\d+)")
+
+
+def find_section_number(content: str) -> Optional[int]:
+    """
+    Find the section an assistant message is working on from its header.
+
+    Args:
+        content (str): Assistant message content
+
+    Returns:
+        Optional[int]: Section number, None if the message has no section header
+    """
+    match = _SECTION_HEADER.search(content[:200])
+    return int(match.group(1)) if match else None
+
+
+def section_numbers(section_group: Sequence[str]) -> Tuple[int, ...]:
+    """Numbers of the sections of a group, e.g. ("Section 8", "Section 9") -> (8, 9)."""
+    return tuple(int(section.split()[-1]) for section in section_group)
+
+
+def estimate_section_tokens(recent_history: List["Message"]) -> Dict[int, int]:
+    """
+    Estimate the printed size of each section from its latest draft in the conversation.
+
+    Args:
+        recent_history (List[Message]): Conversation history
+
+    Returns:
+        Dict[int, int]: Estimated output tokens by section number, for the drafted sections
+    """
+    drafts: Dict[int, str] = {}
+    for message in recent_history:
+        if message["role"] != "assistant":
+            continue
+        text = "".join(block["text"] for block in message["content"] if "text" in block)
+        section = find_section_number(text)
+        if section is not None:
+            drafts[section] = text
+    return {section: token_estimator.count(text) for section, text in drafts.items()}
+
+
+def partition_sections(
+    sections: Sequence[int],
+    section_tokens: Dict[int, int],
+    parallelism: int,
+    max_group_tokens: int,
+) -> List[Tuple[int, ...]]:
+    """
+    Split the sections, in order, into contiguous groups with the smallest largest group.
+
+    As many groups as run in parallel are used, more when a group would not fit the output budget.
+
+    Args:
+        sections (Sequence[int]): Section numbers in document order
+        section_tokens (Dict[int, int]): Estimated output tokens by section number
+        parallelism (int): Groups printed at the same time
+        max_group_tokens (int): Output tokens a single group may need
+
+    Returns:
+        List[Tuple[int, ...]]: Section numbers of each group, in document order
+    """
+    if not sections:
+        return []
+
+    sizes = [section_tokens.get(section, SAVE_SECTION_DEFAULT_TOKENS) for section in sections]
+    count = len(sections)
+    groups = min(count, max(parallelism, math.ceil(sum(sizes) / max_group_tokens)))
+
+    prefix = [0] * (count + 1)
+    for i, size in enumerate(sizes):
+        prefix[i + 1] = prefix[i] + size
+
+    # best[k][i]: smallest largest group splitting the first i sections into k groups
+    best = [[math.inf] * (count + 1) for _ in range(groups + 1)]
+    split = [[0] * (count + 1) for _ in range(groups + 1)]
+    best[0][0] = 0
+    for k in range(1, groups + 1):
+        for i in range(k, count + 1):
+            for j in range(k - 1, i):
+                largest = max(best[k - 1][j], prefix[i] - prefix[j])
+                if largest < best[k][i]:
+                    best[k][i], split[k][i] = largest, j
+
+    bounds, end = [], count
+    for k in range(groups, 0, -1):
+        bounds.append((split[k][end], end))
+        end = split[k][end]
+    return [tuple(sections[start:stop]) for start, stop in reversed(bounds)]
@@ -1,11 +1,22 @@
-from typing import List, cast
+import json
+import zlib
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple, cast
 
 from chainlit.user_session import UserSession
 
+from src.constant import (
+    SESSION_STATE_FORMAT_VERSION,
+    SESSION_STATE_MAX_RETRIES,
+    PromptFamily,
+)
+from src.data.session_store import SessionStateConflictError, SessionStateStore
 from src.utils.memory import RecentMemoryManager
-from src.services.prompt_cache import PromptCacheService
+from src.services.prompt_cache import CachePlan, PromptCacheService, PromptCacheState
 from src.utils.logger import logger
 
+if TYPE_CHECKING:
+    from strands.types.content import Message
+
 
 def load_cache_point_indices(user_session: UserSession) -> List[int]:
     """Load the cache point indices from the user session.
@@ -32,37 +43,214 @@ def save_cache_point_indices(user_session: UserSession, cache_point_indices: Lis
     user_session.set("cache_point_indices", cache_point_indices or [])
 
 
-def create_latest_cache_point(user_session: UserSession, prompt_cache_service: PromptCacheService) -> int:
-    """Create a cache point at the end of the message history.
+def load_prompt_cache_state(user_session: UserSession) -> PromptCacheState:
+    """Load the prompt cache state from the user session, created on first use.
 
     Args:
         user_session (UserSession): User session
-        prompt_cache_service (PromptCacheService): Prompt cache service
 
     Returns:
-        int: Cache point index, -1 if no cache point should be created
+        PromptCacheState: Prompt cache state of the session
     """
-    cache_point_index = -1
+    state = user_session.get("prompt_cache_state")
+    if state is None:
+        # another worker may hold the cache, its cache points are kept as anchors without an expiry
+        state = PromptCacheState()
+        user_session.set("prompt_cache_state", state)
+    return state
+
+
+def build_cached_history(
+    user_session: UserSession,
+    prompt_cache_service: PromptCacheService,
+    family: PromptFamily,
+    upcoming_calls: int = 1,
+    history_start: int = 0,
+) -> Tuple[List["Message"], Optional[CachePlan]]:
+    """Plan the cache points of the next request and add them to the message history.
+
+    Args:
+        user_session (UserSession): User session
+        prompt_cache_service (PromptCacheService): Prompt cache service
+        family (PromptFamily): Prompt family of the request
+        upcoming_calls (int): Requests sent back to back with the same history, including this one
+        history_start (int): First history message sent, the older ones are trimmed to fit the context window
 
-    # Determine if a cache point should be created based on the entire message history
+    Returns:
+        Tuple[List[Message], Optional[CachePlan]]: Message history with cache points and their plan, None without history or when trimmed
+    """
     recent_memory = cast(
         RecentMemoryManager, user_session.get("recent_memory"),
     )
-    cache_point_indices = load_cache_point_indices(user_session)
     recent_history = recent_memory.get_conversation_history()
     if not recent_history:
-        logger.debug("No recent history found, skipping cache point creation")
+        logger.debug("No recent history found, skipping cache point planning")
+        return recent_history, None
+    if history_start:
+        # the trimmed prefix matches none of the tracked ones, so the request is neither planned nor recorded
+        logger.info("History trimmed, skipping cache point planning", history_start=history_start)
+        return recent_history[history_start:], None
+
+    state = load_prompt_cache_state(user_session)
+    anchors = load_cache_point_indices(user_session) if family == PromptFamily.COWRITER else []
+    plan = prompt_cache_service.plan_cache_points(
+        state,
+        family,
+        recent_memory.get_token_counts(),
+        anchors=anchors,
+        upcoming_calls=upcoming_calls,
+    )
+    prompt_cache_service.record_request(state, family, plan)
+    if family == PromptFamily.COWRITER:
+        save_cache_point_indices(user_session, plan.cache_point_indices)
+
+    return prompt_cache_service.add_cache_points_to_messages(
+        plan.cache_point_indices, recent_history
+    ), plan
+
+
+def encode_session_state(
+    recent_memory: RecentMemoryManager, cache_point_indices: List[int]
+) -> bytes:
+    """Serialize the memory and cache point indices into a compact column-oriented payload.
+
+    Args:
+        recent_memory (RecentMemoryManager): Recent memory
+        cache_point_indices (List[int]): Cache point indices
+
+    Returns:
+        bytes: Compressed session state
+    """
+    history = recent_memory.get_conversation_history()
+    payload = {
+        "f": SESSION_STATE_FORMAT_VERSION,
+        "r": "".join("u" if message["role"] == "user" else "a" for message in history),
+        "t": [message["content"][0]["text"] for message in history],
+        "i": recent_memory.get_message_ids(),
+        "n": recent_memory.get_token_counts(),
+        "c": list(cache_point_indices),
+    }
+    # level 1 keeps the encoding cheap, markdown drafts still shrink to about a third
+    return zlib.compress(
+        json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 1
+    )
+
+
+def decode_session_state(data: bytes) -> Tuple[RecentMemoryManager, List[int]]:
+    """Deserialize the session state.
+
+    Args:
+        data (bytes): Compressed session state
+
+    Returns:
+        Tuple[RecentMemoryManager, List[int]]: Memory and cache point indices
+
+    Raises:
+        ValueError: If the payload was written in another format version
+    """
+    payload = json.loads(zlib.decompress(data))
+    if payload.get("f") != SESSION_STATE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported session state format: {payload.get('f')}")
+
+    recent_memory = RecentMemoryManager()
+    recent_memory.add_message_history(
+        [
+            {
+                "role": "user" if role == "u" else "assistant",
+                "content": text,
+                "id": message_id,
+                "token_count": token_count,
+            }
+            for role, text, message_id, token_count in zip(
+                payload["r"], payload["t"], payload["i"], payload["n"]
+            )
+        ]
+    )
+    return recent_memory, payload["c"]
+
+
+async def load_session_state(
+    user_session: UserSession, store: Optional[SessionStateStore], key: Optional[str]
+) -> bool:
+    """Replace the memory in the user session with the stored state when another worker updated it.
+
+    Args:
+        user_session (UserSession): User session
+        store (Optional[SessionStateStore]): Session state store, None if disabled
+        key (Optional[str]): Session state key, the thread id
+
+    Returns:
+        bool: True if the user session was updated from the store
+    """
+    if not store or not key:
+        return False
+
+    try:
+        record = await store.get(key)
+        if record is None:
+            return False
+
+        version, data = record
+        if version == user_session.get("session_state_version", 0):
+            return False
+
+        recent_memory, cache_point_indices = decode_session_state(data)
+    except Exception as e:
+        logger.warning("Failed to load session state", key=key, error=e)
+        return False
+
+    user_session.set("recent_memory", recent_memory)
+    save_cache_point_indices(user_session, cache_point_indices)
+    user_session.set("session_state_version", version)
+    logger.info("Loaded session state", key=key, version=version)
+    return True
+
+
+async def commit_session_state(
+    user_session: UserSession,
+    store: Optional[SessionStateStore],
+    key: Optional[str],
+    apply: Optional[Callable[[UserSession], None]] = None,
+) -> None:
+    """Apply the update to the user session and write the state to the store.
+    On a version conflict the newer state is loaded and the update is applied again on top of it.
+
+    Args:
+        user_session (UserSession): User session
+        store (Optional[SessionStateStore]): Session state store, None if disabled
+        key (Optional[str]): Session state key, the thread id
+        apply (Optional[Callable[[UserSession], None]]): Update of the memory and cache points
+
+    Returns:
+        None
+    """
+    if apply:
+        apply(user_session)
+    if not store or not key:
         return
 
-    if prompt_cache_service.should_create_cache_point(cache_point_indices, recent_history):
-        # Create cache point at the end of the message history
-        new_cache_point_indices = prompt_cache_service.create_cache_point(
-            history_index=len(recent_history) - 1,
-            cache_point_indices=cache_point_indices,
+    for attempt in range(SESSION_STATE_MAX_RETRIES):
+        recent_memory = cast(RecentMemoryManager, user_session.get("recent_memory"))
+        data = encode_session_state(
+            recent_memory, load_cache_point_indices(user_session)
         )
-        save_cache_point_indices(user_session, new_cache_point_indices)
-        cache_point_index = new_cache_point_indices[-1]
-        logger.info("Created cache point at index",
-                    cache_point_index=cache_point_index)
+        try:
+            version = await store.put(
+                key, data, user_session.get("session_state_version", 0)
+            )
+            user_session.set("session_state_version", version)
+            logger.debug("Saved session state", key=key, version=version, size=len(data))
+            return
+        except SessionStateConflictError:
+            logger.info("Session state conflict, reapplying", key=key, attempt=attempt)
+            if not await load_session_state(user_session, store, key):
+                # the stored state expired, write it again from scratch
+                user_session.set("session_state_version", 0)
+                continue
+            if apply:
+                apply(user_session)
+        except Exception as e:
+            logger.warning("Failed to save session state", key=key, error=e)
+            return
 
-    return cache_point_index
+    logger.error("Giving up saving session state", key=key)
@@ -0,0 +1,111 @@
+import re
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from strands.types.content import Message
+
+
+# the section printer outputs only this message when a requested section is incomplete
+STOP_MESSAGE_PREFIX = "Stop printing on Section"
+
+_LEADING_CHARS = " \t\r\n\"'`>*#"
+_SECTION_NUMBER = re.compile(r"\s*(\d+)(\D)")
+_PARTIAL_SECTION_NUMBER = re.compile(r"\s*\d*")
+_SECTION_MENTION = r"Section\s+{number}\b"
+
+
+class StopMessageDetector:
+    """
+    Detects the stop message at the beginning of a section printer stream.
+
+    The beginning of the stream is held back while it can still turn into the stop message,
+    so nothing of the stop message reaches the user.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._decided = False
+        self.incomplete_section: Optional[int] = None
+
+    def feed(self, chunk: str) -> str:
+        """
+        Feed a streamed chunk.
+
+        Args:
+            chunk (str): Streamed chunk
+
+        Returns:
+            str: Text which is safe to emit, empty while the beginning is held back or after the stop message
+        """
+        if self._decided:
+            return "" if self.incomplete_section is not None else chunk
+
+        self._buffer += chunk
+        head = self._buffer.lstrip(_LEADING_CHARS)
+        if len(head) < len(STOP_MESSAGE_PREFIX):
+            if STOP_MESSAGE_PREFIX.startswith(head):
+                return ""
+            return self._release()
+
+        if not head.startswith(STOP_MESSAGE_PREFIX):
+            return self._release()
+
+        rest = head[len(STOP_MESSAGE_PREFIX):]
+        match = _SECTION_NUMBER.match(rest)
+        if match:
+            self._decided = True
+            self.incomplete_section = int(match.group(1))
+            return ""
+        if _PARTIAL_SECTION_NUMBER.fullmatch(rest):
+            return ""
+        return self._release()
+
+    def flush(self) -> str:
+        """
+        Flush the held back text at the end of the stream.
+
+        Returns:
+            str: Remaining text, empty if the stream was the stop message
+        """
+        if self._decided:
+            return ""
+
+        head = self._buffer.lstrip(_LEADING_CHARS)
+        match = re.fullmatch(r"\s*(\d+)\s*", head[len(STOP_MESSAGE_PREFIX):])
+        if head.startswith(STOP_MESSAGE_PREFIX) and match:
+            self._decided = True
+            self.incomplete_section = int(match.group(1))
+            return ""
+        return self._release()
+
+    def _release(self) -> str:
+        self._decided = True
+        text, self._buffer = self._buffer, ""
+        return text
+
+
+def find_missing_section(
+    recent_history: List["Message"], sections: Iterable[str]
+) -> Optional[int]:
+    """
+    Find the first section which is never mentioned in the conversation.
+    The section printer would only output the stop message for it, so there is no need to call the model.
+
+    Args:
+        recent_history (List[Message]): Conversation history
+        sections (Iterable[str]): Sections to print, e.g. "Section 7"
+
+    Returns:
+        Optional[int]: Number of the first missing section, None if every section is mentioned
+    """
+    conversation = "\n".join(
+        block["text"]
+        for message in recent_history
+        for block in message["content"]
+        if "text" in block
+    )
+    for section in sections:
+        number = int(section.split()[-1])
+        if not re.search(_SECTION_MENTION.format(number=number), conversation):
+            return number
+    return None
@@ -0,0 +1,194 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+from chainlit.context import context
+from chainlit.data import get_data_layer
+from chainlit.types import ThreadDict
+from chainlit.user_session import UserSession
+
+from src.constant import MEMORY_SNAPSHOT_KEY, MEMORY_SNAPSHOT_VERSION
+from src.utils.memory import RecentMemoryManager
+from src.utils.session import load_cache_point_indices
+from src.utils.logger import logger
+
+HISTORY_STEP_ROLES = {
+    "user_message": "user",
+    "assistant_message": "assistant",
+}
+
+
+def is_history_step(step: Dict[str, Any]) -> bool:
+    """Check if the thread step belongs to the conversation history.
+
+    Args:
+        step (Dict[str, Any]): Thread step
+
+    Returns:
+        bool: True if the step is a user or assistant message of the conversation
+    """
+    # skip messages with exclude_from_history metadata
+    if (step.get("metadata") or {}).get("exclude_from_history", False):
+        return False
+    # skip empty and error messages
+    if not step.get("output") or step.get("isError"):
+        return False
+    return step.get("type") in HISTORY_STEP_ROLES
+
+
+def load_message_history(thread: ThreadDict) -> List[Dict[str, Any]]:
+    """Rebuild the message history from every step of the thread.
+
+    Args:
+        thread (ThreadDict): Resumed thread
+
+    Returns:
+        List[Dict[str, Any]]: Message history with role, content and id
+    """
+    message_history = []
+    for step in thread["steps"]:
+        if not is_history_step(step):
+            logger.debug(
+                "Skipping step",
+                step_type=step.get("type"),
+                output=(step.get("output") or "")[:50],
+            )
+            continue
+
+        message_history.append(
+            {
+                "role": HISTORY_STEP_ROLES[step["type"]],
+                "content": step["output"],
+                "id": step["id"],
+            }
+        )
+    return message_history
+
+
+def create_memory_snapshot(
+    recent_memory: RecentMemoryManager, cache_point_indices: List[int]
+) -> Optional[Dict[str, Any]]:
+    """Create a compact snapshot of the memory, token ledger and cache point indices.
+    Messages are referenced by their step ids, the contents are read from the thread steps on resume.
+
+    Args:
+        recent_memory (RecentMemoryManager): Recent memory
+        cache_point_indices (List[int]): Cache point indices
+
+    Returns:
+        Optional[Dict[str, Any]]: Snapshot, None if some messages are not persisted
+    """
+    message_ids = recent_memory.get_message_ids()
+    if not all(message_ids):
+        return None
+
+    return {
+        "version": MEMORY_SNAPSHOT_VERSION,
+        "message_ids": message_ids,
+        "token_counts": recent_memory.get_token_counts(),
+        "cache_point_indices": list(cache_point_indices),
+    }
+
+
+def restore_memory_snapshot(
+    thread: ThreadDict,
+) -> Optional[Tuple[RecentMemoryManager, List[int]]]:
+    """Restore the memory and cache point indices from the snapshot in the thread metadata.
+
+    Args:
+        thread (ThreadDict): Resumed thread
+
+    Returns:
+        Optional[Tuple[RecentMemoryManager, List[int]]]: Memory and cache point indices, None if the snapshot is missing or stale
+    """
+    metadata = thread.get("metadata") or {}
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+
+    snapshot = metadata.get(MEMORY_SNAPSHOT_KEY)
+    if not snapshot:
+        logger.info("Memory snapshot not found", thread_id=thread["id"])
+        return None
+
+    if int(snapshot.get("version", 0)) != MEMORY_SNAPSHOT_VERSION:
+        logger.info(
+            "Memory snapshot version mismatch",
+            thread_id=thread["id"],
+            version=snapshot.get("version"),
+        )
+        return None
+
+    message_ids = cast(List[str], snapshot.get("message_ids", []))
+    token_counts = snapshot.get("token_counts", [])
+    steps = {step["id"]: step for step in thread["steps"]}
+
+    # the snapshot is stale if a history message was persisted after it
+    last_history_step = next(
+        (step for step in reversed(thread["steps"]) if is_history_step(step)), None
+    )
+    last_history_step_id = last_history_step["id"] if last_history_step else None
+    last_message_id = message_ids[-1] if message_ids else None
+    if last_history_step_id != last_message_id or len(token_counts) != len(message_ids):
+        logger.info("Memory snapshot is stale", thread_id=thread["id"])
+        return None
+
+    message_history = []
+    for message_id, token_count in zip(message_ids, token_counts):
+        step = steps.get(message_id)
+        if not step or step.get("type") not in HISTORY_STEP_ROLES:
+            logger.info(
+                "Memory snapshot references a missing step",
+                thread_id=thread["id"],
+                step_id=message_id,
+            )
+            return None
+
+        message_history.append(
+            {
+                "role": HISTORY_STEP_ROLES[step["type"]],
+                "content": step["output"],
+                "id": message_id,
+                "token_count": int(token_count),
+            }
+        )
+
+    recent_memory = RecentMemoryManager()
+    recent_memory.add_message_history(message_history)
+    cache_point_indices = [int(i) for i in snapshot.get("cache_point_indices", [])]
+    return recent_memory, cache_point_indices
+
+
+async def persist_memory_snapshot(user_session: UserSession) -> None:
+    """Save the memory snapshot into the user session and the thread metadata.
+
+    Args:
+        user_session (UserSession): User session
+
+    Returns:
+        None
+    """
+    recent_memory = cast(RecentMemoryManager, user_session.get("recent_memory"))
+    snapshot = create_memory_snapshot(
+        recent_memory, load_cache_point_indices(user_session)
+    )
+    if snapshot is None:
+        logger.debug("Memory is not fully persisted, skipping snapshot")
+        return
+
+    # the user session is persisted into the thread metadata by Chainlit as well
+    user_session.set(MEMORY_SNAPSHOT_KEY, snapshot)
+
+    data_layer = get_data_layer()
+    thread_id = context.session.thread_id
+    if not data_layer or not thread_id:
+        return
+
+    try:
+        if hasattr(data_layer, "update_thread_metadata"):
+            # only the snapshot changes each turn, written off the event loop
+            await data_layer.update_thread_metadata(thread_id, MEMORY_SNAPSHOT_KEY, snapshot)
+        else:
+            await data_layer.update_thread(
+                thread_id=thread_id, metadata=context.session.to_persistable()
+            )
+    except Exception as e:
+        logger.warning("Failed to persist memory snapshot", error=e)
@@ -0,0 +1,61 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from src.utils.logger import logger
+
+
+class ThreadTurnQueue:
+    """
+    Ordered queue of the turns of each conversation.
+
+    Turns of one thread run one at a time in arrival order, asyncio.Lock wakes its waiters first in first out.
+    Each thread has its own lock, so other conversations are never blocked.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # running and waiting turns per thread
+        self._depths: Dict[str, int] = {}
+
+    def depth(self, thread_id: str) -> int:
+        """
+        Return the number of running and waiting turns of the thread.
+
+        Args:
+            thread_id (str): Thread id
+
+        Returns:
+            int: Queue depth of the thread
+        """
+        return self._depths.get(thread_id, 0)
+
+    @asynccontextmanager
+    async def turn(
+        self,
+        thread_id: str,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> AsyncIterator[None]:
+        """
+        Wait for the previous turns of the thread and hold the thread until the block exits.
+
+        Args:
+            thread_id (str): Thread id
+            on_queued (Optional[Callable[[int], Awaitable[None]]]): Called with the number of turns ahead when the turn has to wait
+        """
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        ahead = self.depth(thread_id)
+        self._depths[thread_id] = ahead + 1
+        try:
+            if ahead:
+                logger.info("Turn queued", thread_id=thread_id, ahead=ahead)
+                if on_queued:
+                    await on_queued(ahead)
+            async with lock:
+                yield
+        finally:
+            self._depths[thread_id] -= 1
+            if not self._depths[thread_id]:
+                # nobody holds or waits for the lock anymore
+                del self._depths[thread_id]
+                del self._locks[thread_id]
@@ -1,12 +1,74 @@
+import os
+import time
+import threading
 import traceback
+from typing import Optional
 
 import tiktoken
 
+from src.config import config
+from src.constant import TOKENIZER_RETRY_DELAY, TOKENIZER_RETRY_MAX_DELAY
 from src.utils.logger import logger
 
 # Claude models use the cl100k_base encoding
 ENCODING_NAME = "cl100k_base"
 
+_encoding: Optional[tiktoken.Encoding] = None
+# monotonic time before which a failed load is not retried, and the delay of the next retry
+_retry_at = 0.0
+_retry_delay = TOKENIZER_RETRY_DELAY
+_encoding_lock = threading.Lock()
+
+
+def load_encoding() -> Optional[tiktoken.Encoding]:
+    """
+    Load the tiktoken encoding once, preferring the data bundled with the app.
+    A failed load is retried after a doubling delay, so the network is not hit again on every count.
+
+    Returns:
+        Optional[tiktoken.Encoding]: The encoding, None if it could not be loaded
+    """
+    global _encoding, _retry_at, _retry_delay
+
+    if _encoding is not None or time.monotonic() < _retry_at:
+        return _encoding
+
+    with _encoding_lock:
+        if _encoding is not None or time.monotonic() < _retry_at:
+            return _encoding
+
+        # tiktoken reads its data from the cache directory before downloading it,
+        # the Docker image fills the bundled directory at build time
+        if config.tokenizer_data_dir:
+            os.environ.setdefault("TIKTOKEN_CACHE_DIR", config.tokenizer_data_dir)
+
+        started_at = time.perf_counter()
+        try:
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+            logger.info(
+                "Tokenizer loaded",
+                encoding=ENCODING_NAME,
+                data_dir=os.environ.get("TIKTOKEN_CACHE_DIR"),
+                elapsed_ms=round((time.perf_counter() - started_at) * 1000, 1),
+            )
+        except Exception:
+            _retry_at = time.monotonic() + _retry_delay
+            logger.warning(
+                "Error on loading the tokenizer, token counts are approximated",
+                encoding=ENCODING_NAME,
+                data_dir=os.environ.get("TIKTOKEN_CACHE_DIR"),
+                retry_in=_retry_delay,
+                traceback=traceback.format_exc(),
+            )
+            _retry_delay = min(_retry_delay * 2, TOKENIZER_RETRY_MAX_DELAY)
+        return _encoding
+
+
+def warmup_tokenizer() -> None:
+    """Load the encoding ahead of the first count, blocking."""
+    if load_encoding() is None:
+        raise RuntimeError(f"Tokenizer {ENCODING_NAME} is not available")
+
 
 def count_tokens(text: str) -> int:
     """
@@ -18,15 +80,16 @@ def count_tokens(text: str) -> int:
     Returns:
         int: The number of tokens in the text
     """
-    try:
-        # Get the encoding for Claude models
-        encoding = tiktoken.get_encoding(ENCODING_NAME)
+    encoding = load_encoding()
+    if encoding is None:
+        # Fallback to approximate count if encoding fails
+        return len(text) // 4  # Rough approximation
 
+    try:
         # Count tokens
         tokens = encoding.encode(text)
         return len(tokens)
     except Exception:
         logger.warning("Error on counting tokens",
                        traceback=traceback.format_exc())
-        # Fallback to approximate count if encoding fails
         return len(text) // 4  # Rough approximation
@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import traceback
+from collections import deque
+from typing import Deque, List, Optional, Sequence, Tuple
+
+from src.config import config
+from src.constant import (
+    TOKEN_ESTIMATOR_DECAY,
+    TOKEN_ESTIMATOR_ERROR_WINDOW,
+    TOKEN_ESTIMATOR_MIN_SAMPLES,
+    TOKEN_ESTIMATOR_PRIOR,
+    TOKEN_ESTIMATOR_PRIOR_WEIGHT,
+    TOKEN_ESTIMATOR_SAVE_INTERVAL,
+)
+from src.utils.token_counter import count_tokens
+from src.utils.logger import logger
+
+CALIBRATION_VERSION = 1
+# scripts the ratios are learned for, followed by the per message overhead
+FEATURES: Tuple[str, ...] = ("latin", "hangul", "cjk", "other", "message")
+
+_HANGUL = re.compile("[\u1100-\u11ff\u3130-\u318f\uac00-\ud7a3]")
+_CJK = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def script_counts(text: str) -> Tuple[int, int, int, int]:
+    """
+    Count the characters of each script in the text.
+
+    Args:
+        text (str): Text to count
+
+    Returns:
+        Tuple[int, int, int, int]: Latin (ASCII), hangul, CJK and other characters
+    """
+    if text.isascii():
+        return len(text), 0, 0, 0
+    latin = len(text.encode("ascii", "ignore"))
+    hangul = len(_HANGUL.findall(text))
+    cjk = len(_CJK.findall(text))
+    return latin, hangul, cjk, len(text) - latin - hangul - cjk
+
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """Solve the small linear system with Gauss-Jordan elimination and partial pivoting."""
+    size = len(vector)
+    rows = [row[:] + [value] for row, value in zip(matrix, vector)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda row: abs(rows[row][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for row in range(size):
+            if row != col and rows[row][col]:
+                factor = rows[row][col] / rows[col][col]
+                rows[row] = [a - factor * b for a, b in zip(rows[row], rows[col])]
+    return [rows[i][size] / rows[i][i] for i in range(size)]
+
+
+class TokenEstimator:
+    """
+    Estimates Claude token counts from the number of characters of each script.
+
+    The tokens per character of each script and the per message overhead are fitted with
+    decayed least squares against the token counts in the usage metadata of the model,
+    regularized towards the prior ratios. The relative errors of the recent predictions
+    give the error bound. They are measured on whole requests, system prompt and history
+    included, so the bound holds for request-sized texts and not for a single short message.
+    Until enough errors are measured and the bound is within the tolerance, count() is exact.
+    Each worker learns on its own and the latest write of the calibration file wins.
+    """
+
+    def __init__(self, calibration_path: Optional[str] = None, tolerance: float = 0.05):
+        """
+        Args:
+            calibration_path (Optional[str]): JSON file the calibration is persisted to, None keeps it in memory
+            tolerance (float): Largest error bound the estimates are used with
+        """
+        self.calibration_path = calibration_path
+        self.tolerance = tolerance
+        size = len(FEATURES)
+        # decayed normal equations of the observations
+        self._xtx: List[List[float]] = [[0.0] * size for _ in range(size)]
+        self._xty: List[float] = [0.0] * size
+        self._errors: Deque[float] = deque(maxlen=TOKEN_ESTIMATOR_ERROR_WINDOW)
+        self.observations = 0
+        self.ratios: List[float] = [TOKEN_ESTIMATOR_PRIOR[feature] for feature in FEATURES]
+        self.error_bound: Optional[float] = None
+
+        if calibration_path:
+            self._load()
+
+    @property
+    def calibrated(self) -> bool:
+        """True if the error bound is measured and within the tolerance."""
+        return self.error_bound is not None and self.error_bound <= self.tolerance
+
+    def estimate(self, text: str) -> int:
+        """
+        Estimate the token count of the text with the calibrated ratios.
+
+        Args:
+            text (str): Text to estimate
+
+        Returns:
+            int: Estimated token count
+        """
+        counts = script_counts(text)
+        return round(sum(ratio * count for ratio, count in zip(self.ratios, counts)))
+
+    def count(self, text: str) -> int:
+        """
+        Estimate the token count while calibrated, count exactly otherwise.
+
+        The error bound is measured on whole requests, a short text alone may be off by more.
+
+        Args:
+            text (str): Text to count
+
+        Returns:
+            int: Token count
+        """
+        if not self.calibrated:
+            return count_tokens(text)
+        return self.estimate(text)
+
+    def is_uncertain(self, counted_tokens: int, threshold: int) -> bool:
+        """
+        Check whether the threshold lies within the error bound of a token count from count().
+
+        Args:
+            counted_tokens (int): Token count returned by count()
+            threshold (int): Token threshold of the decision
+
+        Returns:
+            bool: True if the decision needs an exact count, never when uncalibrated as count() was exact
+        """
+        if not self.calibrated:
+            return False
+        margin = counted_tokens * self.error_bound
+        return counted_tokens - margin < threshold <= counted_tokens + margin
+
+    def observe(self, texts: Sequence[str], messages: int, tokens: int) -> None:
+        """
+        Calibrate the ratios with the token count the model reported for the texts.
+
+        Args:
+            texts (Sequence[str]): Texts the model counted
+            messages (int): Number of messages and system prompts the texts were sent in
+            tokens (int): Token count reported in the usage metadata
+        """
+        if tokens <= 0:
+            return
+
+        features = [0.0] * len(FEATURES)
+        for text in texts:
+            for i, count in enumerate(script_counts(text)):
+                features[i] += count
+        features[-1] = messages
+
+        predicted = sum(ratio * feature for ratio, feature in zip(self.ratios, features))
+        self._errors.append(abs(predicted - tokens) / tokens)
+
+        for i, feature in enumerate(features):
+            self._xty[i] = self._xty[i] * TOKEN_ESTIMATOR_DECAY + feature * tokens
+            for j, other in enumerate(features):
+                self._xtx[i][j] = self._xtx[i][j] * TOKEN_ESTIMATOR_DECAY + feature * other
+        self.observations += 1
+        self._fit()
+
+        if self.calibration_path and self.observations % TOKEN_ESTIMATOR_SAVE_INTERVAL == 0:
+            self.save()
+
+    def save(self) -> None:
+        """Write the calibration to the calibration file."""
+        if not self.calibration_path or not self.observations:
+            return
+
+        calibration = {
+            "version": CALIBRATION_VERSION,
+            "features": list(FEATURES),
+            "observations": self.observations,
+            "xtx": self._xtx,
+            "xty": self._xty,
+            "errors": list(self._errors),
+        }
+        try:
+            os.makedirs(os.path.dirname(self.calibration_path) or ".", exist_ok=True)
+            temp_path = f"{self.calibration_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(calibration, f)
+            os.replace(temp_path, self.calibration_path)
+        except Exception:
+            logger.warning(
+                "Error saving the token calibration",
+                calibration_path=self.calibration_path,
+                traceback=traceback.format_exc(),
+            )
+
+    def _load(self) -> None:
+        if not os.path.exists(self.calibration_path):
+            return
+
+        try:
+            with open(self.calibration_path, "r", encoding="utf-8") as f:
+                calibration = json.load(f)
+            if (
+                calibration.get("version") != CALIBRATION_VERSION
+                or calibration.get("features") != list(FEATURES)
+            ):
+                logger.info("Token calibration outdated, starting over")
+                return
+            self._xtx = [[float(value) for value in row] for row in calibration["xtx"]]
+            self._xty = [float(value) for value in calibration["xty"]]
+            self._errors.extend(float(error) for error in calibration["errors"])
+            self.observations = int(calibration["observations"])
+        except Exception:
+            logger.warning(
+                "Error loading the token calibration, starting over",
+                calibration_path=self.calibration_path,
+                traceback=traceback.format_exc(),
+            )
+            return
+
+        self._fit()
+        logger.info(
+            "Token calibration loaded",
+            observations=self.observations,
+            ratios=dict(zip(FEATURES, self.ratios)),
+            error_bound=self.error_bound,
+            calibrated=self.calibrated,
+        )
+
+    def _fit(self) -> None:
+        # the prior enters as pseudo observations of each feature, so unseen scripts keep their prior ratio
+        matrix = [row[:] for row in self._xtx]
+        vector = self._xty[:]
+        for i, feature in enumerate(FEATURES):
+            weight = TOKEN_ESTIMATOR_PRIOR_WEIGHT[feature]
+            matrix[i][i] += weight * weight
+            vector[i] += weight * weight * TOKEN_ESTIMATOR_PRIOR[feature]
+        self.ratios = [max(ratio, 0.0) for ratio in _solve(matrix, vector)]
+
+        if len(self._errors) >= TOKEN_ESTIMATOR_MIN_SAMPLES:
+            errors = sorted(self._errors)
+            self.error_bound = errors[min(int(len(errors) * 0.95), len(errors) - 1)]
+
+
+token_estimator = TokenEstimator(config.token_calibration_path or None, config.token_estimator_tolerance)
@@ -0,0 +1,59 @@
+import time
+import asyncio
+import traceback
+from typing import Callable, Dict, Optional
+
+from src.utils.logger import logger
+
+
+class StartupWarmup:
+    """
+    Loads the cold-path resources in the background, so the first user does not wait for them.
+
+    Steps are blocking callables and run one after another in a worker thread.
+    A failed step is logged and reported, the app still serves requests and loads it again on demand.
+    """
+
+    def __init__(self, steps: Dict[str, Callable[[], object]]):
+        """
+        Args:
+            steps (Dict[str, Callable[[], object]]): Blocking warmup steps by name, run in order
+        """
+        self.steps = steps
+        # pending, done or failed per step
+        self.status: Dict[str, str] = {name: "pending" for name in steps}
+        self.ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Schedule the warmup on the running event loop, once."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        started_at = time.perf_counter()
+        for name, step in self.steps.items():
+            step_started_at = time.perf_counter()
+            try:
+                await asyncio.to_thread(step)
+                self.status[name] = "done"
+            except Exception:
+                self.status[name] = "failed"
+                logger.warning(
+                    "Warmup step failed",
+                    step=name,
+                    traceback=traceback.format_exc(),
+                )
+            logger.info(
+                "Warmup step finished",
+                step=name,
+                status=self.status[name],
+                elapsed_ms=round((time.perf_counter() - step_started_at) * 1000, 1),
+            )
+
+        self.ready.set()
+        logger.info(
+            "Warmup finished",
+            status=self.status,
+            elapsed_ms=round((time.perf_counter() - started_at) * 1000, 1),
+        )